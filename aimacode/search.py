@@ -6,16 +6,25 @@ functions."""
 
 from .utils import (
     is_in, argmin, argmax, argmax_random_tie, probability,
-    weighted_sample_with_replacement, memoize, print_table, DataFile, Stack,
+    weighted_sample_with_replacement, memoize, memoize_lru, HyperLogLog, print_table,
+    DataFile, Stack,
     FIFOQueue, PriorityQueue, name
 )
 from .grid import distance
 
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
+import functools
+import inspect
 import math
 import random
 import sys
 import bisect
+import time
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
 
 infinity = float('inf')
 
@@ -71,6 +80,38 @@ class Problem(object):
         """For optimization problems, each state has a value.  Hill-climbing
         and related algorithms try to maximize this value."""
         raise NotImplementedError
+
+    def cached_heuristic(self, h, maxsize=None, name=None):
+        """Return h memoized on node.state in an LRUCache of at most maxsize
+        entries, kept in self.heuristic_caches under name (by default the
+        __name__ of h) for its hit and miss counts.  Unlike memoize(h, 'h'),
+        which caches on each Node, this also serves a state reached again
+        through another node, as happens constantly in RBFS.  A heuristic
+        marked path_dependent would be served a value computed for another
+        path, so it raises ValueError."""
+        if is_path_dependent(h):
+            raise ValueError("heuristic {} depends on the path to a node, not only "
+                             "its state, and cannot be cached by state".format(
+                                 name or getattr(h, '__name__', 'h')))
+        cached = memoize_lru(h, lambda node: node.state, maxsize)
+        if getattr(self, 'heuristic_caches', None) is None:
+            self.heuristic_caches = OrderedDict()
+        self.heuristic_caches[name or getattr(h, '__name__', 'h')] = cached.cache
+        return cached
+
+
+def path_dependent(h):
+    """Mark the heuristic function (or method) h as depending on the path to
+    a node and not only on its state, such as a landmark count, so that
+    cached_heuristic refuses to cache it by state."""
+    h.path_dependent = True
+    return h
+
+
+def is_path_dependent(h):
+    "Whether h was marked with path_dependent."
+    return getattr(h, 'path_dependent', False)
+
 # ______________________________________________________________________________
 
 
@@ -83,7 +124,15 @@ class Node:
     the total path_cost (also known as g) to reach the node.  Other functions
     may add an f and h value; see best_first_graph_search and astar_search for
     an explanation of how the f and h values are handled. You will not need to
-    subclass this class."""
+    subclass this class.
+
+    Nodes have __slots__ rather than a __dict__, since searches keep very many
+    of them; f and h (set by memoize) are slots that stay unset until
+    assigned.  Nodes can be weakly referenced, so a heuristic can keep its
+    own per-node data without keeping the nodes alive."""
+
+    __slots__ = ('state', 'parent', 'action', 'path_cost', 'depth',
+                 'f', 'h', '__weakref__')
 
     def __init__(self, state, parent=None, action=None, path_cost=0):
         "Create a search tree Node, derived from a parent by an action."
@@ -109,7 +158,7 @@ class Node:
     def child_node(self, problem, action):
         "[Figure 3.10]"
         next = problem.result(self.state, action)
-        return Node(next, self, action,
+        return type(self)(next, self, action,
                     problem.path_cost(self.path_cost, self.state,
                                       action, next))
 
@@ -169,11 +218,131 @@ class SimpleProblemSolvingAgentProgram:
     def search(self, problem):
         raise NotImplementedError
 
+# ______________________________________________________________________________
+# Search budgets
+
+
+class BudgetExhausted(Exception):
+
+    """Raised inside a search when its SearchBudget runs out, and returned
+    (not raised) by the search entry points as their result.  Carries the
+    partial statistics of the abandoned search."""
+
+    def __init__(self, reason, expansions, peak_frontier, elapsed, memory=None):
+        self.reason = reason
+        self.expansions = expansions
+        self.peak_frontier = peak_frontier
+        self.elapsed = elapsed
+        self.memory = memory
+        super().__init__(reason, expansions, peak_frontier, elapsed, memory)
+
+    def __repr__(self):
+        return '<BudgetExhausted {} after {} expansions>'.format(
+            self.reason, self.expansions)
+
+    def __str__(self):
+        return ('{} budget exhausted after {} expansions, {:.3f}s, '
+                'peak frontier {}'.format(self.reason, self.expansions,
+                                          self.elapsed, self.peak_frontier))
+
+
+def resident_memory():
+    """Return the current resident set size of this process in bytes, or None
+    if it cannot be determined."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except (OSError, IndexError, ValueError, AttributeError):
+        pass
+    if resource is None:
+        return None
+    # ru_maxrss is the peak (not current) size, in kilobytes on Linux and
+    # bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class SearchBudget:
+
+    """Cooperative limits on a single search run.  Any limit left as None is
+    not enforced.  The search calls expand() once per node expansion with the
+    current frontier size; when a limit is exceeded BudgetExhausted is raised
+    and the search entry point returns it instead of a solution.
+
+    max_memory is in megabytes of resident memory.  Memory is sampled only
+    every check_interval expansions since reading it costs a system call."""
+
+    def __init__(self, max_expansions=None, max_frontier=None,
+                 max_seconds=None, max_memory=None, check_interval=256):
+        self.max_expansions = max_expansions
+        self.max_frontier = max_frontier
+        self.max_seconds = max_seconds
+        self.max_memory = max_memory
+        self.check_interval = check_interval
+        self.expansions = 0
+        self.peak_frontier = 0
+        self.started = None
+
+    def start(self):
+        "Start the clock; later calls (e.g. from nested searches) are no-ops."
+        if self.started is None:
+            self.started = time.perf_counter()
+
+    @property
+    def elapsed(self):
+        if self.started is None:
+            return 0.0
+        return time.perf_counter() - self.started
+
+    def expand(self, frontier_size=0):
+        """Account for one node expansion, raising BudgetExhausted if any limit
+        has been exceeded."""
+        if frontier_size > self.peak_frontier:
+            self.peak_frontier = frontier_size
+        if self.max_expansions is not None and \
+                self.expansions >= self.max_expansions:
+            self.exhausted('expansions')
+        if self.max_frontier is not None and \
+                frontier_size > self.max_frontier:
+            self.exhausted('frontier')
+        if self.max_seconds is not None and self.elapsed > self.max_seconds:
+            self.exhausted('time')
+        if self.max_memory is not None and \
+                self.expansions % self.check_interval == 0:
+            memory = resident_memory()
+            if memory is not None and memory > self.max_memory * 1024 * 1024:
+                self.exhausted('memory', memory)
+        self.expansions += 1
+
+    def exhausted(self, reason, memory=None):
+        raise BudgetExhausted(reason, self.expansions, self.peak_frontier,
+                              self.elapsed, memory)
+
+
+def budgeted(search):
+    """Decorate a search function so that it accepts a budget keyword and
+    returns the BudgetExhausted instance, rather than raising it, when the
+    budget runs out."""
+    signature = inspect.signature(search)
+
+    @functools.wraps(search)
+    def wrapper(*args, **kwargs):
+        budget = signature.bind(*args, **kwargs).arguments.get('budget')
+        if budget is None:
+            return search(*args, **kwargs)
+        budget.start()
+        try:
+            return search(*args, **kwargs)
+        except BudgetExhausted as exhausted:
+            return exhausted
+    return wrapper
+
 # ______________________________________________________________________________
 # Uninformed Search algorithms
 
 
-def tree_search(problem, frontier):
+@budgeted
+def tree_search(problem, frontier, budget=None):
     """Search through the successors of a problem to find a goal.
     The argument frontier should be an empty queue.
     Don't worry about repeated paths to a state. [Figure 3.7]"""
@@ -182,11 +351,14 @@ def tree_search(problem, frontier):
         node = frontier.pop()
         if problem.goal_test(node.state):
             return node
+        if budget:
+            budget.expand(len(frontier))
         frontier.extend(node.expand(problem))
     return None
 
 
-def graph_search(problem, frontier):
+@budgeted
+def graph_search(problem, frontier, budget=None):
     """Search through the successors of a problem to find a goal.
     The argument frontier should be an empty queue.
     If two paths reach a state, only use the first one. [Figure 3.7]"""
@@ -196,6 +368,8 @@ def graph_search(problem, frontier):
         node = frontier.pop()
         if problem.goal_test(node.state):
             return node
+        if budget:
+            budget.expand(len(frontier))
         explored.add(node.state)
         frontier.extend(child for child in node.expand(problem)
                         if child.state not in explored and
@@ -203,22 +377,23 @@ def graph_search(problem, frontier):
     return None
 
 
-def breadth_first_tree_search(problem):
+def breadth_first_tree_search(problem, budget=None):
     "Search the shallowest nodes in the search tree first."
-    return tree_search(problem, FIFOQueue())
+    return tree_search(problem, FIFOQueue(), budget=budget)
 
 
-def depth_first_tree_search(problem):
+def depth_first_tree_search(problem, budget=None):
     "Search the deepest nodes in the search tree first."
-    return tree_search(problem, Stack())
+    return tree_search(problem, Stack(), budget=budget)
 
 
-def depth_first_graph_search(problem):
+def depth_first_graph_search(problem, budget=None):
     "Search the deepest nodes in the search tree first."
-    return graph_search(problem, Stack())
+    return graph_search(problem, Stack(), budget=budget)
 
 
-def breadth_first_search(problem):
+@budgeted
+def breadth_first_search(problem, budget=None):
     "[Figure 3.11]"
     node = Node(problem.initial)
     if problem.goal_test(node.state):
@@ -228,6 +403,8 @@ def breadth_first_search(problem):
     explored = set()
     while frontier:
         node = frontier.pop()
+        if budget:
+            budget.expand(len(frontier))
         explored.add(node.state)
         for child in node.expand(problem):
             if child.state not in explored and child not in frontier:
@@ -237,14 +414,16 @@ def breadth_first_search(problem):
     return None
 
 
-def best_first_graph_search(problem, f):
+@budgeted
+def best_first_graph_search(problem, f, budget=None):
     """Search the nodes with the lowest f scores first.
     You specify the function f(node) that you want to minimize; for example,
     if f is a heuristic estimate to the goal, then we have greedy best
     first search; if f is node.depth then we have breadth-first search.
     There is a subtlety: the line "f = memoize(f, 'f')" means that the f
     values will be cached on the nodes as they are computed. So after doing
-    a best first search you can examine the f values of the path returned."""
+    a best first search you can examine the f values of the path returned.
+    An optional SearchBudget limits the run; see budgeted."""
     f = memoize(f, 'f')
     node = Node(problem.initial)
     if problem.goal_test(node.state):
@@ -256,6 +435,8 @@ def best_first_graph_search(problem, f):
         node = frontier.pop()
         if problem.goal_test(node.state):
             return node
+        if budget:
+            budget.expand(len(frontier))
         explored.add(node.state)
         for child in node.expand(problem):
             if child.state not in explored and child not in frontier:
@@ -268,12 +449,14 @@ def best_first_graph_search(problem, f):
     return None
 
 
-def uniform_cost_search(problem):
+def uniform_cost_search(problem, budget=None):
     "[Figure 3.14]"
-    return best_first_graph_search(problem, lambda node: node.path_cost)
+    return best_first_graph_search(problem, lambda node: node.path_cost,
+                                   budget=budget)
 
 
-def depth_limited_search(problem, limit=50):
+@budgeted
+def depth_limited_search(problem, limit=50, budget=None):
     "[Figure 3.17]"
     def recursive_dls(node, problem, limit):
         if problem.goal_test(node.state):
@@ -281,6 +464,9 @@ def depth_limited_search(problem, limit=50):
         elif limit == 0:
             return 'cutoff'
         else:
+            if budget:
+                # the recursion stack plays the role of the frontier
+                budget.expand(node.depth)
             cutoff_occurred = False
             for child in node.expand(problem):
                 result = recursive_dls(child, problem, limit - 1)
@@ -294,10 +480,11 @@ def depth_limited_search(problem, limit=50):
     return recursive_dls(Node(problem.initial), problem, limit)
 
 
-def iterative_deepening_search(problem):
+def iterative_deepening_search(problem, budget=None):
     "[Figure 3.18]"
     for depth in range(sys.maxsize):
-        result = depth_limited_search(problem, depth)
+        # the budget is shared across all depths
+        result = depth_limited_search(problem, depth, budget=budget)
         if result != 'cutoff':
             return result
 
@@ -308,24 +495,28 @@ greedy_best_first_graph_search = best_first_graph_search
 # Greedy best-first search is accomplished by specifying f(n) = h(n).
 
 
-def astar_search(problem, h=None):
+def astar_search(problem, h=None, budget=None):
     """A* search is best-first graph search with f(n) = g(n)+h(n).
     You need to specify the h function when you call astar_search, or
     else in your Problem subclass."""
     h = memoize(h or problem.h, 'h')
-    return best_first_graph_search(problem, lambda n: n.path_cost + h(n))
+    return best_first_graph_search(problem, lambda n: n.path_cost + h(n),
+                                   budget=budget)
 
 # ______________________________________________________________________________
 # Other search algorithms
 
 
-def recursive_best_first_search(problem, h=None):
+@budgeted
+def recursive_best_first_search(problem, h=None, budget=None):
     "[Figure 3.26]"
     h = memoize(h or problem.h, 'h')
 
     def RBFS(problem, node, flimit):
         if problem.goal_test(node.state):
             return node, 0   # (The second value is immaterial)
+        if budget:
+            budget.expand(node.depth)
         successors = node.expand(problem)
         if len(successors) == 0:
             return None, infinity
@@ -1098,26 +1289,143 @@ def mutate_boggle(board):
 # Code to compare searchers on various problems.
 
 
+class CallProfile:
+
+    """Call count, cumulative time, latency histogram and repeat rate of one
+    profiled function.  The histogram maps the upper bound of a power of two
+    bucket, in microseconds, to the number of calls that fell in it.  A call
+    is a repeat when its key (usually the state) was seen by an earlier call,
+    so repeat_rate is the hit rate a cache keyed that way would get; it is
+    estimated from a HyperLogLog count of the distinct keys, so memory stays
+    bounded however many keys there are.  When the function has an LRUCache,
+    cache holds it and its counts are reported."""
+
+    def __init__(self, name, cache=None):
+        self.name = name
+        self.cache = cache
+        self.calls = 0
+        self.time = 0.0
+        self.keyed_calls = 0
+        self.histogram = defaultdict(int)
+        self.distinct = HyperLogLog()
+
+    def record(self, elapsed, key=None):
+        self.calls += 1
+        self.time += elapsed
+        self.histogram[1 << int(elapsed * 1e6).bit_length()] += 1
+        if key is not None:
+            self.keyed_calls += 1
+            self.distinct.add(key)
+
+    @property
+    def repeats(self):
+        return max(0, self.keyed_calls - len(self.distinct))
+
+    @property
+    def mean(self):
+        return self.time / self.calls if self.calls else 0.0
+
+    @property
+    def repeat_rate(self):
+        return self.repeats / self.calls if self.calls else 0.0
+
+    def summary(self):
+        "Return the statistics as a plain dict, e.g. for a JSON record."
+        summary = {'calls': self.calls, 'time': self.time, 'mean': self.mean,
+                   'repeat_rate': self.repeat_rate,
+                   'histogram': dict(sorted(self.histogram.items()))}
+        if self.cache is not None:
+            summary.update(cache_hits=self.cache.hits,
+                           cache_misses=self.cache.misses,
+                           cache_evictions=self.cache.evictions,
+                           cache_size=len(self.cache))
+        return summary
+
+
 class InstrumentedProblem(Problem):
 
-    """Delegates to a problem, and keeps statistics."""
+    """Delegates to a problem, and keeps statistics, including the calls
+    to and total time of the heuristics wrapped with heuristic(), and the
+    LRUCache of the last one given a cache_size, as heuristic_cache.  With
+    profile=True it also times every call to actions, result and goal_test,
+    and to each heuristic, in CallProfiles keyed by name."""
 
-    def __init__(self, problem):
+    def __init__(self, problem, profile=False):
         self.problem = problem
         self.succs = self.goal_tests = self.states = 0
         self.found = None
+        self.heuristic_calls = 0
+        self.heuristic_time = 0.0
+        self.heuristic_cache = None
+        self.profiles = None
+        if profile:
+            self.profiles = OrderedDict((name, CallProfile(name)) for name in
+                                        ('actions', 'result', 'goal_test'))
+
+    def profile(self, name):
+        "Return the CallProfile for name, creating it on first use."
+        if name not in self.profiles:
+            self.profiles[name] = CallProfile(name)
+        return self.profiles[name]
+
+    def cached_heuristic(self, h, maxsize=None, name=None):
+        """Cache h on the wrapped problem, where its counts are kept."""
+        return self.problem.cached_heuristic(h, maxsize, name)
+
+    def heuristic(self, h, name=None, cache_size=None):
+        """Return h wrapped to add its calls and time to heuristic_calls
+        and heuristic_time, and to be profiled under name (by default its
+        __name__) when profiling is on.  With a cache_size, h is first given
+        a state-keyed LRU cache of that many entries."""
+        name = name or getattr(h, '__name__', 'h')
+        if cache_size:
+            h = self.cached_heuristic(h, cache_size, name)
+            self.heuristic_cache = h.cache
+        profile = None
+        if self.profiles is not None:
+            profile = self.profile(name)
+            profile.cache = getattr(h, 'cache', None)
+
+        def timed_h(node):
+            start = time.perf_counter()
+            try:
+                return h(node)
+            finally:
+                elapsed = time.perf_counter() - start
+                self.heuristic_calls += 1
+                self.heuristic_time += elapsed
+                if profile is not None:
+                    profile.record(elapsed, node.state)
+        return timed_h
 
     def actions(self, state):
         self.succs += 1
-        return self.problem.actions(state)
+        if self.profiles is None:
+            return self.problem.actions(state)
+        start = time.perf_counter()
+        actions = self.problem.actions(state)
+        self.profile('actions').record(time.perf_counter() - start, state)
+        return actions
 
     def result(self, state, action):
         self.states += 1
-        return self.problem.result(state, action)
+        if self.profiles is None:
+            return self.problem.result(state, action)
+        start = time.perf_counter()
+        result = self.problem.result(state, action)
+        self.profile('result').record(time.perf_counter() - start,
+                                      (state, action))
+        return result
 
     def goal_test(self, state):
         self.goal_tests += 1
-        result = self.problem.goal_test(state)
+        if self.profiles is None:
+            result = self.problem.goal_test(state)
+        else:
+            start = time.perf_counter()
+            result = self.problem.goal_test(state)
+            self.profile('goal_test').record(time.perf_counter() - start,
+                                             state)
         if result:
             self.found = state
         return result
@@ -1132,6 +1440,10 @@ class InstrumentedProblem(Problem):
         return getattr(self.problem, attr)
 
     def __repr__(self):
+        if self.heuristic_cache is not None:
+            return '<%4d/%4d/%4d/%s %d/%d>' % (
+                self.succs, self.goal_tests, self.states, str(self.found)[:4],
+                self.heuristic_cache.hits, self.heuristic_cache.misses)
         return '<%4d/%4d/%4d/%s>' % (self.succs, self.goal_tests,
                                      self.states, str(self.found)[:4])
 
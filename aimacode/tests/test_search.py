@@ -1,5 +1,6 @@
 import pytest
-from search import *  # noqa
+import weakref
+from aimacode.search import *  # noqa
 
 
 romania_problem = GraphProblem('Arad', 'Bucharest', romania_map)
@@ -44,6 +45,91 @@ def test_recursive_best_first_search():
     assert recursive_best_first_search(romania_problem).solution() == ['Sibiu', 'Rimnicu', 'Pitesti', 'Bucharest']
 
 
+def test_search_budget_expansions():
+    result = breadth_first_search(romania_problem, budget=SearchBudget(max_expansions=2))
+    assert isinstance(result, BudgetExhausted)
+    assert result.reason == 'expansions'
+    assert result.expansions == 2
+    result = astar_search(romania_problem, budget=SearchBudget(max_expansions=100))
+    assert result.solution() == ['Sibiu', 'Rimnicu', 'Pitesti', 'Bucharest']
+
+
+def test_search_budget_frontier():
+    result = breadth_first_tree_search(romania_problem, budget=SearchBudget(max_frontier=5))
+    assert isinstance(result, BudgetExhausted)
+    assert result.reason == 'frontier'
+    assert result.peak_frontier > 5
+
+
+def test_search_budget_shared_across_depths():
+    budget = SearchBudget(max_expansions=10)
+    assert isinstance(iterative_deepening_search(romania_problem, budget=budget), BudgetExhausted)
+    assert budget.expansions == 10
+
+
+def test_search_budget_time():
+    result = recursive_best_first_search(romania_problem, budget=SearchBudget(max_seconds=0))
+    assert isinstance(result, BudgetExhausted)
+    assert result.reason == 'time'
+
+
+def test_instrumented_problem_profile():
+    ip = InstrumentedProblem(romania_problem, profile=True)
+    h = ip.heuristic(romania_problem.h, 'h')
+    astar_search(ip, h)
+    assert list(ip.profiles) == ['actions', 'result', 'goal_test', 'h']
+    assert ip.profiles['actions'].calls == ip.succs
+    assert ip.profiles['goal_test'].calls == ip.goal_tests
+    assert ip.profiles['result'].calls == ip.states
+    assert sum(ip.profiles['h'].histogram.values()) == ip.profiles['h'].calls
+    assert 0 <= ip.profiles['h'].repeat_rate < 1
+    assert ip.heuristic_calls == ip.profiles['h'].calls
+    assert ip.heuristic_time == ip.profiles['h'].time
+    assert InstrumentedProblem(romania_problem).profiles is None
+
+
+def test_instrumented_problem_heuristic_time():
+    ip = InstrumentedProblem(romania_problem)
+    h = ip.heuristic(romania_problem.h, 'h')
+    astar_search(ip, h)
+    assert ip.profiles is None
+    assert ip.heuristic_calls >= ip.succs > 0
+    assert ip.heuristic_time > 0
+
+
+def test_node_slots():
+    node = Node('Arad')
+    assert not hasattr(node, '__dict__')
+    h = memoize(lambda n: 7, 'h')
+    assert h(node) == 7 and node.h == 7
+    child = node.child_node(romania_problem, 'Sibiu')
+    assert type(child) is Node and child.depth == 1 and not hasattr(child, 'h')
+    assert weakref.ref(child)() is child
+
+
+def test_instrumented_problem_heuristic_cache():
+    ip = InstrumentedProblem(romania_problem, profile=True)
+    h = ip.heuristic(romania_problem.h, 'h', cache_size=5)
+    assert recursive_best_first_search(ip, h).solution() == ['Sibiu', 'Rimnicu', 'Pitesti', 'Bucharest']
+    cache = ip.profiles['h'].cache
+    assert cache is romania_problem.heuristic_caches['h']
+    assert cache.hits + cache.misses == ip.profiles['h'].calls
+    assert cache.hits > 0 and len(cache) <= 5
+    summary = ip.profiles['h'].summary()
+    assert summary['cache_hits'] == cache.hits and summary['cache_size'] == len(cache)
+
+
+def test_instrumented_problem_heuristic_cache_counts():
+    ip = InstrumentedProblem(romania_problem)
+    assert repr(ip) == '<   0/   0/   0/None>'
+    h = ip.heuristic(romania_problem.h, 'h', cache_size=5)
+    recursive_best_first_search(ip, h)
+    cache = ip.heuristic_cache
+    assert cache is romania_problem.heuristic_caches['h']
+    assert cache.hits + cache.misses == ip.heuristic_calls
+    assert repr(ip).endswith(' %d/%d>' % (cache.hits, cache.misses))
+
+
 def test_BoggleFinder():
     board = list('SARTELNID')
     """
@@ -1,3 +1,5 @@
+import copy
+import pickle
 import pytest
 from utils import *  # noqa
 
@@ -176,5 +178,107 @@ def test_expr():
     assert (expr('GP(x, z) <== P(x, y) & P(y, z)')
             == Expr('<==', GP(x, z), P(x, y) & P(y, z)))
 
+def test_Expr_interning():
+    x = Expr('At', Symbol('C1'), Symbol('SFO'))
+    assert expr('At(C1, SFO)') is x
+    assert expr('~At(C1, SFO)').args[0] is x
+    assert x != Expr('At', Symbol('C2'), Symbol('SFO'))
+    # Exprs with numbers are not interned, but still equal
+    assert Expr('+', x, 1) == Expr('+', x, 1)
+    assert copy.deepcopy(x) is x and pickle.loads(pickle.dumps(x)) is x
+    Expr.interning = False
+    try:
+        y = Expr('At', Symbol('C1'), Symbol('SFO'))
+    finally:
+        Expr.interning = True
+    assert y is not x and y == x and x == y and hash(y) == hash(x)
+
+
+def test_Expr_unhashable_args():
+    x = Expr('F', [1, 2], Symbol('A'))
+    assert x.args[0] == [1, 2] and x == Expr('F', [1, 2], Symbol('A'))
+    assert repr(x) == 'F([1, 2], A)'
+    with pytest.raises(TypeError):
+        hash(x)
+    nested = Expr('F', Expr('G', [1, 2]))
+    assert repr(nested) == 'F(G([1, 2]))' and nested == Expr('F', Expr('G', [1, 2]))
+    assert ~nested == Expr('~', nested)
+    with pytest.raises(TypeError):
+        hash(nested)
+
+
+def test_expr_atom():
+    assert expr_atom('At(C1, SFO)') == Expr('At', Symbol('C1'), Symbol('SFO'))
+    assert expr_atom(' P ') == Symbol('P')
+    assert expr_atom('P & Q') is None
+    assert expr_atom('f(x, 2)') is None
+    assert expr_atom('None') is None
+    assert expr('None') is None
+
+
+def test_parse_expr():
+    A, B, C, P, Q, R, x, y = symbols('A, B, C, P, Q, R, x, y')
+    assert expr('A | B & ~C ==> P') == Expr('==>', A | (B & ~C), P)
+    assert expr('P ==> Q ==> R') == Expr('==>', Expr('==>', P, Q), R)
+    assert expr('P & (Q <=> R)') == P & Expr('<=>', Q, R)
+    assert expr('x ** y ** 2') == x ** (y ** 2)
+    assert expr('-x ** 2 + y') == -(x ** 2) + y
+    assert expr('F(G(x), 2, y + 1,)') == Expr('F', Expr('G', x), 2, y + 1)
+    assert expr('1 + 2 * 3') == 7 and expr('-2**2') == -4 and expr('1.5e1') == 15.0
+    assert expr('True') is True
+    assert parse_expr('(P | Q) & R') is parse_expr('(P | Q) & R')
+    assert tokenize_expr('P<=>Q') == [('name', 'P'), ('op', '<=>'), ('name', 'Q'), ('end', '')]
+    for bad in ['P ===', 'F(x', 'P Q', 'lambda: P', '(P, Q)', 'x.y', '']:
+        with pytest.raises(SyntaxError):
+            expr(bad)
+
+
+def test_HyperLogLog():
+    sketch = HyperLogLog()
+    assert len(sketch) == 0
+    for i in range(20000):
+        sketch.add(i)
+        sketch.add(('state', i % 100))
+    assert len(sketch.registers) == 4096
+    assert abs(len(sketch) - 20100) < 20100 * 0.05
+
+
+def test_PriorityQueue():
+    f = {'a': 3, 'b': 1, 'c': 2, 'd': 1}
+    q = PriorityQueue(min, f.get)
+    q.extend('abcd')
+    assert len(q) == 4 and 'c' in q and q['c'] == 'c' and q['e'] is None
+    del q['c']
+    assert 'c' not in q and len(q) == 3
+    f['a'] = 0
+    q.append('a')
+    assert len(q) == 3
+    assert [q.pop() for _ in range(3)] == ['a', 'b', 'd']
+    with pytest.raises(IndexError):
+        q.pop()
+    q = PriorityQueue(max, f.get)
+    q.extend('abcd')
+    assert [q.pop() for _ in range(4)] == ['c', 'd', 'b', 'a']
+
+
+def test_LRUCache():
+    cache = LRUCache(2)
+    cache['a'], cache['b'] = 1, 2
+    assert cache.get('a') == 1
+    cache['c'] = 3
+    assert 'b' not in cache and 'a' in cache and len(cache) == 2
+    assert cache.get('b', 0) == 0
+    assert (cache.hits, cache.misses, cache.evictions) == (1, 1, 1)
+    assert cache.hit_rate == 0.5
+
+
+def test_memoize_lru():
+    calls = []
+    square = memoize_lru(lambda x: calls.append(x) or x * x, key=abs, maxsize=1)
+    assert [square(2), square(-2), square(3), square(2)] == [4, 4, 9, 4]
+    assert calls == [2, 3, 2]
+    assert (square.cache.hits, square.cache.evictions) == (1, 2)
+
+
 if __name__ == '__main__':
     pytest.main()
@@ -4,10 +4,14 @@ import bisect
 import collections
 import collections.abc
 import functools
+import heapq
+import keyword
 import operator
 import os.path
 import random
 import math
+import re
+import weakref
 
 # ______________________________________________________________________________
 # Functions on Sequences and Iterables
@@ -291,6 +295,100 @@ def memoize(fn, slot=None):
     return memoized_fn
 
 
+class LRUCache:
+
+    """A dict-like cache that holds at most maxsize entries (None for no limit),
+    evicting the least recently used one, and counts its hits, misses and
+    evictions."""
+
+    def __init__(self, maxsize=None):
+        self.maxsize = maxsize
+        self.data = collections.OrderedDict()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key, default=None):
+        "Return the value for key (marking it recently used), or default."
+        try:
+            value = self.data[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self.data.move_to_end(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self.data[key] = value
+        self.data.move_to_end(key)
+        if self.maxsize is not None and len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+            self.evictions += 1
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def __len__(self):
+        return len(self.data)
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+def memoize_lru(fn, key=identity, maxsize=None):
+    """Memoize the one-argument function fn in an LRUCache of at most maxsize
+    entries, keyed by key(arg); the cache is the cache attribute of the result."""
+    cache = LRUCache(maxsize)
+    missing = object()
+
+    def memoized_fn(arg):
+        k = key(arg)
+        val = cache.get(k, missing)
+        if val is missing:
+            val = cache[k] = fn(arg)
+        return val
+
+    memoized_fn.cache = cache
+    return memoized_fn
+
+
+class HyperLogLog:
+
+    """Estimate the number of distinct hashable items added, in a fixed
+    2**precision bytes (a HyperLogLog sketch, with a relative standard error
+    of about 1.04 / sqrt(2**precision), 1.6% by default)."""
+
+    def __init__(self, precision=12):
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    def add(self, item):
+        x = mix64(hash(item))
+        width = 64 - self.precision
+        j, w = x >> width, x & ((1 << width) - 1)
+        rank = width - w.bit_length() + 1
+        if rank > self.registers[j]:
+            self.registers[j] = rank
+
+    def __len__(self):
+        m = len(self.registers)
+        estimate = 0.7213 / (1 + 1.079 / m) * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)    # linear counting for small counts
+        return int(round(estimate))
+
+
+def mix64(x):
+    "Scramble the bits of an int into 64 well-distributed bits (splitmix64's finalizer)."
+    mask = (1 << 64) - 1
+    x = (x + 0x9E3779B97F4A7C15) & mask
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & mask
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & mask
+    return x ^ (x >> 31)
+
+
 def name(obj):
     "Try to find some reasonable name for the object."
     return (getattr(obj, 'name', 0) or getattr(obj, '__name__', 0) or
@@ -355,11 +453,50 @@ class Expr(object):
     """A mathematical expression with an operator and 0 or more arguments.
     op is a str like '+' or 'sin'; args are Expressions.
     Expr('x') or Symbol('x') creates a symbol (a nullary Expr).
-    Expr('-', x) creates a unary; Expr('+', x, 1) creates a binary."""
-
-    def __init__(self, op, *args):
-        self.op = str(op)
+    Expr('-', x) creates a unary; Expr('+', x, 1) creates a binary.
+
+    Exprs are immutable and cache their hash.  While Expr.interning is true,
+    an Expr whose args are all Exprs is hash-consed: building one equal to a
+    live interned Expr returns that same object, so two interned Exprs are
+    equal only if they are identical.  Args need not be hashable (such as a
+    list), at any depth; an Expr with such an arg, or with an Expr arg that
+    has one, is built as usual (and not interned) and only raises TypeError
+    when it is hashed."""
+
+    __slots__ = ('op', 'args', '_hash', '_interned', '__weakref__')
+
+    interning = True
+    _interned_exprs = weakref.WeakValueDictionary()
+
+    def __new__(cls, op, *args):
+        op = str(op)
+        interned = Expr.interning and cls is Expr
+        if interned:
+            for arg in args:
+                # an Expr arg without a hash holds an unhashable arg somewhere below
+                if type(arg) is not Expr or arg._hash is None:
+                    interned = False
+                    break
+            else:
+                self = Expr._interned_exprs.get((op, args))
+                if self is not None:
+                    return self
+        self = object.__new__(cls)
+        self.op = op
         self.args = args
+        try:
+            self._hash = hash(op) ^ hash(args)
+        except TypeError:           # unhashable args: fail when hashed, as before
+            self._hash = None
+        self._interned = interned
+        if interned:
+            Expr._interned_exprs[(op, args)] = self
+        return self
+
+    def __reduce__(self):
+        # rebuilt through Expr() so copies and unpickled Exprs are interned (and
+        # rehashed: str hashes differ between processes)
+        return (type(self), (self.op,) + self.args)
 
     # Operator overloads
     def __neg__(self):      return Expr('-', self)
@@ -411,11 +548,16 @@ class Expr(object):
     # Equality and repr
     def __eq__(self, other):
         "'x == y' evaluates to True or False; does not build an Expr."
-        return (isinstance(other, Expr)
-                and self.op == other.op
-                and self.args == other.args)
+        if self is other:
+            return True
+        if not isinstance(other, Expr) or (self._interned and other._interned):
+            return False
+        return self.op == other.op and self.args == other.args
 
-    def __hash__(self): return hash(self.op) ^ hash(self.args)
+    def __hash__(self):
+        if self._hash is None:
+            return hash(self.op) ^ hash(self.args)
+        return self._hash
 
     def __repr__(self):
         op = self.op
@@ -474,17 +616,190 @@ def expr(x):
     """Shortcut to create an Expression. x is a str in which:
     - identifiers are automatically defined as Symbols.
     - ==> is treated as an infix |'==>'|, as are <== and <=>.
-    If x is already an Expression, it is returned unchanged. Example:
+    If x is already an Expression, it is returned unchanged.  Strings are
+    parsed by parse_expr, without eval, and cached. Example:
     >>> expr('P & Q ==> Q')
     ((P & Q) ==> Q)
     """
     if isinstance(x, str):
-        return eval(expr_handle_infix_ops(x), defaultkeydict(Symbol))
+        return parse_expr(x)
     else:
         return x
 
 infix_ops = '==> <== <=>'.split()
 
+atom_pattern = re.compile(r'\s*([^\W\d]\w*)\s*(?:\(\s*([^\W\d]\w*(?:\s*,\s*[^\W\d]\w*)*)\s*\))?\s*\Z')
+
+
+def expr_atom(x):
+    """Parse a str that is a symbol or a function of symbols, such as
+    'At(C1, SFO)', without eval; return None for anything else.
+    >>> expr_atom('At(C1, SFO)')
+    At(C1, SFO)
+    """
+    match = atom_pattern.match(x)
+    if not match:
+        return None
+    name, args = match.groups()
+    names = [name] + ([a.strip() for a in args.split(',')] if args else [])
+    if any(keyword.iskeyword(n) for n in names):
+        return None
+    return Expr(name, *map(Symbol, names[1:]))
+
+
+expr_token_pattern = re.compile(r'''\s*(?:
+    (?P<number>0[xXoObB][0-9a-fA-F_]+|(?:\d[\d_]*\.?[\d_]*|\.\d[\d_]*)(?:[eE][+-]?\d+)?[jJ]?)
+  | (?P<name>[^\W\d]\w*)
+  | (?P<op>==>|<==|<=>|\*\*|//|<<|>>|[|^&+\-*/%@~(),])
+  )''', re.VERBOSE)
+
+# Binding powers of the infix operators, as in Python, with ==>, <== and <=>
+# as weak (and as left-associative) as |, which they are written as in eval.
+expr_infix_ops = {
+    '|': (10, operator.or_), '==>': (10, None), '<==': (10, None), '<=>': (10, None),
+    '^': (20, operator.xor), '&': (30, operator.and_),
+    '<<': (40, operator.lshift), '>>': (40, operator.rshift),
+    '+': (50, operator.add), '-': (50, operator.sub),
+    '*': (60, operator.mul), '/': (60, operator.truediv), '//': (60, operator.floordiv),
+    '%': (60, operator.mod), '@': (60, operator.matmul),
+    '**': (80, operator.pow)}
+expr_prefix_ops = {'-': operator.neg, '+': operator.pos, '~': operator.invert}
+expr_constants = {'True': True, 'False': False, 'None': None}
+EXPR_UNARY_POWER = 70    # unary operators bind tighter than * but looser than **
+EXPR_CALL_POWER = 90
+
+
+def tokenize_expr(x):
+    """Split a str into a list of (kind, text) tokens, kind being 'number',
+    'name' or 'op', ending with ('end', '').
+    >>> tokenize_expr('P ==> Q(1)')
+    [('name', 'P'), ('op', '==>'), ('name', 'Q'), ('op', '('), ('number', '1'), ('op', ')'), ('end', '')]
+    """
+    tokens = []
+    pos, end = 0, len(x.rstrip())
+    while pos < end:
+        match = expr_token_pattern.match(x, pos)
+        if not match:
+            raise SyntaxError('invalid expression {!r} at {!r}'.format(x, x[pos:].strip()))
+        tokens.append((match.lastgroup, match.group(match.lastgroup)))
+        pos = match.end()
+    tokens.append(('end', ''))
+    return tokens
+
+
+class ExprParser:
+
+    """A Pratt (top down operator precedence) parser for the expression
+    language of expr.  Operators are applied to the parsed operands just as
+    eval would apply them, so Exprs are built by the Expr operator overloads
+    and numbers are combined as numbers."""
+
+    def __init__(self, x):
+        self.source = x
+        self.tokens = tokenize_expr(x)
+        self.pos = 0
+
+    def parse(self):
+        "Parse the whole str."
+        result = self.expression(0)
+        if self.tokens[self.pos][0] != 'end':
+            self.error()
+        return result
+
+    def error(self):
+        raise SyntaxError('invalid expression {!r} at {!r}'.format(
+            self.source, self.tokens[self.pos][1]))
+
+    def advance(self):
+        token = self.tokens[self.pos]
+        self.pos += 1
+        return token
+
+    def expect(self, text):
+        if self.tokens[self.pos] != ('op', text):
+            self.error()
+        self.pos += 1
+
+    def expression(self, power):
+        "Parse the operators that bind tighter than power."
+        left = self.prefix(self.advance())
+        while True:
+            kind, text = self.tokens[self.pos]
+            if kind != 'op':
+                return left
+            if text == '(':
+                if EXPR_CALL_POWER <= power:
+                    return left
+                self.pos += 1
+                left = left(*self.arguments())
+                continue
+            if text not in expr_infix_ops:
+                return left
+            op_power, apply = expr_infix_ops[text]
+            if op_power <= power:
+                return left
+            self.pos += 1
+            # ** is right-associative, the rest are left-associative
+            right = self.expression(op_power - 1 if text == '**' else op_power)
+            left = Expr(text, left, right) if apply is None else apply(left, right)
+
+    def prefix(self, token):
+        kind, text = token
+        if kind == 'name':
+            if keyword.iskeyword(text):
+                if text in expr_constants:
+                    return expr_constants[text]
+                self.pos -= 1
+                self.error()
+            return Symbol(text)
+        if kind == 'number':
+            return parse_number(text)
+        if text == '(':
+            result = self.expression(0)
+            self.expect(')')
+            return result
+        if text in expr_prefix_ops:
+            return expr_prefix_ops[text](self.expression(EXPR_UNARY_POWER))
+        self.pos -= 1
+        self.error()
+
+    def arguments(self):
+        "Parse the arguments of a call, after its '('."
+        args = []
+        while self.tokens[self.pos] != ('op', ')'):
+            args.append(self.expression(0))
+            if self.tokens[self.pos] != ('op', ','):
+                break
+            self.pos += 1
+        self.expect(')')
+        return args
+
+
+def parse_number(text):
+    "The int, float or complex value of a number token."
+    text = text.replace('_', '')
+    if text[-1] in 'jJ':
+        return complex(text)
+    try:
+        return int(text, 0)
+    except ValueError:
+        return float(text)
+
+
+@functools.lru_cache(maxsize=65536)
+def parse_expr(x):
+    """Parse a str into the Expression eval(expr_handle_infix_ops(x)) gives,
+    but without eval: a symbol or a function of symbols is matched by
+    a regex, and anything else goes through an ExprParser.  Results are
+    cached by str (Exprs are immutable, so they can be shared).
+    >>> parse_expr('P & Q ==> Q')
+    ((P & Q) ==> Q)
+    """
+    atom = expr_atom(x)
+    if atom is not None:
+        return atom
+    return ExprParser(x).parse()
+
 
 def expr_handle_infix_ops(x):
     """Given a str, return a new str with ==> replaced by |'==>'|, etc.
@@ -570,42 +885,83 @@ class FIFOQueue(Queue):
         return item in self.A[self.start:]
 
 
+class MaxFirst:
+
+    """A key that sorts before the smaller keys, so that a heap of MaxFirst
+    keys pops the maximum first."""
+
+    __slots__ = ('key',)
+
+    def __init__(self, key):
+        self.key = key
+
+    def __lt__(self, other):
+        return other.key < self.key
+
+    def __eq__(self, other):
+        return self.key == other.key
+
+
 class PriorityQueue(Queue):
 
     """A queue in which the minimum (or maximum) element (as determined by f and
     order) is returned first. If order is min, the item with minimum f(x) is
     returned first; if order is max, then it is the item with maximum f(x).
-    Also supports dict-like lookup."""
+    Also supports dict-like lookup.
+
+    Items are kept in a binary heap of [(f(item), item), count, item, live]
+    entries, so ties on f go to the smaller item and then to the first (or,
+    for max, the last) appended, as they would in a sorted list.  A dict from
+    item to its entry makes membership and lookup O(1).  An item holds one
+    entry: deleting it, or appending an equal item (a decrease-key), marks its
+    entry dead, and dead entries are skipped when popped."""
 
     def __init__(self, order=min, f=lambda x: x):
-        self.A = []
+        self.heap = []
+        self.entries = {}
+        self.count = 0
         self.order = order
         self.f = f
 
     def append(self, item):
-        bisect.insort(self.A, (self.f(item), item))
+        if item in self.entries:
+            del self[item]
+        self.count += 1
+        key = (self.f(item), item)
+        if self.order == min:
+            entry = [key, self.count, item, True]
+        else:
+            entry = [MaxFirst(key), -self.count, item, True]
+        self.entries[item] = entry
+        heapq.heappush(self.heap, entry)
 
     def __len__(self):
-        return len(self.A)
+        return len(self.entries)
 
     def pop(self):
-        if self.order == min:
-            return self.A.pop(0)[1]
-        else:
-            return self.A.pop()[1]
+        while self.heap:
+            _, _, item, live = heapq.heappop(self.heap)
+            if live:
+                del self.entries[item]
+                return item
+        raise IndexError('pop from empty PriorityQueue')
 
     def __contains__(self, item):
-        return any(item == pair[1] for pair in self.A)
+        return item in self.entries
 
     def __getitem__(self, key):
-        for _, item in self.A:
-            if item == key:
-                return item
+        entry = self.entries.get(key)
+        if entry is not None:
+            return entry[2]
 
     def __delitem__(self, key):
-        for i, (value, item) in enumerate(self.A):
-            if item == key:
-                self.A.pop(i)
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            entry[3] = False
+            # drop the dead entries once they outnumber the live ones
+            if len(self.heap) > 2 * len(self.entries) + 32:
+                self.heap = [e for e in self.heap if e[3]]
+                heapq.heapify(self.heap)
 
 # ______________________________________________________________________________
 # Useful Shorthands
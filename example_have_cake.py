@@ -40,6 +40,7 @@ from aimacode.search import (
     uniform_cost_search,
     greedy_best_first_graph_search,
     Problem,
+    path_dependent,
 )
 from aimacode.utils import expr
 from lp_utils import (
@@ -101,6 +102,7 @@ from lp_utils import (
 #                               - Action node pairs have either Inconsistent Effects, Interference, Competing needs
 
 from my_planning_graph import PlanningGraph
+from my_landmarks import landmark_graph
 from run_search import run_search
 
 import my_logging
@@ -181,10 +183,17 @@ class HaveCakeProblem(Problem):
         # uses the planning graph level-sum heuristic calculated
         # from this node to the goal
         # requires implementation in PlanningGraph
-        pg = PlanningGraph(self, node.state)
+        # level sums ignore mutexes, so the cheaper relaxed graph gives the same values
+        pg = PlanningGraph(self, node.state, mutex=False)
         pg_levelsum = pg.h_levelsum()
         return pg_levelsum
 
+    @path_dependent
+    def h_landmark_count(self, node: Node):
+        # counts the landmarks not yet accepted on the path to this node, plus
+        # the accepted goals that no longer hold
+        return landmark_graph(self).h_landmark_count(node)
+
     def h_ignore_preconditions(self, node: Node):
         count = 0
         kb = PropKB()
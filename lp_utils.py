@@ -1,3 +1,5 @@
+import heapq
+
 from aimacode.logic import associate
 from aimacode.utils import expr
 
@@ -54,11 +56,14 @@ def decode_state(state: str, fluent_map: list) -> FluentState:
     """ decode string of T/F as fluent per mapping
 
     :param state: str eg. "TFFTFT" string of mapped positive and negative fluents
+        (an int bitset state from FluentIndex is also accepted)
     :param fluent_map: ordered list of possible fluents for the problem
     :return: fs: FluentState object
 
     lengths of state string and fluent_map list must be the same
     """
+    if isinstance(state, int):
+        state = bits_to_state(state, len(fluent_map))
     fs = FluentState([], [])
     for idx, char in enumerate(state):
         if char == 'T':
@@ -66,3 +71,325 @@ def decode_state(state: str, fluent_map: list) -> FluentState:
         else:
             fs.neg.append(fluent_map[idx])
     return fs
+
+
+TF_TO_BITS = str.maketrans('TF', '10')
+BITS_TO_TF = str.maketrans('10', 'TF')
+
+
+def state_to_bits(state: str) -> int:
+    """ convert a string of T/F to its bitset form
+
+    The first fluent of the map is the most significant bit, so comparing two
+    bitset states orders them exactly like their T/F strings.
+
+    :param state: str eg. "TFFTFT" string of mapped positive and negative fluents
+    :return: int eg. 0b100101
+    """
+    return int(state.translate(TF_TO_BITS), 2) if state else 0
+
+
+def bits_to_state(bits: int, size: int) -> str:
+    """ convert a bitset state back to its string of T/F
+
+    :param bits: int bitset state
+    :param size: number of fluents in the fluent map
+    :return: str eg. "TFFTFT" string of mapped positive and negative fluents
+    """
+    return format(bits, '0{}b'.format(size)).translate(BITS_TO_TF) if size else ''
+
+
+def fluent_bits(mask: int):
+    """ yield each set bit of a mask as its own single-bit int
+
+    :param mask: int
+    :return: generator of int
+    """
+    while mask:
+        low = mask & -mask
+        mask ^= low
+        yield low
+
+
+def bit_indices(mask: int):
+    """ yield the index of each set bit of a mask, lowest first
+
+    :param mask: int
+    :return: generator of int
+    """
+    while mask:
+        low = mask & -mask
+        mask ^= low
+        yield low.bit_length() - 1
+
+
+def count_bits(mask: int) -> int:
+    """ number of set bits (fluents) in a mask
+
+    :param mask: int
+    :return: int
+    """
+    return bin(mask).count('1')
+
+
+class FluentIndex():
+    """ index from the fluents of a planning problem to their bit in a bitset state
+
+    Built once from the problem's fluent map; encodes FluentState objects and
+    fluent lists to int masks and decodes int states back to FluentState.
+    """
+
+    def __init__(self, fluent_map: list):
+        self.fluents = list(fluent_map)
+        self.size = len(self.fluents)
+        self.bits = {}
+        for idx, fluent in enumerate(self.fluents):
+            self.bits[fluent] = 1 << (self.size - 1 - idx)
+
+    def mask(self, fluents) -> int:
+        """ bitwise OR of the bits of the given fluents
+
+        :param fluents: iterable of fluents in the fluent map
+        :return: int mask
+        """
+        mask = 0
+        for fluent in fluents:
+            mask |= self.bits[fluent]
+        return mask
+
+    def encode(self, fs: FluentState) -> int:
+        """ encode fluents to a bitset state
+
+        :param fs: FluentState object
+        :return: int bitset of the positive fluents
+        """
+        return self.encode_fluents(fs.pos)
+
+    def encode_fluents(self, pos_list) -> int:
+        """ encode a list of true fluents to a bitset state, ignoring unmapped fluents
+
+        :param pos_list: list of fluents
+        :return: int bitset
+        """
+        return self.mask(f for f in pos_list if f in self.bits)
+
+    def decode(self, state: int) -> FluentState:
+        """ decode a bitset state as fluents
+
+        :param state: int bitset state
+        :return: fs: FluentState object
+        """
+        fs = FluentState([], [])
+        for fluent in self.fluents:
+            if state & self.bits[fluent]:
+                fs.pos.append(fluent)
+            else:
+                fs.neg.append(fluent)
+        return fs
+
+    def to_bits(self, state) -> int:
+        """ bitset form of a state in either encoding
+
+        :param state: int bitset or str of T/F
+        :return: int
+        """
+        return state if isinstance(state, int) else state_to_bits(state)
+
+    def to_str(self, state) -> str:
+        """ T/F string form of a state in either encoding, used for printing
+
+        :param state: int bitset or str of T/F
+        :return: str
+        """
+        return state if isinstance(state, str) else bits_to_state(state, self.size)
+
+
+def relaxed_reachable(initial: int, action_masks) -> int:
+    """ fluents reachable from a state when delete effects are ignored
+
+    Runs a fixpoint over (precond_pos, effect_add) mask pairs: any action whose
+    positive preconditions are all reachable makes its add effects reachable.
+    Entries that are None are skipped.
+
+    :param initial: int bitset of the fluents true in the starting state
+    :param action_masks: list of (precond_pos mask, effect_add mask) or None
+    :return: int mask of reachable fluents
+    """
+    reachable = initial
+    pending = [m for m in action_masks if m is not None]
+    changed = True
+    while changed:
+        changed = False
+        waiting = []
+        for pre, add in pending:
+            if pre & reachable == pre:
+                if add & ~reachable:
+                    reachable |= add
+                    changed = True
+            else:
+                waiting.append((pre, add))
+        pending = waiting
+    return reachable
+
+
+class ActionMasks():
+    """ ground action compiled to int masks over a FluentIndex
+
+    pre_pos: fluents that must be true
+    pre_neg: fluents that must be false
+    add: fluents made true
+    rem: fluents made false
+    """
+
+    def __init__(self, action, fluent_index: FluentIndex):
+        self.action = action
+        self.pre_pos = fluent_index.mask(action.precond_pos)
+        self.pre_neg = fluent_index.mask(action.precond_neg)
+        self.add = fluent_index.mask(action.effect_add)
+        self.rem = fluent_index.mask(action.effect_rem)
+
+    def applicable(self, bits: int) -> bool:
+        return bits & self.pre_pos == self.pre_pos and not bits & self.pre_neg
+
+    def apply(self, bits: int) -> int:
+        """ successor of a bitset state: add effects set, then delete effects cleared
+
+        :param bits: int bitset state
+        :return: int bitset state
+        """
+        return (bits | self.add) & ~self.rem
+
+
+class CompiledActions():
+    """ ground actions of a planning problem compiled once for fast applicability tests
+
+    Each action is "watched" by one of its positive preconditions, the one
+    shared by the fewest actions, so only actions whose watched fluent is true
+    in a state are ever tested against it. Actions without positive
+    preconditions are tested in every state.
+    """
+
+    def __init__(self, actions: list, fluent_index: FluentIndex):
+        self.actions = list(actions)
+        self.fluent_index = fluent_index
+        self.masks = [ActionMasks(a, fluent_index) for a in self.actions]
+        self.position = {action: idx for idx, action in enumerate(self.actions)}
+        need_counts = {}
+        for m in self.masks:
+            for bit in fluent_bits(m.pre_pos):
+                need_counts[bit] = need_counts.get(bit, 0) + 1
+        self.watchers = {}
+        self.unwatched = []
+        for idx, m in enumerate(self.masks):
+            if m.pre_pos:
+                watch = min(fluent_bits(m.pre_pos), key=lambda bit: (need_counts[bit], bit))
+                self.watchers.setdefault(watch, []).append(idx)
+            else:
+                self.unwatched.append(idx)
+
+    def masks_for(self, action) -> ActionMasks:
+        """ compiled masks of an action, compiling it on the fly if it is not one of ours
+
+        :param action: Action
+        :return: ActionMasks
+        """
+        idx = self.position.get(action)
+        if idx is None:
+            return ActionMasks(action, self.fluent_index)
+        return self.masks[idx]
+
+    def applicable(self, bits: int) -> list:
+        """ actions applicable in a bitset state, in the original action order
+
+        :param bits: int bitset state
+        :return: list of Action objects
+        """
+        candidates = list(self.unwatched)
+        watchers = self.watchers
+        remaining = bits
+        while remaining:
+            low = remaining & -remaining
+            remaining ^= low
+            watched = watchers.get(low)
+            if watched:
+                candidates.extend(watched)
+        candidates.sort()
+        masks = self.masks
+        possible_actions = []
+        for idx in candidates:
+            m = masks[idx]
+            if bits & m.pre_pos == m.pre_pos and not bits & m.pre_neg:
+                possible_actions.append(m.action)
+        return possible_actions
+
+
+class DeleteRelaxation():
+    """ h_add and h_max cost propagation under the delete relaxation over the
+    masks of a CompiledActions: negative preconditions and delete effects are
+    ignored and every action costs 1
+
+    The per-node work is a generalized Dijkstra from the true fluents: each
+    action is settled once its last positive precondition is, with a counter
+    of the preconditions still unsettled, so a call is linear in the size of
+    the grounded problem (times the log of a heap of pending fluents), and it
+    stops as soon as every goal fluent is settled.
+    """
+
+    def __init__(self, compiled_actions: CompiledActions):
+        self.preconds = [tuple(bit_indices(m.pre_pos)) for m in compiled_actions.masks]
+        self.adds = [tuple(bit_indices(m.add)) for m in compiled_actions.masks]
+        self.consumers = {}
+        for idx, preconds in enumerate(self.preconds):
+            for p in preconds:
+                self.consumers.setdefault(p, []).append(idx)
+        self.unconditional = [idx for idx, preconds in enumerate(self.preconds) if not preconds]
+
+    def goal_costs(self, bits: int, goal_mask: int, additive=True) -> list:
+        """ relaxed cost of each goal fluent from a bitset state
+
+        :param bits: int bitset state
+        :param goal_mask: int mask of the goal fluents
+        :param additive: bool, sum the costs of an action's preconditions (h_add) rather than
+            taking their max (h_max)
+        :return: list of int (float inf for unreachable goals)
+        """
+        infinity = float('inf')
+        cost = {}
+        heap = [(0, p) for p in bit_indices(bits)]
+        for idx in self.unconditional:
+            heap.extend((1, p) for p in self.adds[idx])
+        heapq.heapify(heap)
+        unsettled = [len(preconds) for preconds in self.preconds]
+        support = [0] * len(self.preconds)
+        goals = set(bit_indices(goal_mask))
+        remaining = len(goals)
+        while heap and remaining:
+            c, p = heapq.heappop(heap)
+            if p in cost:
+                continue
+            cost[p] = c
+            if p in goals:
+                remaining -= 1
+            for idx in self.consumers.get(p, ()):
+                support[idx] = support[idx] + c if additive else max(support[idx], c)
+                unsettled[idx] -= 1
+                if not unsettled[idx]:
+                    action_cost = support[idx] + 1
+                    for q in self.adds[idx]:
+                        if q not in cost:
+                            heapq.heappush(heap, (action_cost, q))
+        return [cost.get(g, infinity) for g in sorted(goals)]
+
+    def h_add(self, bits: int, goal_mask: int):
+        """ sum of the relaxed goal costs (not admissible, but informative)
+
+        :return: int (float inf if a goal is unreachable)
+        """
+        return sum(self.goal_costs(bits, goal_mask, additive=True))
+
+    def h_max(self, bits: int, goal_mask: int):
+        """ largest relaxed goal cost (admissible)
+
+        :return: int (float inf if a goal is unreachable)
+        """
+        return max(self.goal_costs(bits, goal_mask, additive=False), default=0)
@@ -1,4 +1,5 @@
-from aimacode.logic import PropKB
+import random
+
 from aimacode.planning import Action
 from aimacode.search import (
     Node,
@@ -8,14 +9,23 @@ from aimacode.search import (
     uniform_cost_search,
     greedy_best_first_graph_search,
     Problem,
+    path_dependent,
 )
-from aimacode.utils import expr
+from aimacode.utils import expr, Expr, LRUCache
 from lp_utils import (
     FluentState,
+    FluentIndex,
+    CompiledActions,
+    DeleteRelaxation,
     encode_state,
-    decode_state,
+    state_to_bits,
+    bits_to_state,
+    count_bits,
+    relaxed_reachable,
 )
 from my_planning_graph import PlanningGraph
+from my_pattern_database import PatternDatabaseHeuristic, air_cargo_patterns
+from my_landmarks import landmark_graph
 # from run_search import run_search
 
 import my_logging
@@ -24,7 +34,10 @@ my_logging.setup_log_level()
 
 
 class AirCargoProblem(Problem):
-    def __init__(self, cargos, planes, airports, initial: FluentState, goal: list):
+    # relaxed planning graphs kept by state, for the graphs of their children to reuse
+    RELAXED_GRAPH_CACHE_SIZE = 1024
+
+    def __init__(self, cargos, planes, airports, initial: FluentState, goal: list, bitset=False):
         """
         :param cargos: list of str
             cargos in the problem
@@ -36,14 +49,32 @@ class AirCargoProblem(Problem):
             positive and negative literal fluents (as expr) describing initial state
         :param goal: list of expr
             literal fluents required for goal test
+        :param bitset: bool
+            if True, states are int bitsets (see lp_utils.FluentIndex) rather than
+            T/F strings; the methods below accept states in either encoding and
+            return successors in the encoding they were given
         """
         self.state_map = initial.pos + initial.neg
+        self.initial_fluents = initial.pos
+        self.fluent_index = FluentIndex(self.state_map)
         self.initial_state_TF = encode_state(initial, self.state_map)
-        Problem.__init__(self, self.initial_state_TF, goal=goal)
+        self.bitset = bitset
+        if bitset:
+            Problem.__init__(self, self.fluent_index.encode(initial), goal=goal)
+        else:
+            Problem.__init__(self, self.initial_state_TF, goal=goal)
         self.cargos = cargos
         self.planes = planes
         self.airports = airports
+        self.symbols = {}
+        self.fluents = {}
         self.actions_list = self.get_actions()
+        self.compiled_actions = CompiledActions(self.actions_list, self.fluent_index)
+        self.delete_relaxation = DeleteRelaxation(self.compiled_actions)
+        self.goal_mask = self.fluent_index.mask(self.goal)
+        self.pdb_cache_dir = None
+        self.relaxed_graphs = LRUCache(self.RELAXED_GRAPH_CACHE_SIZE)
+        self.pattern_databases = {}
 
     def get_actions(self):
         """ This method creates concrete actions (no variables) for all actions in the problem
@@ -51,158 +82,172 @@ class AirCargoProblem(Problem):
         aimacode.planning module. It is computationally expensive to call this method directly;
         however, it is called in the constructor and the results cached in the `actions_list` property.
 
+        Actions that can never become applicable are pruned (see iter_actions); the number of
+        actions grounded and pruned is recorded in `num_grounded` and `num_pruned`.
+
         Returns:
         ----------
         list<Action>
             list of Action objects
         """
+        return list(self.iter_actions())
+
+    def iter_actions(self):
+        """ Lazily yield the concrete actions that are reachable from the initial state.
+
+        A first pass over the ground schemas runs a relaxed (delete-free) reachability
+        fixpoint from the initial state on precondition/add masks only. A second pass
+        yields, in schema order, an Action for each ground schema whose positive
+        preconditions are all reachable; the rest are pruned without being built.
+        Schemas that mention a fluent missing from the state map are always pruned.
+
+        :return: generator of Action objects
+        """
+        index = self.fluent_index
+        schema_masks = []
+        for name, precond_pos, precond_neg, effect_add, effect_rem in self.ground_schemas():
+            literals = precond_pos + precond_neg + effect_add + effect_rem
+            if all(f in index.bits for f in literals):
+                schema_masks.append((index.mask(precond_pos), index.mask(effect_add)))
+            else:
+                schema_masks.append(None)
+        reachable = relaxed_reachable(index.encode_fluents(self.initial_fluents), schema_masks)
+
+        self.num_grounded = self.num_pruned = 0
+        for masks, (name, precond_pos, precond_neg, effect_add, effect_rem) in \
+                zip(schema_masks, self.ground_schemas()):
+            self.num_grounded += 1
+            if masks is None or masks[0] & reachable != masks[0]:
+                self.num_pruned += 1
+                continue
+            yield Action(name, [precond_pos, precond_neg], [effect_add, effect_rem])
+
+    def ground_schemas(self):
+        """ Lazily ground the Load, Unload and Fly schemas into
+        (name, precond_pos, precond_neg, effect_add, effect_rem) tuples.
+
+        Concrete actions definition: specific literal action that does not include variables as with the schema
+        for example, the action schema 'Load(c, p, a)' can represent the concrete actions 'Load(C1, P1, SFO)'
+        or 'Load(C2, P2, JFK)'.  The actions for the planning problem must be concrete because the problems in
+        forward search and Planning Graphs must use Propositional Logic.
+
+        Literals are built straight from Expr objects rather than parsed with expr(), and the
+        same fluent always yields the same Expr object.
+
+        :return: generator of tuples
+        """
+        at, inside = self.fluent_expr('At'), self.fluent_expr('In')
+        sym = self.symbol
+        for c in self.cargos:
+            for p in self.planes:
+                for a in self.airports:
+                    yield (Expr('Load', sym(c), sym(p), sym(a)),
+                           [at(p, a), at(c, a)], [],
+                           [inside(c, p)], [at(c, a)])
+        for c in self.cargos:
+            for p in self.planes:
+                for a in self.airports:
+                    yield (Expr('Unload', sym(c), sym(p), sym(a)),
+                           [at(p, a), inside(c, p)], [],
+                           [at(c, a)], [inside(c, p)])
+        for fr in self.airports:
+            for to in self.airports:
+                if fr != to:
+                    for p in self.planes:
+                        yield (Expr('Fly', sym(p), sym(fr), sym(to)),
+                               [at(p, fr)], [],
+                               [at(p, to)], [at(p, fr)])
 
-        # Create concrete Action objects based on the domain action schema for: Load, Unload, and Fly.
-        # Concrete actions definition: specific literal action that does not include variables as with the schema
-        # for example, the action schema 'Load(c, p, a)' can represent the concrete actions 'Load(C1, P1, SFO)'
-        # or 'Load(C2, P2, JFK)'.  The actions for the planning problem must be concrete because the problems in
-        # forward search and Planning Graphs must use Propositional Logic
-
-        def load_actions():
-            """ Create all concrete Load actions and return a list
-
-            :return: list of Action objects
-            """
-            loads = []
-            for c in self.cargos:
-                for p in self.planes:
-                    for a in self.airports:
-                        precond_pos = [expr("At({}, {})".format(p, a)),
-                                       expr("At({}, {})".format(c, a))]
-                        precond_neg = []
-                        effect_add = [expr("In({}, {})".format(c, p))]
-                        effect_rem = [expr("At({}, {})".format(c, a))]
-                        load = Action(expr("Load({}, {}, {})".format(c, p, a)),
-                                      [precond_pos, precond_neg],
-                                      [effect_add, effect_rem])
-                        loads.append(load)
-            return loads
-
-        def unload_actions():
-            """ Create all concrete Unload ground actions
-            from the domain Unload ground action and return a list
-
-            :return: list of Action objects
-            """
-            unloads = []
-            for c in self.cargos:
-                for p in self.planes:
-                    for a in self.airports:
-                        precond_pos = [expr("At({}, {})".format(p, a)),
-                                       expr("In({}, {})".format(c, p))]
-                        precond_neg = []
-                        effect_add = [expr("At({}, {})".format(c, a))]
-                        effect_rem = [expr("In({}, {})".format(c, p))]
-                        unload = Action(expr("Unload({}, {}, {})".format(c, p, a)),
-                                        [precond_pos, precond_neg],
-                                        [effect_add, effect_rem])
-                        unloads.append(unload)
-            return unloads
-
-        def fly_actions():
-            """ Create all concrete Fly actions and return a list
-
-            :return: list of Action objects
-            """
-            flys = []
-            for fr in self.airports:
-                for to in self.airports:
-                    if fr != to:
-                        for p in self.planes:
-                            precond_pos = [expr("At({}, {})".format(p, fr))]
-                            precond_neg = []
-                            effect_add = [expr("At({}, {})".format(p, to))]
-                            effect_rem = [expr("At({}, {})".format(p, fr))]
-                            fly = Action(expr("Fly({}, {}, {})".format(p, fr, to)),
-                                         [precond_pos, precond_neg],
-                                         [effect_add, effect_rem])
-                            flys.append(fly)
-            return flys
-
-        return load_actions() + unload_actions() + fly_actions()
+    def symbol(self, name: str) -> Expr:
+        """ Return the shared Symbol for an object name of this problem """
+        s = self.symbols.get(name)
+        if s is None:
+            s = self.symbols[name] = Expr(name)
+        return s
+
+    def fluent_expr(self, predicate: str):
+        """ Return a function building the shared fluent Expr predicate(args...) """
+        def make(*names):
+            key = (predicate,) + names
+            f = self.fluents.get(key)
+            if f is None:
+                f = self.fluents[key] = Expr(predicate, *(self.symbol(n) for n in names))
+            return f
+        return make
+
+    def state_str(self, state) -> str:
+        """ Return the T/F string form of a state in either encoding, for printing.
+
+        :param state: str or int
+        :return: str e.g. 'FTTTFF'
+        """
+        return self.fluent_index.to_str(state)
 
     def actions(self, state: str) -> list:
         """ Return the actions that can be executed in the given state.
 
         :param state: str
             state represented as T/F string of mapped fluents (state variables)
-            e.g. 'FTTTFF'
+            e.g. 'FTTTFF', or as the equivalent int bitset
         :return: list of Action objects
         """
-        possible_actions = []
-        kb = PropKB()
-        kb.tell(decode_state(state, self.state_map).pos_sentence())
-        # logging.debug("\nKB Clauses: %r", kb.clauses)
-
-        for action in self.actions_list:
-            # logging.debug("\nAction Name / Args: %r / %r", action.name, action.args)
-            is_possible = True
-            for clause in action.precond_pos:
-                if clause not in kb.clauses:
-                    is_possible = False
-            for clause in action.precond_neg:
-                if clause in kb.clauses:
-                    is_possible = False
-            if is_possible:
-                possible_actions.append(action)
-        return possible_actions
+        return self.compiled_actions.applicable(self.fluent_index.to_bits(state))
 
     def result(self, state: str, action: Action):
         """ Return the state that results from executing the given
         action in the given state. The action must be one of
         self.actions(state).
 
+        The action's precompiled add and delete masks are applied directly to
+        the encoded state; string states go through their bitset form.
+
         :param state: state entering node
         :param action: Action applied
-        :return: resulting state after action
+        :return: resulting state after action, in the same encoding as state
         """
-        new_state = FluentState([], [])
-        old_state = decode_state(state, self.state_map)
-        for pos in old_state.pos:
-            if pos not in new_state.pos:
-                new_state.pos.append(pos)
-            if pos in new_state.neg:
-                new_state.neg.remove(pos)
-        for rem in old_state.neg:
-            if rem in new_state.pos:
-                new_state.pos.remove(rem)
-            if rem not in new_state.neg:
-                new_state.neg.append(rem)
-        for pos in action.effect_add:
-            if pos not in new_state.pos:
-                new_state.pos.append(pos)
-            if pos in new_state.neg:
-                new_state.neg.remove(pos)
-        for rem in action.effect_rem:
-            if rem in new_state.pos:
-                new_state.pos.remove(rem)
-            if rem not in new_state.neg:
-                new_state.neg.append(rem)
-        return encode_state(new_state, self.state_map)
+        masks = self.compiled_actions.masks_for(action)
+        if isinstance(state, int):
+            return masks.apply(state)
+        return bits_to_state(masks.apply(state_to_bits(state)), self.fluent_index.size)
 
     def goal_test(self, state: str) -> bool:
         """ Test the state to see if goal is reached
 
+        The goal is compiled once into goal_mask, so this is a single mask test.
+
         :param state: str representing state
         :return: bool
         """
-        kb = PropKB()
-        kb.tell(decode_state(state, self.state_map).pos_sentence())
-        for clause in self.goal:
-            if clause not in kb.clauses:
-                return False
-        return True
+        bits = self.fluent_index.to_bits(state)
+        return bits & self.goal_mask == self.goal_mask
+
+    def unsatisfied_goals(self, state) -> int:
+        """ Count the goal fluents that are not true in the state
+
+        :param state: str or int representing state
+        :return: int
+        """
+        return count_bits(self.goal_mask & ~self.fluent_index.to_bits(state))
 
     def h_1(self, node: Node):
         # note that this is not a true heuristic
         h_const = 1
         return h_const
 
+    def relaxed_planning_graph(self, node: Node) -> PlanningGraph:
+        """ The relaxed (mutex-free) planning graph of the node's state, grown from
+        the graph of its parent's state when that is still in `relaxed_graphs`, so
+        only the levels the last action changed are rebuilt.
+
+        :param node: Node
+        :return: PlanningGraph
+        """
+        pg = self.relaxed_graphs.get(node.state)
+        if pg is None:
+            parent = node.parent and self.relaxed_graphs.get(node.parent.state)
+            pg = self.relaxed_graphs[node.state] = PlanningGraph(self, node.state, mutex=False, parent=parent)
+        return pg
+
     def h_pg_levelsum(self, node: Node):
         """ This heuristic uses a planning graph representation of the problem
         state space to estimate the sum of all actions that must be carried
@@ -210,10 +255,44 @@ class AirCargoProblem(Problem):
         condition.
         """
         # requires implemented PlanningGraph class
-        pg = PlanningGraph(self, node.state)
+        # level sums ignore mutexes, so the cheaper relaxed graph gives the same values
+        pg = self.relaxed_planning_graph(node)
         pg_levelsum = pg.h_levelsum()
         return pg_levelsum
 
+    def h_pg_maxlevel(self, node: Node):
+        """ This heuristic uses a planning graph representation of the problem
+        state space to estimate the largest number of actions that must be
+        carried out from the current state to satisfy any one goal condition.
+        """
+        pg = self.relaxed_planning_graph(node)
+        return pg.h_maxlevel()
+
+    def h_pg_setlevel(self, node: Node):
+        """ This heuristic uses a planning graph representation of the problem
+        state space, including its mutexes, to estimate the number of levels
+        before all goal conditions can hold together.
+        """
+        pg = PlanningGraph(self, node.state, stop_at_goals=True)
+        return pg.h_setlevel()
+
+    def h_pg_ff(self, node: Node):
+        """ This heuristic counts the actions of a relaxed plan (ignoring delete
+        effects) extracted from a planning graph representation of the problem
+        state space; it is not admissible but usually the most informed.
+        """
+        pg = self.relaxed_planning_graph(node)
+        return pg.h_ff()
+
+    @path_dependent
+    def h_landmark_count(self, node: Node):
+        """ This heuristic counts the landmarks (facts every plan must make true) that
+        are not yet accepted on the path to the node, plus the accepted goals that
+        no longer hold; the landmarks are extracted once from the relaxed planning
+        graph of the initial state (not admissible).
+        """
+        return landmark_graph(self).h_landmark_count(node)
+
     def h_ignore_preconditions(self, node: Node):
         """ This heuristic estimates the minimum number of actions that must be
         carried out from the current state in order to satisfy all of the goal
@@ -221,13 +300,7 @@ class AirCargoProblem(Problem):
         executed.
         """
         # Implemented with reference to Russell-Norvig Ed-3 10.2.3
-        count = 0
-        kb = PropKB()
-        kb.tell(decode_state(node.state, self.state_map).pos_sentence())
-        for clause in self.goal:
-            if clause not in kb.clauses:
-                count += 1
-        return count
+        return self.unsatisfied_goals(node.state)
 
     def h_ignore_delete_lists(self, node: Node):
         """
@@ -240,17 +313,64 @@ class AirCargoProblem(Problem):
         action ever undoes progress made by another action.
         """
         # Implemented with reference to Russell-Norvig Ed-3 10.2.3, p. 377
-        count = 0
-        kb = PropKB()
-        kb.tell(decode_state(node.state, self.state_map).pos_sentence())
-        for action in self.actions_list:
-            for clause in self.goal:
-                if clause in action.effect_rem:
-                    count += 1
-            return count
+        # The optimal relaxed plan is NP-hard to find, so this is its admissible
+        # h_max lower bound: the most costly goal in the relaxed problem.
+        return self.h_max(node)
+
+    def h_max(self, node: Node):
+        """ Delete-relaxation heuristic: the relaxed cost of the most costly
+        goal, where an action costs one more than its most costly precondition
+        (admissible).
+        """
+        return self.delete_relaxation.h_max(self.fluent_index.to_bits(node.state), self.goal_mask)
+
+    def h_add(self, node: Node):
+        """ Delete-relaxation heuristic: the sum of the relaxed costs of the
+        goals, where an action costs one more than the sum of the costs of its
+        preconditions (not admissible, as it counts shared actions repeatedly,
+        but much better informed than h_max).
+        """
+        return self.delete_relaxation.h_add(self.fluent_index.to_bits(node.state), self.goal_mask)
 
+    def pattern_database(self, pattern_size=2, planes=True) -> PatternDatabaseHeuristic:
+        """ The pattern database heuristic for the default patterns of this problem, built on
+        first use and kept for reuse: the goal cargos in disjoint groups of pattern_size without
+        the planes, which are added up, and if planes is True the same groups with the planes
+        (as many as fit, see my_pattern_database.air_cargo_patterns), which are not additive and
+        count when they are larger than the sum. Tables are saved to and loaded from
+        `pdb_cache_dir` when it is set.
 
-def air_cargo_p1() -> AirCargoProblem:
+        :param pattern_size: int, cargos per pattern
+        :param planes: bool, whether to add the patterns with the planes
+        :return: PatternDatabaseHeuristic
+        """
+        key = (pattern_size, planes)
+        pdb = self.pattern_databases.get(key)
+        if pdb is None:
+            patterns = air_cargo_patterns(self, pattern_size, planes=False)
+            if planes:
+                patterns += [p for p in air_cargo_patterns(self, pattern_size) if p not in patterns]
+            pdb = self.pattern_databases[key] = PatternDatabaseHeuristic(
+                self, patterns, cache_dir=self.pdb_cache_dir)
+        return pdb
+
+    def h_pdb(self, node: Node):
+        """ Pattern database heuristic: the sum of the exact distances to the goal in the
+        projections of the problem onto disjoint pairs of goal cargos, or if larger the
+        distance in one of their projections with the planes (admissible). The tables are
+        computed once, so each call is a few lookups.
+        """
+        return self.pattern_database()(self.fluent_index.to_bits(node.state))
+
+    def h_pdb_additive(self, node: Node):
+        """ Pattern database heuristic: the sum of the exact distances to the goal of each
+        goal cargo on its own, ignoring the planes (admissible, as no action moves two
+        cargos).
+        """
+        return self.pattern_database(1, planes=False)(self.fluent_index.to_bits(node.state))
+
+
+def air_cargo_p1(bitset=False) -> AirCargoProblem:
     cargos = ['C1', 'C2']
     planes = ['P1', 'P2']
     airports = ['JFK', 'SFO']
@@ -272,9 +392,9 @@ def air_cargo_p1() -> AirCargoProblem:
     goal = [expr('At(C1, JFK)'),
             expr('At(C2, SFO)'),
             ]
-    return AirCargoProblem(cargos, planes, airports, init, goal)
+    return AirCargoProblem(cargos, planes, airports, init, goal, bitset=bitset)
 
-def air_cargo_p2() -> AirCargoProblem:
+def air_cargo_p2(bitset=False) -> AirCargoProblem:
     cargos = ['C1', 'C2', 'C3']
     planes = ['P1', 'P2', 'P3']
     airports = ['JFK', 'SFO', 'ATL']
@@ -313,9 +433,9 @@ def air_cargo_p2() -> AirCargoProblem:
             expr('At(C3, SFO)'),
             ]
 
-    return AirCargoProblem(cargos, planes, airports, init, goal)
+    return AirCargoProblem(cargos, planes, airports, init, goal, bitset=bitset)
 
-def air_cargo_p3() -> AirCargoProblem:
+def air_cargo_p3(bitset=False) -> AirCargoProblem:
     cargos = ['C1', 'C2', 'C3', 'C4']
     planes = ['P1', 'P2']
     airports = ['JFK', 'SFO', 'ATL', 'ORD']
@@ -359,7 +479,50 @@ def air_cargo_p3() -> AirCargoProblem:
             expr('At(C3, JFK)'),
             expr('At(C4, SFO)'),
             ]
-    return AirCargoProblem(cargos, planes, airports, init, goal)
+    return AirCargoProblem(cargos, planes, airports, init, goal, bitset=bitset)
+
+def air_cargo_problem(num_cargos, num_planes, num_airports, seed=None,
+                      initial=None, goal=None, bitset=False) -> AirCargoProblem:
+    """ Build an air cargo problem of any size.
+
+    Cargos are named C1..Cn, planes P1..Pn and airports A1..An. Any cargo or plane
+    missing from `initial` starts at a random airport, and any cargo missing from
+    `goal` must end at a random airport other than its start.
+
+    :param num_cargos: int
+    :param num_planes: int
+    :param num_airports: int (at least 2)
+    :param seed: seed for the random placement, so instances can be rebuilt exactly
+    :param initial: dict of object name -> airport name for the initial placement
+    :param goal: dict of cargo name -> airport name for the goal placement
+    :param bitset: bool, see AirCargoProblem
+    :return: AirCargoProblem
+    """
+    if num_airports < 2:
+        raise ValueError('An air cargo problem needs at least two airports')
+    rng = random.Random(seed)
+    cargos = ['C{}'.format(i) for i in range(1, num_cargos + 1)]
+    planes = ['P{}'.format(i) for i in range(1, num_planes + 1)]
+    airports = ['A{}'.format(i) for i in range(1, num_airports + 1)]
+    start = dict(initial or {})
+    for obj in cargos + planes:
+        if obj not in start:
+            start[obj] = rng.choice(airports)
+    finish = dict(goal or {})
+    for c in cargos:
+        if c not in finish:
+            finish[c] = rng.choice([a for a in airports if a != start[c]])
+
+    pos = [expr('At({}, {})'.format(obj, start[obj])) for obj in cargos + planes]
+    neg = []
+    for c in cargos:
+        neg.extend(expr('At({}, {})'.format(c, a)) for a in airports if a != start[c])
+        neg.extend(expr('In({}, {})'.format(c, p)) for p in planes)
+    for p in planes:
+        neg.extend(expr('At({}, {})'.format(p, a)) for a in airports if a != start[p])
+    init = FluentState(pos, neg)
+    goal = [expr('At({}, {})'.format(c, finish[c])) for c in cargos]
+    return AirCargoProblem(cargos, planes, airports, init, goal, bitset=bitset)
 
 # IMPORTANT NOTE: Run "Performance Comparison" directly (see Readme) with:
 #   - python3 run_search.py -m OR
@@ -0,0 +1,311 @@
+import weakref
+from collections import deque
+
+from aimacode.search import Node, Problem, path_dependent
+from lp_utils import state_to_bits, bit_indices, count_bits
+from my_planning_graph import PlanningGraph, planning_graph_template
+
+import my_logging
+from my_logging import *
+my_logging.setup_log_level()
+
+
+class LandmarkGraph():
+    '''
+    Landmarks of a planning problem, extracted from its relaxed planning graph by backchaining
+    from the goals (in the style of Hoffmann, Porteous and Sebastia, and of the LAMA planner).
+
+    A fact landmark is a set of literals, at least one of which holds at some point of every
+    plan (a single literal, or a disjunction of literals of the same predicate). Each goal is
+    one. For a landmark L that is not true initially, its possible first achievers are the
+    actions that add a literal of L and are reachable in the relaxed planning graph when no
+    action adding a literal of L is used; they form a disjunctive action landmark, one of which
+    every plan applies. The preconditions they share are fact landmarks greedy-necessarily
+    ordered before L, and so are, for a predicate that every achiever needs, the disjunction
+    of their preconditions of that predicate.
+
+    Literals use the ids of the problem's PlanningGraphTemplate (see planning_graph_template).
+
+    Instance variables:
+        template: PlanningGraphTemplate
+        landmarks: list of int literal masks, by landmark id
+        action_landmarks: dict of landmark id to the frozenset of the action ids of its possible
+            first achievers (no entry for the landmarks true initially)
+        orderings: set of (i, j) landmark ids where i must hold before j is first achieved
+        parents: list by landmark id of the mask of the landmarks ordered before it
+        goal_landmarks: mask of the landmarks that are goals
+        accepted_masks: NodeMap of the mask of the landmarks accepted on the path to each node
+            the heuristic has seen
+    '''
+
+    def __init__(self, problem: Problem, max_disjunction=4):
+        '''
+        :param problem: PlanningProblem (or subclass such as AirCargoProblem or HaveCakeProblem)
+        :param max_disjunction: int, the most literals in a disjunctive fact landmark
+        '''
+        self.problem = problem
+        self.template = planning_graph_template(problem)
+        self.max_disjunction = max_disjunction
+        # the literals of the initial state, and the actions of the relaxed graph once it levels off
+        self.initial = self.template.initial_mask(problem.initial)
+        pg = PlanningGraph(problem, problem.initial, mutex=False, stop_at_goals=False)
+        num_actions = len(problem.actions_list)
+        self.reachable_actions = [i for i in bit_indices(pg.a_masks[-1] if pg.a_masks else 0)
+                                  if i < num_actions]
+        self.landmarks = []
+        self.landmark_ids = {}
+        self.action_landmarks = {}
+        self.orderings = set()
+        self.goal_landmarks = 0
+        self.extract()
+        self.parents = [0] * len(self.landmarks)
+        for i, j in self.orderings:
+            self.parents[j] |= 1 << i
+        self.compile_state_masks()
+        self.accepted_masks = NodeMap()
+
+    def add_landmark(self, mask: int, queue: deque) -> int:
+        ''' id of the landmark with the literals of mask, queueing it for backchaining if new
+
+        :param mask: int literal mask
+        :param queue: deque of landmark ids
+        :return: int
+        '''
+        j = self.landmark_ids.get(mask)
+        if j is None:
+            j = self.landmark_ids[mask] = len(self.landmarks)
+            self.landmarks.append(mask)
+            queue.append(j)
+        return j
+
+    def extract(self):
+        ''' backchain from the goal landmarks, filling landmarks, action_landmarks and orderings
+
+        :return:
+            fills the instance variables
+        '''
+        template = self.template
+        queue = deque()
+        for l in bit_indices(template.goal_mask):
+            self.goal_landmarks |= 1 << self.add_landmark(1 << l, queue)
+        while queue:
+            j = queue.popleft()
+            mask = self.landmarks[j]
+            if mask & self.initial:
+                continue
+            achievers = self.first_achievers(mask)
+            if not achievers:
+                continue
+            self.action_landmarks[j] = frozenset(achievers)
+            shared = -1
+            for i in achievers:
+                shared &= template.pre_masks[i]
+            for l in bit_indices(shared):
+                self.orderings.add((self.add_landmark(1 << l, queue), j))
+            for disjunction in self.disjunctions(achievers, shared):
+                self.orderings.add((self.add_landmark(disjunction, queue), j))
+
+    def first_achievers(self, mask: int) -> list:
+        ''' the actions that can first achieve a literal of mask: they add one, and their
+        preconditions are reachable in the relaxed graph without adding any
+
+        :param mask: int literal mask
+        :return: list of int action ids
+        '''
+        template = self.template
+        reachable = self.relaxed_reachable(mask)
+        return [i for i in self.reachable_actions
+                if template.eff_masks[i] & mask and not template.pre_masks[i] & ~reachable]
+
+    def relaxed_reachable(self, excluded: int) -> int:
+        ''' literals of the relaxed planning graph when it levels off, without the actions that
+        add a literal of excluded
+
+        :param excluded: int literal mask
+        :return: int literal mask
+        '''
+        template = self.template
+        pending = [i for i in self.reachable_actions if not template.eff_masks[i] & excluded]
+        reachable = self.initial
+        changed = True
+        while changed:
+            changed = False
+            waiting = []
+            for i in pending:
+                if not template.pre_masks[i] & ~reachable:
+                    if template.eff_masks[i] & ~reachable:
+                        reachable |= template.eff_masks[i]
+                        changed = True
+                else:
+                    waiting.append(i)
+            pending = waiting
+        return reachable
+
+    def disjunctions(self, achievers: list, shared: int) -> list:
+        ''' for each predicate that every achiever has a precondition of (besides the shared
+        ones), the disjunction of those preconditions, if it has two to max_disjunction literals,
+        none true initially and none already a fact landmark
+
+        :param achievers: list of int action ids
+        :param shared: int literal mask of the preconditions common to all the achievers
+        :return: list of int literal masks
+        '''
+        template = self.template
+        by_predicate = None
+        for i in achievers:
+            predicates = {}
+            for l in bit_indices(template.pre_masks[i] & ~shared):
+                op = template.literals[l][0].op
+                predicates[op] = predicates.get(op, 0) | 1 << l
+            if by_predicate is None:
+                by_predicate = predicates
+            else:
+                by_predicate = {op: by_predicate[op] | m for op, m in predicates.items() if op in by_predicate}
+        disjunctions = []
+        for op, mask in sorted((by_predicate or {}).items()):
+            if 2 <= count_bits(mask) <= self.max_disjunction and not mask & self.initial and \
+                    not any((1 << l) in self.landmark_ids for l in bit_indices(mask)):
+                disjunctions.append(mask)
+        return disjunctions
+
+    def compile_state_masks(self):
+        ''' masks to test each landmark against a bitset state (bit n-1-i is fluent i): a landmark
+        holds if the state has a fluent of pos_bits set or a fluent of neg_bits clear
+
+        :return:
+            fills pos_bits and neg_bits, by landmark id
+        '''
+        n = self.template.num_fluents
+        self.pos_bits, self.neg_bits = [], []
+        for mask in self.landmarks:
+            pos = neg = 0
+            for l in bit_indices(mask):
+                fluent = l >> 1
+                if fluent < n:
+                    if l & 1:
+                        neg |= 1 << (n - 1 - fluent)
+                    else:
+                        pos |= 1 << (n - 1 - fluent)
+            self.pos_bits.append(pos)
+            self.neg_bits.append(neg)
+
+    def literals(self, j: int) -> list:
+        ''' the literals of landmark j
+
+        :param j: int landmark id
+        :return: list of (fluent, is_pos)
+        '''
+        return [self.template.literals[l] for l in bit_indices(self.landmarks[j])]
+
+    def true_landmarks(self, bits: int) -> int:
+        ''' mask of the landmarks that hold in a bitset state
+
+        :param bits: int
+        :return: int
+        '''
+        true = 0
+        for j, (pos, neg) in enumerate(zip(self.pos_bits, self.neg_bits)):
+            if bits & pos or ~bits & neg:
+                true |= 1 << j
+        return true
+
+    def accepted(self, node: Node) -> int:
+        ''' mask of the landmarks accepted on the path to node, kept in accepted_masks
+
+        The landmarks true at the root of the path are accepted there; further on, a landmark is
+        accepted once it holds and every landmark ordered before it was accepted by the parent.
+
+        :param node: Node
+        :return: int
+        '''
+        accepted = self.accepted_masks.get(node)
+        if accepted is None:
+            true = self.true_landmarks(self.state_bits(node.state))
+            if node.parent is None:
+                accepted = true
+            else:
+                parent = self.accepted(node.parent)
+                accepted = parent
+                for j in bit_indices(true & ~parent):
+                    if not self.parents[j] & ~parent:
+                        accepted |= 1 << j
+            self.accepted_masks[node] = accepted
+        return accepted
+
+    @path_dependent
+    def h_landmark_count(self, node: Node) -> int:
+        ''' Landmark-Count Heuristic: the landmarks not yet accepted on the path to node, plus the
+        accepted ones that are false but still required, because they are goals or ordered before
+        a landmark not yet accepted (LAMA's heuristic; not admissible)
+
+        Two paths to the same state can accept different landmarks, so the value must not be
+        cached by state; it is marked path_dependent, which Problem.cached_heuristic refuses.
+
+        :param node: Node
+        :return: int
+        '''
+        accepted = self.accepted(node)
+        unaccepted = ~accepted & ((1 << len(self.landmarks)) - 1)
+        required = self.goal_landmarks
+        for j in bit_indices(unaccepted):
+            required |= self.parents[j]
+        true = self.true_landmarks(self.state_bits(node.state))
+        return count_bits(unaccepted) + count_bits(accepted & ~true & required)
+
+    @staticmethod
+    def state_bits(state) -> int:
+        ''' bitset form of a state in either encoding
+
+        :param state: str of T/F or int
+        :return: int
+        '''
+        return state if isinstance(state, int) else state_to_bits(state)
+
+
+class NodeMap():
+    '''
+    A dict keyed by search Node identity that holds its nodes weakly, dropping the entry of a
+    node once the search lets go of it.
+
+    A WeakKeyDictionary would not do: Nodes compare and hash by state, so two paths to the
+    same state would share one entry, while the accepted landmarks differ from path to path.
+    '''
+
+    def __init__(self):
+        self.entries = {}
+
+    def get(self, node: Node, default=None):
+        ''' the value kept for this very node, or default
+
+        :param node: Node
+        :return: the value, or default
+        '''
+        entry = self.entries.get(id(node))
+        if entry is None or entry[0]() is not node:
+            return default
+        return entry[1]
+
+    def __setitem__(self, node: Node, value):
+        key = id(node)
+        entries = self.entries
+
+        def forget(ref):
+            # the id may have been reused by a newer node since
+            if key in entries and entries[key][0] is ref:
+                del entries[key]
+        entries[key] = (weakref.ref(node, forget), value)
+
+    def __len__(self):
+        return len(self.entries)
+
+
+def landmark_graph(problem: Problem) -> LandmarkGraph:
+    ''' the LandmarkGraph of the problem, extracted on first use and cached on the problem
+
+    :param problem: PlanningProblem (or subclass such as AirCargoProblem or HaveCakeProblem)
+    :return: LandmarkGraph
+    '''
+    graph = getattr(problem, 'lm_graph', None)
+    if graph is None:
+        graph = problem.lm_graph = LandmarkGraph(problem)
+    return graph
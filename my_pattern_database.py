@@ -0,0 +1,367 @@
+import hashlib
+import os
+import sys
+from array import array
+from collections import OrderedDict
+
+from aimacode.search import Problem
+
+import my_logging
+from my_logging import *
+my_logging.setup_log_level()
+
+
+def air_cargo_variables(problem: Problem) -> OrderedDict:
+    ''' the multi-valued state variables of an air cargo problem
+
+    Every cargo is at exactly one airport or in exactly one plane, and every plane is at
+    exactly one airport, so the fluents of each object form a variable with one value per
+    fluent. Fluents missing from the problem's state map are left out of the domains.
+
+    :param problem: AirCargoProblem
+    :return: OrderedDict of object name -> tuple of fluents (its domain), cargos first
+    '''
+    at, inside = problem.fluent_expr('At'), problem.fluent_expr('In')
+    variables = OrderedDict()
+    for c in problem.cargos:
+        domain = [at(c, a) for a in problem.airports] + [inside(c, p) for p in problem.planes]
+        variables[c] = tuple(f for f in domain if f in problem.fluent_index.bits)
+    for p in problem.planes:
+        variables[p] = tuple(f for f in (at(p, a) for a in problem.airports)
+                             if f in problem.fluent_index.bits)
+    return variables
+
+
+# the most abstract states of a default pattern, so its table builds in about a second
+PATTERN_MAX_SIZE = 10**5
+
+
+def abstract_size(pattern, variables) -> int:
+    ''' the number of abstract states of a pattern, the product of its domain sizes
+
+    :param pattern: iterable of variable names
+    :param variables: OrderedDict of variable name -> domain
+    :return: int
+    '''
+    size = 1
+    for v in pattern:
+        size *= len(variables[v])
+    return size
+
+
+def air_cargo_patterns(problem: Problem, pattern_size=2, planes=True, max_size=PATTERN_MAX_SIZE) -> list:
+    ''' default patterns for an air cargo problem: the cargos named in the goal, in groups
+    of pattern_size, each group with every plane if planes is True
+
+    Patterns with the planes are not additive (Fly changes a plane in all of them) but see
+    how loading depends on flying; cargo-only patterns ignore the planes and are additive.
+    A pattern is kept within max_size abstract states (the table grows as airports to the
+    power of the planes): a group of cargos too big even without planes is split into single
+    cargos, then planes are dropped from each pattern until it fits.
+
+    :param problem: AirCargoProblem
+    :param pattern_size: int, cargos per pattern
+    :param planes: bool
+    :param max_size: int, the most abstract states of a pattern
+    :return: list of tuple of variable names
+    '''
+    variables = air_cargo_variables(problem)
+    goal_fluents = set(problem.goal)
+    cargos = [c for c in problem.cargos if goal_fluents.intersection(variables[c])]
+    groups = []
+    for i in range(0, len(cargos), pattern_size):
+        group = tuple(cargos[i:i + pattern_size])
+        if abstract_size(group, variables) > max_size:
+            groups.extend((c,) for c in group)
+        else:
+            groups.append(group)
+    patterns = []
+    for group in groups:
+        kept = list(problem.planes) if planes else []
+        while kept and abstract_size(group + tuple(kept), variables) > max_size:
+            kept.pop()
+        patterns.append(group + tuple(kept))
+    return patterns
+
+
+PDB_FORMAT = b'PDB1'
+
+
+class PatternDatabase():
+    ''' exact goal distances of an abstraction of a planning problem, the projection of its
+    states onto a pattern (a subset of its multi-valued state variables)
+
+    An abstract state holds one value per pattern variable and is numbered in mixed radix,
+    so its distance is one array lookup. Ground actions are projected onto the pattern by
+    keeping only their preconditions and effects on pattern variables; actions without
+    such effects become self-loops and are dropped. Dropping conditions only adds abstract
+    transitions, so every abstract distance is a lower bound of the real one (admissible).
+
+    The table is filled by a breadth first search backwards from every abstract goal
+    state, regressing each state through the abstract actions whose effects it satisfies.
+    '''
+
+    def __init__(self, problem: Problem, pattern, variables=None, max_size=10**7):
+        '''
+        :param problem: AirCargoProblem (any problem with compiled_actions, fluent_index and goal)
+        :param pattern: iterable of variable names
+        :param variables: OrderedDict of variable name -> domain, by default air_cargo_variables(problem)
+        :param max_size: largest number of abstract states to tabulate; bigger patterns raise ValueError
+        '''
+        variables = air_cargo_variables(problem) if variables is None else variables
+        self.pattern = tuple(pattern)
+        index = problem.fluent_index
+        self.domains = [tuple(index.bits[f] for f in variables[v]) for v in self.pattern]
+        self.size = 1
+        self.strides = []
+        for domain in self.domains:
+            self.strides.append(self.size)
+            self.size *= len(domain)
+        if self.size > max_size:
+            raise ValueError('Pattern {} has {} abstract states, more than {}'.format(
+                self.pattern, self.size, max_size))
+        self.masks = [sum(domain) for domain in self.domains]
+        # bits of a variable's fluents -> contribution of its value to the abstract state number
+        self.offsets = [{bit: value * stride for value, bit in enumerate(domain)}
+                        for domain, stride in zip(self.domains, self.strides)]
+        self.actions = self.abstract_actions(problem.compiled_actions.masks)
+        self.goal = self.project(problem.goal_mask)
+        self.key = self.fingerprint(problem)
+        self.table = None
+        self.unreachable = None
+
+    def project(self, mask: int) -> dict:
+        ''' the values a mask of fluents gives the pattern variables
+
+        :param mask: int
+        :return: dict of pattern variable position -> value
+        '''
+        values = {}
+        for var, domain in enumerate(self.domains):
+            for value, bit in enumerate(domain):
+                if mask & bit:
+                    values[var] = value
+        return values
+
+    def abstract_actions(self, action_masks) -> list:
+        ''' project ground actions onto the pattern, dropping self-loops and duplicates
+
+        :param action_masks: list of ActionMasks
+        :return: list of (precondition dict, effect dict) over pattern variable positions
+        '''
+        actions = OrderedDict()
+        for m in action_masks:
+            effects = self.project(m.add)
+            if effects:
+                pre = self.project(m.pre_pos)
+                actions[(tuple(sorted(pre.items())), tuple(sorted(effects.items())))] = (pre, effects)
+        return list(actions.values())
+
+    def fingerprint(self, problem: Problem) -> str:
+        ''' digest of everything the table depends on, to recognize a saved table
+
+        :param problem: AirCargoProblem
+        :return: str
+        '''
+        digest = hashlib.sha1()
+        digest.update(repr((self.pattern, self.domains, problem.goal_mask)).encode())
+        for pre, effects in self.actions:
+            digest.update(repr((sorted(pre.items()), sorted(effects.items()))).encode())
+        return digest.hexdigest()
+
+    def build(self):
+        ''' fill the distance table by backward breadth first search
+
+        Distances are stored in an array('B'), widened to array('H') should any reach 255;
+        the largest value of the typecode marks abstract states that cannot reach the goal.
+        '''
+        table = array('B', [255]) * self.size
+        unreachable = 255
+        # index the abstract actions by the value of their first effect variable
+        regress = [[[] for _ in domain] for domain in self.domains]
+        for pre, effects in self.actions:
+            var, value = min(effects.items())
+            checks = [(self.strides[v], len(self.domains[v]), effects.get(v, pre.get(v)))
+                      for v in sorted(set(pre) | set(effects))]
+            changes = [(self.strides[v], len(self.domains[v]), effects[v], pre.get(v))
+                       for v in sorted(effects)]
+            regress[var][value].append((checks, changes))
+
+        frontier = self.goal_states()
+        for s in frontier:
+            table[s] = 0
+        depth = 0
+        while frontier:
+            depth += 1
+            if depth >= unreachable:
+                table = array('H', (65535 if d == unreachable else d for d in table))
+                unreachable = 65535
+            successors = []
+            for s in frontier:
+                for var, stride in enumerate(self.strides):
+                    for checks, changes in regress[var][s // stride % len(self.domains[var])]:
+                        if any(value is not None and s // w % n != value for w, n, value in checks):
+                            continue
+                        for p in self.predecessors(s, changes):
+                            if table[p] == unreachable:
+                                table[p] = depth
+                                successors.append(p)
+            frontier = successors
+        self.table = table
+        self.unreachable = unreachable
+        logging.debug("PatternDatabase %r: %d abstract states, %d actions, max distance %d",
+                      self.pattern, self.size, len(self.actions), depth - 1)
+        return self
+
+    def goal_states(self) -> list:
+        ''' every abstract state that agrees with the goal on the pattern variables
+
+        :return: list of int
+        '''
+        states = [0]
+        for var, (stride, domain) in enumerate(zip(self.strides, self.domains)):
+            values = [self.goal[var]] if var in self.goal else range(len(domain))
+            states = [s + value * stride for s in states for value in values]
+        return states
+
+    @staticmethod
+    def predecessors(s: int, changes) -> list:
+        ''' abstract states from which an action with the given changes leads to s
+
+        A changed variable takes the action's precondition value, or any value if the
+        action does not require one.
+
+        :param s: int abstract state already known to satisfy the action's effects
+        :param changes: list of (stride, domain size, effect value, precondition value or None)
+        :return: list of int
+        '''
+        states = [s]
+        for stride, n, effect, pre in changes:
+            base = -effect * stride
+            values = [pre] if pre is not None else range(n)
+            states = [p + base + value * stride for p in states for value in values]
+        return states
+
+    def abstract_state(self, bits: int) -> int:
+        ''' number of the abstract state of a bitset state
+
+        :param bits: int
+        :return: int
+        '''
+        return sum(offsets[bits & mask] for offsets, mask in zip(self.offsets, self.masks))
+
+    def distance(self, bits: int):
+        ''' abstract goal distance of a bitset state
+
+        :param bits: int
+        :return: int (float inf if the goal is unreachable in the abstraction)
+        '''
+        d = self.table[self.abstract_state(bits)]
+        return float('inf') if d == self.unreachable else d
+
+    def save(self, path: str):
+        ''' write the table to a file that load() can read back: a one-line header with the
+        format, fingerprint, typecode, size and byte order of the table, then its raw bytes
+
+        :param path: str
+        '''
+        header = ' '.join([PDB_FORMAT.decode(), self.key, self.table.typecode,
+                           str(len(self.table)), sys.byteorder])
+        with open(path, 'wb') as f:
+            f.write(header.encode() + b'\n')
+            self.table.tofile(f)
+
+    def load(self, path: str) -> bool:
+        ''' read a table written by save(), if it was computed for this same abstraction
+
+        The file holds no code, only the header and the table bytes, and anything unexpected
+        in it (a missing, truncated, stale or foreign file) is treated as no table at all.
+
+        :param path: str
+        :return: bool, False (and no table loaded) if the file is missing or does not match
+        '''
+        try:
+            with open(path, 'rb') as f:
+                fields = f.readline(256).split()
+                if len(fields) != 5 or fields[0] != PDB_FORMAT or fields[1].decode() != self.key:
+                    return False
+                typecode, size, byteorder = fields[2].decode(), int(fields[3]), fields[4].decode()
+                if typecode not in ('B', 'H') or size != self.size or byteorder not in ('little', 'big'):
+                    return False
+                table = array(typecode)
+                table.fromfile(f, size)
+                if f.read(1):
+                    return False
+        except Exception:
+            return False
+        if byteorder != sys.byteorder:
+            table.byteswap()
+        self.table = table
+        self.unreachable = 255 if table.typecode == 'B' else 65535
+        return True
+
+
+class PatternDatabaseHeuristic():
+    ''' combines the pattern databases of several patterns into one admissible heuristic
+
+    Patterns are additive when no action changes variables of two of them, so each action is
+    counted in at most one database. The patterns are split greedily, in order, into groups
+    of mutually additive ones; the heuristic is the largest over the groups of the sum of
+    their distances (so one group of disjoint patterns is simply added up).
+    '''
+
+    def __init__(self, problem: Problem, patterns, variables=None, cache_dir=None):
+        '''
+        :param problem: AirCargoProblem
+        :param patterns: list of iterables of variable names
+        :param variables: OrderedDict of variable name -> domain, by default air_cargo_variables(problem)
+        :param cache_dir: directory where tables are saved and reused from, or None
+        '''
+        variables = air_cargo_variables(problem) if variables is None else variables
+        self.databases = [PatternDatabase(problem, pattern, variables) for pattern in patterns]
+        for db in self.databases:
+            path = cache_dir and os.path.join(cache_dir, 'pdb-{}.bin'.format(db.key))
+            if not (path and db.load(path)):
+                db.build()
+                if path:
+                    os.makedirs(cache_dir, exist_ok=True)
+                    db.save(path)
+        self.groups = self.additive_groups(problem, variables)
+        self.additive = len(self.groups) <= 1
+
+    def additive_groups(self, problem: Problem, variables) -> list:
+        ''' split the databases, in order, into groups in which no action changes variables
+        of two patterns
+
+        :return: list of lists of database positions
+        '''
+        index = problem.fluent_index
+        pattern_masks = [index.mask(f for v in db.pattern for f in variables[v]) for db in self.databases]
+        conflicts = [0] * len(self.databases)
+        for m in problem.compiled_actions.masks:
+            touched = 0
+            for k, mask in enumerate(pattern_masks):
+                if m.add & mask:
+                    touched |= 1 << k
+            for k in range(len(self.databases)):
+                if touched >> k & 1:
+                    conflicts[k] |= touched & ~(1 << k)
+        groups = []
+        for k in range(len(self.databases)):
+            for group in groups:
+                if not conflicts[k] & group[1]:
+                    group[0].append(k)
+                    group[1] |= 1 << k
+                    break
+            else:
+                groups.append([[k], 1 << k])
+        return [members for members, _ in groups]
+
+    def __call__(self, bits: int):
+        ''' heuristic value of a bitset state
+
+        :param bits: int
+        :return: int (float inf if some abstraction cannot reach the goal)
+        '''
+        distances = [db.distance(bits) for db in self.databases]
+        return max((sum(distances[k] for k in group) for group in self.groups), default=0)
@@ -1,7 +1,7 @@
 from aimacode.planning import Action
 from aimacode.search import Problem
-from aimacode.utils import expr
-from lp_utils import decode_state
+from aimacode.utils import expr, Expr
+from lp_utils import decode_state, bits_to_state, bit_indices
 
 import my_logging
 from my_logging import *
@@ -14,8 +14,12 @@ class PgNode():
     parents: the set of nodes in the previous level
     children: the set of nodes in the subsequent level
     mutex: the set of sibling nodes that are mutually exclusive with this node
+
+    Nodes (and those of the subclasses) have __slots__ rather than a __dict__.
     '''
 
+    __slots__ = ('parents', 'children', 'mutex')
+
     def __init__(self):
         self.parents = set()
         self.children = set()
@@ -58,16 +62,24 @@ class PgNode_s(PgNode):
     is_pos : bool
         Boolean flag indicating whether the literal expression is positive or
         negative.
+
+    literal : expr, optional
+        The literal form of the fluent, when it is already known (see
+        PlanningGraphTemplate.literal_exprs).
     '''
 
-    def __init__(self, symbol: str, is_pos: bool):
+    __slots__ = ('symbol', 'is_pos', 'literal')
+
+    def __init__(self, symbol: str, is_pos: bool, literal=None):
         ''' S-level Planning Graph node constructor
 
         :param symbol: expr
         :param is_pos: bool
+        :param literal: expr, optional
         Instance variables calculated:
             literal: expr
-                    fluent in its literal form including negative operator if applicable
+                    fluent in its literal form including negative operator if applicable; built from the
+                    symbol without parsing it unless given
         Instance variables inherited from PgNode:
             parents: set of nodes connected to this node in previous A level; initially empty
             children: set of nodes connected to this node in next A level; initially empty
@@ -76,9 +88,9 @@ class PgNode_s(PgNode):
         PgNode.__init__(self)
         self.symbol = symbol
         self.is_pos = is_pos
-        self.literal = expr(self.symbol)
-        if not self.is_pos:
-            self.literal = expr('~{}'.format(self.symbol))
+        if literal is None:
+            literal = literal_expr(symbol, is_pos)
+        self.literal = literal
 
     def show(self):
         '''helper print for debugging shows literal plus counts of parents, children, siblings
@@ -113,15 +125,32 @@ class PgNode_s(PgNode):
         return hash(self.symbol) ^ hash(self.is_pos)
 
 
+def literal_expr(symbol, is_pos: bool) -> Expr:
+    ''' the literal of a fluent: the fluent itself, or its negation
+
+    :param symbol: expr (or str, which is parsed)
+    :param is_pos: bool
+    :return: expr
+    '''
+    fluent = expr(symbol) if isinstance(symbol, str) else symbol
+    return fluent if is_pos else Expr('~', fluent)
+
+
 class PgNode_a(PgNode):
     '''A-type (action) Planning Graph node - inherited from PgNode
     '''
 
-    def __init__(self, action: Action):
+    __slots__ = ('action', 'prenodes', 'effnodes', 'is_persistent')
+
+    def __init__(self, action: Action, prenodes=None, effnodes=None):
         '''A-level Planning Graph node constructor
 
         :param action: Action
             a ground action, i.e. this action cannot contain any variables
+        :param prenodes: set of PgNode_s, optional
+        :param effnodes: set of PgNode_s, optional
+            precondition and effect S-nodes computed once by a PlanningGraphTemplate; they are
+            only read, so one set can be shared by the nodes of the same action in many graphs
         Instance variables calculated:
             An A-level will always have an S-level as its parent and an S-level as its child.
             The preconditions and effects will become the parents and children of the A-level node
@@ -136,8 +165,8 @@ class PgNode_a(PgNode):
        '''
         PgNode.__init__(self)
         self.action = action
-        self.prenodes = self.precond_s_nodes()
-        self.effnodes = self.effect_s_nodes()
+        self.prenodes = self.precond_s_nodes() if prenodes is None else prenodes
+        self.effnodes = self.effect_s_nodes() if effnodes is None else effnodes
         self.is_persistent = False
         if self.prenodes == self.effnodes:
             self.is_persistent = True
@@ -213,31 +242,162 @@ def mutexify(node1: PgNode, node2: PgNode):
 def is_effect_mutex(eff1, eff2):
     return True if [e1 for e1 in eff1 if e1 in eff2] else False
 
-class PlanningGraph():
+class PlanningGraphTemplate():
     '''
-    A planning graph as described in chapter 10 of the AIMA text. The planning
-    graph can be used to reason about 
+    The parts of a planning graph that depend only on the problem, compiled once and shared by
+    every PlanningGraph built for it (see planning_graph_template), so that a per-state graph
+    only walks the literals and actions reachable from its S0 level.
+
+    Literals are numbered 2i for the positive and 2i+1 for the negative literal of fluent i of
+    the problem's state_map; fluents that appear only in goals or actions are numbered after those.
+
+    Instance variables:
+        literals: list of (fluent, is_pos) by literal id
+        literal_ids: dict of (fluent, is_pos) to literal id
+        literal_exprs: list by literal id of the literal as an expr, shared by every S-node of the literal
+        actions: the problem's actions_list followed by the no-op actions
+        prenodes, effnodes: lists by action id of the frozensets of PgNode_s for the
+            preconditions and effects of each action, shared by all graphs (never mutated)
+        preconds, effects: lists by action id of the tuples of precondition / effect literal ids
+        pre_masks, eff_masks: lists by action id of the same literals as bit masks (bit i is literal i)
+        persistent: list by action id of whether the action is a no-op (same preconditions and effects)
+        consumers: list by literal id of the ids of the actions with that literal as a precondition
+        achievers: list by literal id of the mask of the actions (bit i is action i) with that
+            literal as an effect
+        consumer_masks: list by literal id of the mask of the actions with that literal as a precondition
+        static_mutex: list by action id of the mask of the actions that are mutex with it at every
+            level, by inconsistent effects or interference
+        effect_tables: for each byte of the action ids, the OR of the eff_masks of each subset
+            of its 8 actions, indexed by the subset's bits (see effects_of)
+        nonpersistent: mask of the actions that are not no-ops, for serial planning graphs
+        unconditional: ids of the actions without preconditions
+        goal_mask: mask of the (positive) goal literals
     '''
 
-    def __init__(self, problem: Problem, state: str, serial_planning=True):
+    def __init__(self, problem: Problem):
         '''
         :param problem: PlanningProblem (or subclass such as AirCargoProblem or HaveCakeProblem)
-        :param state: str (will be in form TFTTFF... representing fluent states)
-        :param serial_planning: bool (whether or not to assume that only one action can occur at a time)
-        Instance variable calculated:
-            fs: FluentState
-                the state represented as positive and negative fluent literal lists
-            all_actions: list of the PlanningProblem valid ground actions combined with calculated no-op actions
-            s_levels: list of sets of PgNode_s, where each set in the list represents an S-level in the planning graph
-            a_levels: list of sets of PgNode_a, where each set in the list represents an A-level in the planning graph
         '''
-        self.problem = problem
-        self.fs = decode_state(state, problem.state_map)
-        self.serial = serial_planning
-        self.all_actions = self.problem.actions_list + self.noop_actions(self.problem.state_map)
-        self.s_levels = []
-        self.a_levels = []
-        self.create_graph()
+        self.literals = []
+        self.literal_ids = {}
+        self.literal_exprs = []
+        for fluent in problem.state_map:
+            self.literal_id(fluent, True)
+        self.num_fluents = len(problem.state_map)
+        self.goal_mask = literal_mask(self.literal_id(goal, True) for goal in problem.goal)
+        self.actions = problem.actions_list + self.noop_actions(problem.state_map)
+        self.prenodes, self.effnodes = [], []
+        self.preconds, self.effects = [], []
+        self.unconditional = []
+        for i, a in enumerate(self.actions):
+            preconds = tuple([self.literal_id(f, True) for f in a.precond_pos] +
+                             [self.literal_id(f, False) for f in a.precond_neg])
+            effects = tuple([self.literal_id(f, True) for f in a.effect_add] +
+                            [self.literal_id(f, False) for f in a.effect_rem])
+            self.preconds.append(preconds)
+            self.effects.append(effects)
+            self.prenodes.append(frozenset(self.s_node(l) for l in preconds))
+            self.effnodes.append(frozenset(self.s_node(l) for l in effects))
+            if not preconds:
+                self.unconditional.append(i)
+        self.pre_masks = [literal_mask(preconds) for preconds in self.preconds]
+        self.eff_masks = [literal_mask(effects) for effects in self.effects]
+        self.persistent = [pre == eff for pre, eff in zip(self.pre_masks, self.eff_masks)]
+        self.consumers = [[] for _ in self.literals]
+        self.consumer_masks = [0] * len(self.literals)
+        self.achievers = [0] * len(self.literals)
+        for i, (preconds, effects) in enumerate(zip(self.preconds, self.effects)):
+            for l in set(preconds):
+                self.consumers[l].append(i)
+                self.consumer_masks[l] |= 1 << i
+            for l in set(effects):
+                self.achievers[l] |= 1 << i
+        # the positive literals, to swap each literal of a mask with its negation
+        self.pos_mask = literal_mask(range(0, len(self.literals), 2))
+        self.nonpersistent = literal_mask(i for i, persistent in enumerate(self.persistent) if not persistent)
+        self.static_mutex = [self.static_action_mutex(i) for i in range(len(self.actions))]
+        self.effect_tables = []
+        for base in range(0, len(self.actions), 8):
+            table = [0] * 256
+            for subset in range(1, 256):
+                low = subset & -subset
+                i = base + low.bit_length() - 1
+                table[subset] = table[subset ^ low] | (self.eff_masks[i] if i < len(self.actions) else 0)
+            self.effect_tables.append(table)
+
+    def literal_id(self, fluent, is_pos: bool) -> int:
+        ''' id of the literal, numbering the fluent (both its literals) if it is new
+
+        :param fluent: expr
+        :param is_pos: bool
+        :return: int
+        '''
+        key = (fluent, is_pos)
+        if key not in self.literal_ids:
+            for pos in (True, False):
+                self.literal_ids[(fluent, pos)] = len(self.literals)
+                self.literals.append((fluent, pos))
+                self.literal_exprs.append(literal_expr(fluent, pos))
+        return self.literal_ids[key]
+
+    def s_node(self, literal_id: int) -> PgNode_s:
+        ''' a new S-node for the literal id
+
+        :param literal_id: int
+        :return: PgNode_s
+        '''
+        fluent, is_pos = self.literals[literal_id]
+        return PgNode_s(fluent, is_pos, self.literal_exprs[literal_id])
+
+    def initial_mask(self, state) -> int:
+        ''' literal mask of a state, for the S0 level of a graph
+
+        :param state: str (TFTTFF... in state_map order) or the equivalent int bitset
+        :return: int
+        '''
+        if isinstance(state, int):
+            state = bits_to_state(state, self.num_fluents)
+        mask = 0
+        for i, value in enumerate(state):
+            mask |= 1 << (2 * i + (value != 'T'))
+        return mask
+
+    def static_action_mutex(self, i: int) -> int:
+        ''' mask of the actions with inconsistent effects with, or interfering with, action i:
+        those with an effect or a precondition that negates an effect of i, or with an effect
+        that negates a precondition of i
+
+        :param i: int
+        :return: int
+        '''
+        mutex = 0
+        for l in bit_indices(self.negate(self.eff_masks[i])):
+            mutex |= self.achievers[l] | self.consumer_masks[l]
+        for l in bit_indices(self.negate(self.pre_masks[i])):
+            mutex |= self.achievers[l]
+        return mutex & ~(1 << i)
+
+    def effects_of(self, action_mask: int) -> int:
+        ''' the OR of the eff_masks of the actions in action_mask, one table lookup per byte
+
+        :param action_mask: int
+        :return: int literal mask
+        '''
+        effects = 0
+        for table in self.effect_tables:
+            if not action_mask:
+                break
+            effects |= table[action_mask & 255]
+            action_mask >>= 8
+        return effects
+
+    def negate(self, mask: int) -> int:
+        ''' the mask of the negations of the literals in mask
+
+        :param mask: int
+        :return: int
+        '''
+        return ((mask & self.pos_mask) << 1) | ((mask >> 1) & self.pos_mask)
 
     def noop_actions(self, literal_list):
         '''create persistent action for each possible fluent
@@ -255,7 +415,8 @@ class PlanningGraph():
         negative precondition and remove the literal expression as an effect in
         the output.
 
-        This function should only be called by the class constructor.
+        This function should only be called by the class constructor, so the no-ops are built
+        once per problem rather than once per graph.
 
         :param literal_list:
         :return: list of Action
@@ -268,7 +429,98 @@ class PlanningGraph():
             action_list.append(act2)
         return action_list
 
-    def create_graph(self):
+
+def literal_mask(literal_ids) -> int:
+    ''' bit mask with the bit of each literal (or action) id set
+
+    :param literal_ids: iterable of int
+    :return: int
+    '''
+    mask = 0
+    for l in literal_ids:
+        mask |= 1 << l
+    return mask
+
+
+def planning_graph_template(problem: Problem) -> PlanningGraphTemplate:
+    ''' the PlanningGraphTemplate of the problem, compiled on first use and cached on the problem
+
+    :param problem: PlanningProblem (or subclass such as AirCargoProblem or HaveCakeProblem)
+    :return: PlanningGraphTemplate
+    '''
+    template = getattr(problem, 'pg_template', None)
+    if template is None:
+        template = problem.pg_template = PlanningGraphTemplate(problem)
+    return template
+
+
+class PlanningGraph():
+    '''
+    A planning graph as described in chapter 10 of the AIMA text. The planning
+    graph can be used to reason about 
+    '''
+
+    def __init__(self, problem: Problem, state: str, serial_planning=True, mutex=True,
+                 stop_at_goals=None, cutoff=None, parent=None):
+        '''
+        :param problem: PlanningProblem (or subclass such as AirCargoProblem or HaveCakeProblem)
+        :param state: str (will be in form TFTTFF... representing fluent states)
+        :param serial_planning: bool (whether or not to assume that only one action can occur at a time)
+        :param mutex: bool (whether to compute mutexes; without them the graph is the relaxed
+            reachability graph, which is all h_levelsum needs)
+        :param stop_at_goals: bool (whether to stop growing the graph at the first level that contains
+            every goal rather than when it levels off; defaults to True without mutexes, where the
+            later levels cannot change when a goal first appears, and to False with them)
+        :param cutoff: int (the deepest S-level to build, or None to build until the graph stops)
+        :param parent: PlanningGraph (a graph built with the same options for another state of the problem,
+            typically the parent of this state in a search; once a level of this graph equals one of its
+            levels, the rest of its levels are reused rather than rebuilt)
+        Instance variable calculated:
+            template: PlanningGraphTemplate
+                the problem's compiled action and literal tables, shared with its other graphs
+            all_actions: list of the PlanningProblem valid ground actions combined with calculated no-op actions
+            s_masks: list of int, the literals of each S-level as a bit mask over template literal ids
+            a_masks: list of int, the actions of each A-level as a bit mask over template action ids
+            s_mutex: list of dicts, for each S-level, of literal id to the mask of the literals mutex with it
+            a_mutex: list of dicts, for each A-level, of action id to the mask of the actions mutex with it
+            leveled: bool, whether the last two S-levels contain the same literals, so the graph
+                cannot grow any further
+        The PgNode view of the graph (fs, s_levels and a_levels) is built on first access.
+        '''
+        self.problem = problem
+        self.state = state
+        self.serial = serial_planning
+        self.mutex = mutex
+        self.stop_at_goals = not mutex if stop_at_goals is None else stop_at_goals
+        self.cutoff = cutoff
+        self.template = planning_graph_template(problem)
+        self.all_actions = self.template.actions
+        self.s_masks = []
+        self.a_masks = []
+        self.s_mutex = []
+        self.a_mutex = []
+        self.leveled = False
+        self._views = None
+        self._level_ids = None
+        self.built_levels = 0
+        self.create_graph(parent)
+
+    @property
+    def fs(self):
+        ''' FluentState: the state represented as positive and negative fluent literal lists '''
+        return decode_state(self.state, self.problem.state_map)
+
+    @property
+    def s_levels(self):
+        ''' list of sets of PgNode_s, where each set in the list represents an S-level in the planning graph '''
+        return self.node_views()[0]
+
+    @property
+    def a_levels(self):
+        ''' list of sets of PgNode_a, where each set in the list represents an A-level in the planning graph '''
+        return self.node_views()[1]
+
+    def create_graph(self, parent=None):
         ''' build a Planning Graph as described in Russell-Norvig 3rd Ed 10.3 or 2nd Ed 11.4
 
         The S0 initial level has been implemented for you.  It has no parents and includes all of
@@ -278,126 +530,174 @@ class PlanningGraph():
 
         This function should only be called by the class constructor.
 
+        The graph grows until it levels off, and h_levelsum returns inf at once if a goal is still
+        missing then.  With stop_at_goals it stops at the first level containing every goal, and
+        it never grows past the cutoff level.
+
+        Each level is a function of the one before (its literals, and their mutexes unless the graph
+        is relaxed), so as soon as a level equals a level of the parent graph, the graph continues
+        exactly like the parent's and its remaining levels are copied from there (see splice).  A
+        child state differs from its parent by one action, so this usually happens after a level or two.
+
+        :param parent: PlanningGraph or None
         :return:
-            builds the graph by filling s_levels[] and a_levels[] lists with node sets for each level
+            builds the graph by filling s_masks[] and a_masks[] with the literals and actions of each level
         '''
         # the graph should only be built during class construction
-        if (len(self.s_levels) != 0) or (len(self.a_levels) != 0):
+        if (len(self.s_masks) != 0) or (len(self.a_masks) != 0):
             raise Exception(
                 'Planning Graph already created; construct a new planning graph for each new state in the planning sequence')
 
         # initialize S0 to literals in initial state provided.
-        leveled = False
-        level = 0
-        self.s_levels.append(set())  # S0 set of s_nodes - empty to start
-        # for each fluent in the initial state, add the correct literal PgNode_s
-        for literal in self.fs.pos:
-            self.s_levels[level].add(PgNode_s(literal, True))
-        for literal in self.fs.neg:
-            self.s_levels[level].add(PgNode_s(literal, False))
+        self.s_masks.append(self.template.initial_mask(self.state))
         # no mutexes at the first level
+        self.s_mutex.append({})
 
         # continue to build the graph alternating A, S levels until last two S levels contain the same literals,
         # i.e. until it is "leveled" (Section 10.3 AIMA text, pg 381)
-        while not leveled:
-            self.add_action_level(level)
-            self.update_a_mutex(self.a_levels[level])
+        if parent is not None and not self.compatible(parent):
+            parent = None
+        while not self.leveled:
+            if parent is not None and self.splice(parent):
+                break
+            if self.stop_at_goals and self.goals_reached():
+                break
+            if self.cutoff is not None and len(self.s_masks) > self.cutoff:
+                break
+            self.expand()
+        self.built_levels = len(self.s_masks)
+
+    def compatible(self, other) -> bool:
+        ''' whether another graph was built by the same rules as this one, so that equal levels of
+        the two graphs are followed by equal levels; graphs with a cutoff, or grown past the level
+        where they stopped (as h_setlevel does), do not qualify
+
+        :param other: PlanningGraph
+        :return: bool
+        '''
+        return other.template is self.template and other.serial == self.serial and \
+            other.mutex == self.mutex and other.stop_at_goals == self.stop_at_goals and \
+            other.cutoff is None and self.cutoff is None and len(other.s_masks) == other.built_levels
 
-            level += 1
-            self.add_literal_level(level)
-            self.update_s_mutex(self.s_levels[level])
+    def level_ids(self) -> dict:
+        ''' the first S-level of this graph with each literal mask
 
-            if self.s_levels[level] == self.s_levels[level - 1]:
-                leveled = True
+        :return: dict of int literal mask to int level
+        '''
+        if self._level_ids is None:
+            self._level_ids = {}
+            for level, s_mask in enumerate(self.s_masks):
+                self._level_ids.setdefault(s_mask, level)
+        return self._level_ids
+
+    def splice(self, other) -> bool:
+        ''' if the last S-level of this graph equals an S-level of a compatible graph, with the same
+        mutexes, append the levels of the other graph that follow it
+
+        :param other: PlanningGraph
+        :return: bool, whether the graph is complete
+        '''
+        level = len(self.s_masks) - 1
+        other_level = other.level_ids().get(self.s_masks[level])
+        if other_level is None or (self.mutex and other.s_mutex[other_level] != self.s_mutex[level]):
+            return False
+        self.a_masks.extend(other.a_masks[other_level:])
+        self.a_mutex.extend(other.a_mutex[other_level:])
+        self.s_masks.extend(other.s_masks[other_level + 1:])
+        self.s_mutex.extend(other.s_mutex[other_level + 1:])
+        self.leveled = other.leveled
+        return True
 
-    def add_action_level(self, level):
-        ''' Add A-Level (action) to the Planning Graph per Section 10.3 AIMA text, pg 381
+    def expand(self):
+        ''' Add the next A-level and S-level to the graph, with their mutexes unless the graph is relaxed
+
+        :return:
+            appends to the level lists and sets leveled when the new S-level equals the previous one
+        '''
+        level = len(self.a_masks)
+        self._views = None
+        self._level_ids = None
+        self.add_action_level(level)
+        if self.mutex:
+            self.update_a_mutex(level)
+        else:
+            self.a_mutex.append({})
+
+        level += 1
+        self.add_literal_level(level)
+        if self.mutex:
+            self.update_s_mutex(level)
+        else:
+            self.s_mutex.append({})
+
+        if self.s_masks[level] == self.s_masks[level - 1]:
+            self.leveled = True
+
+    def goals_reached(self) -> bool:
+        ''' whether every goal literal is in the last S-level built
 
-        - Append a Set to Literal Action-Level (A-Level) (to store Action Nodes (no duplicates)
-        - Declare Literal State-Level (S-Level) Nodes in current level
-        - Iterate all_actions (list of all possible PlanningProblem valid ground actions combined with calculated no-op actions)
-            - Declare Current Action using PgNode_a A-type (action) Planning Graph node object constructor
-            - Check iff all prerequisite literals for the proposed PgNode_a hold for the Current S-Level including:
-            Check to see if proposed PgNode_a has prenodes (set of possible Parent Precondition S-Nodes)
-            that are a subset of the Current S-Level (possible Parent).
+        :return: bool
+        '''
+        return not self.template.goal_mask & ~self.s_masks[-1]
 
-                - If Current S-Level Nodes is subset of PgNode_a's prenodes
-                - Iterate all Current S-Level Nodes
-                    - If Current S-Level Node is in PgNode_a's prenodes:
-                    Add Current Action Node object (PgNode_a) to "children" of Current S-Level Node.
-                    Add Current S-Level Node to "parents" of Current Action Node object (PgNode_a).
+    def add_action_level(self, level):
+        ''' Add A-Level (action) to the Planning Graph per Section 10.3 AIMA text, pg 381
 
-                - Add the Current Action Node object (PgNode_a) to the Current A-Level Nodes in Planning Graph
+        An action is in the A-level when its precondition mask is a subset of the S-level mask.
+        Only the consumers of the literals of the S-level (and the actions without preconditions)
+        can qualify.  When the S-level contains the previous one - always the case when every
+        literal has its no-op - so does the A-level, and only the consumers of the new literals
+        need to be tested.
 
         :param level: int
             the level number alternates S0, A0, S1, A1, S2, .... etc the level number is also used as the
-            index for the node set lists self.a_levels[] and self.s_levels[]
+            index for the lists self.a_masks[] and self.s_masks[]
         :return:
-            adds A nodes to the current level in self.a_levels[level]
-        '''
-        self.a_levels.append(set())
-        current_s_nodes = self.s_levels[level]
-        count_a_levels_before = len(self.a_levels[level])
-        count_subsets = 0; count_total = 0
-        for a in self.all_actions:
-            a_node = PgNode_a(a)
-            if a_node.prenodes.issubset(current_s_nodes):
-                for s_node in current_s_nodes:
-                    if s_node in a_node.prenodes:
-                        s_node.children.add(a_node)
-                        a_node.parents.add(s_node)
-                self.a_levels[level].add(a_node)
-                count_subsets += 1
-            count_total += 1
-        count_a_levels_after = len(self.a_levels[level])
-        # logging.debug("\nAdded %r action nodes (found to be subsets) out of %r to current A-level nodes changing count from %r to %r.", count_subsets, count_total, count_a_levels_before, count_a_levels_after)
+            adds the action mask of the level in self.a_masks[level]
+        '''
+        template = self.template
+        s_mask = self.s_masks[level]
+        if level > 0 and not self.s_masks[level - 1] & ~s_mask:
+            a_mask = self.a_masks[level - 1]
+            new_literals = s_mask & ~self.s_masks[level - 1]
+        else:
+            a_mask = 0
+            new_literals = s_mask
+            for i in template.unconditional:
+                a_mask |= 1 << i
+        pre_masks = template.pre_masks
+        for l in bit_indices(new_literals):
+            for i in template.consumers[l]:
+                if not pre_masks[i] & ~s_mask:
+                    a_mask |= 1 << i
+        self.a_masks.append(a_mask)
 
     def add_literal_level(self, level):
         ''' Add an S-Level (literal) to the Planning Graph per Section 10.3 AIMA text, pg 381
 
-        - Append a Set to Literal State-Level (S-Level) (to store Literal Effect Nodes (no duplicates)
-        - Declare Parent Literal Action-Level (A-Level) Nodes in previous level
-        - Iterate Parent Literal A-Level Nodes
-            - Declare Effnodes of Parent Literal A-Level Node
-            - Iterate list of S-Level Nodes (Effnodes) representing Effects of Parent Action
-                - If find an Effnode of current Parent Action Node that equals current Existing S-Level Node then:
-                Add current Existing S-Level Node's "parents" property with the current Parent Action Node.
-                Add current Parent Action Node's "children" property with the current Existing S-Level Node.
-            - If Effnode of current Parent Action Node does not equal Existing S-Level Node then:
-            Add current Parent Action Node to "parents" property of current Effnode.
-            Add current Effnode to "children" of current Parent Action Node.
-            Add current Effnode to the current Existing S-Level of the Planning Graph as PgNode_s object.
+        The S-level is the union of the effect masks of the actions in the previous A-level.  When
+        that A-level contains the one before it, only the effects of its new actions are added to
+        the previous S-level (the effects of the older actions).
 
         :param level: int
             the level number alternates S0, A0, S1, A1, S2, .... etc
             the level number is also used as the
-            index for the node set lists self.a_levels[] and self.s_levels[]
+            index for the lists self.a_masks[] and self.s_masks[]
         :return:
-            adds S nodes to the current level in self.s_levels[level]
-        '''
-        self.s_levels.append(set())
-        parent_a_nodes = self.a_levels[level-1]
-        count_s_levels_before = len(self.s_levels[level])
-        count_unique = 0; count_total = 0
-        for parent_a_node in parent_a_nodes:
-            effnodes = parent_a_node.effnodes
-            for effnode in effnodes:
-                is_unique_node = True
-                for existing_s_node in self.s_levels[level]:
-                    if effnode == existing_s_node:
-                        parent_a_node.children.add(existing_s_node)
-                        existing_s_node.parents.add(parent_a_node)
-                        is_unique_node = False
-                if is_unique_node:
-                    parent_a_node.children.add(effnode)
-                    effnode.parents.add(parent_a_node)
-                    self.s_levels[level].add(effnode)
-                    count_unique += 1
-                count_total += 1
-        count_s_levels_after = len(self.s_levels[level])
-        # logging.debug("\nAdd %r unique effnodes out of %r to current S-level nodes changing count from %r to %r.", count_unique, count_total, count_s_levels_before, count_s_levels_after)
-
-    def update_a_mutex(self, nodeset):
+            adds the literal mask of the level in self.s_masks[level]
+        '''
+        a_mask = self.a_masks[level - 1]
+        if level > 1 and not self.a_masks[level - 2] & ~a_mask:
+            s_mask = self.s_masks[level - 1]
+            a_mask &= ~self.a_masks[level - 2]
+        else:
+            s_mask = 0
+        eff_masks = self.template.eff_masks
+        for i in bit_indices(a_mask):
+            s_mask |= eff_masks[i]
+        self.s_masks.append(s_mask)
+
+    def update_a_mutex(self, level):
         ''' Determine and update sibling mutual exclusion for A-level nodes
 
         Mutex action tests section from 3rd Ed. 10.3 or 2nd Ed. 11.4
@@ -408,18 +708,113 @@ class PlanningGraph():
            Interference
            Competing needs
 
-        :param nodeset: set of PgNode_a (siblings in the same level)
+        Inconsistent effects and interference do not depend on the level, so they come from the
+        template's static mutex masks, and serial mutexes from its mask of non-persistent actions.
+        An action has competing needs with every consumer of a literal that is mutex with one of
+        its preconditions, which is an OR over the consumer masks of those literals.
+
+        :param level: int
         :return:
-            mutex set in each PgNode_a in the set is appropriately updated
+            adds the action mutex masks of the level in self.a_mutex[level]
         '''
-        nodelist = list(nodeset)
-        for i, n1 in enumerate(nodelist[:-1]):
-            for n2 in nodelist[i + 1:]:
-                if (self.serialize_actions(n1, n2) or
-                        self.inconsistent_effects_mutex(n1, n2) or
-                        self.interference_mutex(n1, n2) or
-                        self.competing_needs_mutex(n1, n2)):
-                    mutexify(n1, n2)
+        template = self.template
+        s_mutex = self.s_mutex[level]
+        a_mask = self.a_masks[level]
+        serial_mask = template.nonpersistent if self.serial else 0
+        a_mutex = {}
+        for i in bit_indices(a_mask):
+            mutex = template.static_mutex[i]
+            if not template.persistent[i]:
+                mutex |= serial_mask
+            mutex_needs = 0
+            for l in template.preconds[i]:
+                mutex_needs |= s_mutex.get(l, 0)
+            for l in bit_indices(mutex_needs):
+                mutex |= template.consumer_masks[l]
+            mutex &= a_mask & ~(1 << i)
+            if mutex:
+                a_mutex[i] = mutex
+        self.a_mutex.append(a_mutex)
+
+    def update_s_mutex(self, level):
+        ''' Determine and update sibling mutual exclusion for S-level nodes
+
+        Mutex action tests section from 3rd Ed. 10.3 or 2nd Ed. 11.4
+        A mutex relation holds between literals at a given level
+        if either of the two conditions hold between the pair:
+           Negation
+           Inconsistent support
+
+        Every achiever of a literal p is mutex with the actions in the AND of their action mutex
+        masks, so another literal has inconsistent support with p when all of its achievers are in
+        that mask, that is when no action of the level outside it achieves the literal.  The
+        partners of p are then the literals of the level missing from the OR of the effects of the
+        actions outside the mask, with no pairwise test.  (An action is never mutex with itself,
+        so p's own achievers keep p out.)
+
+        :param level: int
+        :return:
+            adds the literal mutex masks of the level in self.s_mutex[level]
+        '''
+        template = self.template
+        a_mask = self.a_masks[level - 1]
+        a_mutex = self.a_mutex[level - 1]
+        s_mask = self.s_masks[level]
+        literals = list(bit_indices(s_mask))
+        # literal ids 2i and 2i+1 are a fluent and its negation
+        s_mutex = {l: 1 << (l ^ 1) for l in literals if s_mask >> (l ^ 1) & 1}
+        for l in literals:
+            supported = -1
+            for a in bit_indices(template.achievers[l] & a_mask):
+                supported &= a_mutex.get(a, 0)
+            if not supported:
+                continue
+            partners = s_mask & ~template.effects_of(a_mask & ~supported)
+            if partners:
+                s_mutex[l] = s_mutex.get(l, 0) | partners
+        self.s_mutex.append(s_mutex)
+
+    def node_views(self):
+        ''' the graph as the sets of PgNode_s and PgNode_a of each level, connected by their parents,
+        children and mutex sets; built from the masks on first use and kept
+
+        :return: tuple of (list of sets of PgNode_s, list of sets of PgNode_a)
+        '''
+        if self._views is not None:
+            return self._views
+        template = self.template
+        s_levels, a_levels = [], []
+        a_nodes = {}
+        for level, s_mask in enumerate(self.s_masks):
+            s_nodes = {l: template.s_node(l) for l in bit_indices(s_mask)}
+            for i, a_node in a_nodes.items():
+                for l in template.effects[i]:
+                    a_node.children.add(s_nodes[l])
+                    s_nodes[l].parents.add(a_node)
+            self.view_mutex(s_nodes, self.s_mutex[level])
+            s_levels.append(set(s_nodes.values()))
+            if level == len(self.a_masks):
+                break
+            a_nodes = {i: PgNode_a(template.actions[i], template.prenodes[i], template.effnodes[i])
+                       for i in bit_indices(self.a_masks[level])}
+            for i, a_node in a_nodes.items():
+                for l in template.preconds[i]:
+                    s_nodes[l].children.add(a_node)
+                    a_node.parents.add(s_nodes[l])
+            self.view_mutex(a_nodes, self.a_mutex[level])
+            a_levels.append(set(a_nodes.values()))
+        self._views = (s_levels, a_levels)
+        return self._views
+
+    @staticmethod
+    def view_mutex(nodes: dict, mutex: dict):
+        ''' fill the mutex sets of the nodes of a level from its mutex masks
+
+        :param nodes: dict of id to PgNode
+        :param mutex: dict of id to the mask of the ids mutex with it
+        '''
+        for i, mask in mutex.items():
+            nodes[i].mutex.update(nodes[j] for j in bit_indices(mask))
 
     def serialize_actions(self, node_a1: PgNode_a, node_a2: PgNode_a) -> bool:
         '''
@@ -493,25 +888,6 @@ class PlanningGraph():
                          if a_s1.is_mutex(a_s2)] \
                     else False
 
-    def update_s_mutex(self, nodeset: set):
-        ''' Determine and update sibling mutual exclusion for S-level nodes
-
-        Mutex action tests section from 3rd Ed. 10.3 or 2nd Ed. 11.4
-        A mutex relation holds between literals at a given level
-        if either of the two conditions hold between the pair:
-           Negation
-           Inconsistent support
-
-        :param nodeset: set of PgNode_a (siblings in the same level)
-        :return:
-            mutex set in each PgNode_a in the set is appropriately updated
-        '''
-        nodelist = list(nodeset)
-        for i, n1 in enumerate(nodelist[:-1]):
-            for n2 in nodelist[i + 1:]:
-                if self.negation_mutex(n1, n2) or self.inconsistent_support_mutex(n1, n2):
-                    mutexify(n1, n2)
-
     def negation_mutex(self, node_s1: PgNode_s, node_s2: PgNode_s) -> bool:
         '''
         Test a pair of state literals for mutual exclusion, returning True if
@@ -561,28 +937,121 @@ class PlanningGraph():
         (admissible if goals independent) per Section 10.3 AIMA text, pg 382
 
         - Iterate each Goal in Problem
-            - Iterate over Levels and associated States in S-Levels object
-                - If Goal return Level Sum
-                - Else:
-                    - Iterate over each State in associated States
-                        - If State Literal equals Goal increment Level Sum by level number
-                        and return Level Sum
-            - If Goal not found in S-Levels object then return Infinite Level Sum
+            - Iterate over Levels and their S-Level literal masks
+                - If the Goal literal is in the Level increment Level Sum by level number
+                and move on to the next Goal
+            - If Goal not found in S-Levels object then return Infinite Level Sum if the graph leveled off,
+            otherwise (cut off) count the level after the last one built
 
         :return: int
         '''
         level_sum = 0
         for goal in self.problem.goal:
             is_goal = False
-            for (level, states) in enumerate(self.s_levels):
-                if is_goal:
+            goal_id = self.template.literal_ids[(goal, True)]
+            for (level, s_mask) in enumerate(self.s_masks):
+                if s_mask >> goal_id & 1:
+                    level_sum += level
+                    is_goal = True
                     break
-                else:
-                    for s in states:
-                        if goal == s.literal:
-                            level_sum += level
-                            is_goal = True
-                            break
             if not is_goal:
-                return float('Inf')
+                if self.leveled:
+                    return float('Inf')
+                # the graph was cut off before the goal appeared, so it can appear no sooner than next
+                level_sum += len(self.s_masks)
         return level_sum
+
+    def literal_levels(self) -> dict:
+        ''' the level at which each literal of the graph first appears
+
+        :return: dict of literal id to int
+        '''
+        levels = {}
+        seen = 0
+        for level, s_mask in enumerate(self.s_masks):
+            for l in bit_indices(s_mask & ~seen):
+                levels[l] = level
+            seen |= s_mask
+        return levels
+
+    def goal_levels(self) -> list:
+        ''' first level of each goal literal; a goal missing from the graph gets inf if the graph
+        leveled off, or otherwise (cut off) the level after the last one built
+
+        :return: list of int (or float inf)
+        '''
+        levels = self.literal_levels()
+        missing = float('Inf') if self.leveled else len(self.s_masks)
+        return [levels.get(l, missing) for l in bit_indices(self.template.goal_mask)]
+
+    def h_maxlevel(self) -> int:
+        '''Max-Level Heuristic: the largest level cost of the individual goals (admissible)
+        per Section 10.3 AIMA text
+
+        :return: int
+        '''
+        return max(self.goal_levels(), default=0)
+
+    def h_setlevel(self) -> int:
+        '''Set-Level Heuristic: the first level at which all of the goals appear with no pair of them
+        mutex (admissible, and dominates max-level) per Section 10.3 AIMA text
+
+        The search looks past the level where the literals level off, since mutexes can keep
+        disappearing after that; it returns inf once both the literals and the mutexes of the last
+        two S-levels are the same.  A relaxed graph has no mutexes, so this is max-level.
+
+        :return: int
+        '''
+        goal_mask = self.template.goal_mask
+        level = 0
+        while True:
+            if level == len(self.s_masks):
+                if self.leveled and self.s_mutex[-1] == self.s_mutex[-2]:
+                    return float('Inf')
+                if self.cutoff is not None and level > self.cutoff:
+                    return level
+                self.expand()
+            s_mutex = self.s_mutex[level]
+            if not goal_mask & ~self.s_masks[level] and \
+                    not any(s_mutex.get(l, 0) & goal_mask for l in bit_indices(goal_mask)):
+                return level
+            level += 1
+
+    def h_ff(self) -> int:
+        '''FF Heuristic: the number of actions in a relaxed plan extracted backwards from the goals
+        (Hoffmann and Nebel's FF planner; not admissible, but usually the most informed)
+
+        Each goal at level k is achieved by the action of A-level k-1 whose preconditions appear
+        earliest (lowest sum of levels), and those preconditions become goals at their own first
+        levels.  The effects of a chosen action count as achieved at levels k and k-1, so other goals
+        it achieves there need no action of their own.  Mutexes are ignored.
+
+        :return: int
+        '''
+        template = self.template
+        levels = self.literal_levels()
+        goals_at = [set() for _ in self.s_masks]
+        missing = 0
+        for l in bit_indices(template.goal_mask):
+            if l not in levels:
+                if self.leveled:
+                    return float('Inf')
+                missing += 1
+            elif levels[l] > 0:
+                goals_at[levels[l]].add(l)
+        achieved = [0] * len(self.s_masks)
+        plan = set()
+        for level in range(len(self.s_masks) - 1, 0, -1):
+            for g in sorted(goals_at[level]):
+                if achieved[level] >> g & 1:
+                    continue
+                best = min(bit_indices(template.achievers[g] & self.a_masks[level - 1]),
+                           key=lambda i: sum(levels[l] for l in template.preconds[i]))
+                plan.add(best)
+                for l in template.preconds[best]:
+                    if levels[l] > 0 and not achieved[level - 1] >> l & 1:
+                        goals_at[levels[l]].add(l)
+                achieved[level] |= template.eff_masks[best]
+                achieved[level - 1] |= template.eff_masks[best]
+        return len(plan) + missing
+
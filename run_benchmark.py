@@ -0,0 +1,176 @@
+import argparse
+import csv
+import json
+import multiprocessing
+import sys
+from timeit import default_timer as timer
+from aimacode.search import Node, SearchBudget, BudgetExhausted
+from run_search import SEARCHES, PrintableProblem, SearchTimeout, TIMEOUT_GRACE, time_limit
+from my_air_cargo_problems import air_cargo_problem
+
+import my_logging
+from my_logging import *
+my_logging.setup_log_level()
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+FIELDS = ['cargos', 'planes', 'airports', 'seed', 'search', 'heuristic', 'status',
+          'expansions', 'goal_tests', 'new_nodes', 'plan_length', 'elapsed', 'peak_rss_kb']
+
+# seconds any single case may run before it is recorded as a timeout
+DEFAULT_TIMEOUT = 300.0
+
+
+def parse_size(size):
+    """ parse a problem size given as CARGOSxPLANESxAIRPORTS, e.g. 4x2x4
+
+    :param size: str
+    :return: tuple of int (cargos, planes, airports)
+    """
+    try:
+        cargos, planes, airports = (int(n) for n in size.lower().split('x'))
+    except ValueError:
+        raise argparse.ArgumentTypeError("size must look like CARGOSxPLANESxAIRPORTS, e.g. 4x2x4")
+    return cargos, planes, airports
+
+
+def peak_rss_kb():
+    """ high-water mark of this process' resident set size in kB, or None if unknown """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':  # bytes on macOS, kB elsewhere
+        peak //= 1024
+    return peak
+
+
+def benchmark_case(size, seed, search_index, bitset=False, timeout=DEFAULT_TIMEOUT, max_expansions=None):
+    """ solve one generated problem with one entry of run_search.SEARCHES
+
+    Runs in its own worker process (see sweep) so that the peak RSS belongs to
+    this case alone. The search gets a SearchBudget of the time left from the
+    timeout (and of max_expansions), backed by SIGALRM as in run_search.solve,
+    so a runaway case is cut off instead of hanging the sweep. A case that does
+    not end with a solution Node is recorded with status 'timeout', 'budget',
+    'memory', 'cutoff', 'failed' (an exception) or 'unsolved', and no plan length.
+
+    :param size: tuple of int (cargos, planes, airports)
+    :param seed: int seed passed to air_cargo_problem
+    :param search_index: int index into run_search.SEARCHES
+    :param timeout: seconds before the case is abandoned (None for no limit)
+    :param max_expansions: node expansions before the search stops (None for no limit)
+    :return: dict with one value per FIELDS entry
+    """
+    sname, search, h = SEARCHES[search_index]
+    cargos, planes, airports = size
+    ip = node = None
+    status = 'unsolved'
+    start = timer()
+    try:
+        with time_limit(timeout and timeout + TIMEOUT_GRACE):
+            problem = air_cargo_problem(cargos, planes, airports, seed=seed, bitset=bitset)
+            ip = PrintableProblem(problem)
+            max_seconds = timeout and max(0.0, timeout - (timer() - start))
+            budget = SearchBudget(max_expansions=max_expansions, max_seconds=max_seconds)
+            if h:
+                node = search(ip, getattr(problem, h), budget=budget)
+            else:
+                node = search(ip, budget=budget)
+    except SearchTimeout:
+        status = 'timeout'
+    except MemoryError:
+        status = 'memory'
+    except Exception:
+        logging.exception("Benchmark case %r seed %d %s %s failed", size, seed, sname, h)
+        status = 'failed'
+    end = timer()
+    if isinstance(node, Node):
+        status = 'solved'
+    elif isinstance(node, BudgetExhausted):
+        status = 'timeout' if node.reason == 'time' else 'budget'
+    elif node == 'cutoff':
+        status = 'cutoff'
+    return {'cargos': cargos, 'planes': planes, 'airports': airports, 'seed': seed,
+            'search': sname, 'heuristic': h, 'status': status,
+            'expansions': ip.succs if ip else 0, 'goal_tests': ip.goal_tests if ip else 0,
+            'new_nodes': ip.states if ip else 0,
+            'plan_length': len(node.solution()) if status == 'solved' else None,
+            'elapsed': end - start, 'peak_rss_kb': peak_rss_kb()}
+
+
+def sweep(sizes, s_choices, seeds, bitset=False, timeout=DEFAULT_TIMEOUT, max_expansions=None):
+    """ run every size x seed x search combination, each in a fresh process
+    with the given limits (see benchmark_case)
+
+    :return: generator of result dicts, in sweep order
+    """
+    # one process per case, so ru_maxrss is not inherited from earlier cases
+    with multiprocessing.Pool(processes=1, maxtasksperchild=1) as pool:
+        for size in sizes:
+            for seed in seeds:
+                for i in s_choices:
+                    yield pool.apply(benchmark_case, (size, seed, i - 1, bitset, timeout, max_expansions))
+
+
+def write_results(results, path):
+    """ write result dicts as CSV, or as JSON if the file name ends in .json """
+    with open(path, 'w', newline='') as f:
+        if path.endswith('.json'):
+            json.dump(results, f, indent=2)
+        else:
+            writer = csv.DictWriter(f, fieldnames=FIELDS)
+            writer.writeheader()
+            writer.writerows(results)
+
+
+def main(sizes, s_choices, seeds, output=None, bitset=False, timeout=DEFAULT_TIMEOUT, max_expansions=None):
+
+    print("\n{:>10}  {:<40}  {:^8}  {:^10}  {:^10}  {:^10}  {:^6}  {:>9}  {:>10}".format(
+        "Size", "Search", "Status", "Expansions", "Goal Tests", "New Nodes", "Plan", "Seconds", "Peak kB"))
+    results = []
+    for r in sweep(sizes, s_choices, seeds, bitset, timeout, max_expansions):
+        results.append(r)
+        size = "{}x{}x{}".format(r['cargos'], r['planes'], r['airports'])
+        search = r['search'] + (" with {}".format(r['heuristic']) if r['heuristic'] else "")
+        print("{:>10}  {:<40}  {:^8}  {:^10d}  {:^10d}  {:^10d}  {:^6}  {:>9.3f}  {:>10}".format(
+            size, search[:40], r['status'], r['expansions'], r['goal_tests'], r['new_nodes'],
+            str(r['plan_length']), r['elapsed'], str(r['peak_rss_kb'])))
+    if output:
+        write_results(results, output)
+        print("\nWrote {} results to {}".format(len(results), output))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark how the air cargo planner scales by " +
+        "sweeping generated problem sizes against search algorithms and heuristics.")
+    parser.add_argument('-z', '--sizes', nargs="+", type=parse_size, required=True, metavar='CxPxA',
+                        help="Problem sizes to generate as CARGOSxPLANESxAIRPORTS, e.g. 2x2x2 4x2x4.")
+    parser.add_argument('-s', '--searches', nargs="+", choices=range(1, len(SEARCHES)+1), type=int, metavar='',
+                        help="Indices of the run_search.py search algorithms to use. Choose from: {!s}".format(list(range(1, len(SEARCHES)+1))))
+    parser.add_argument('--seeds', nargs="+", type=int, default=[0],
+                        help="Seeds for the random initial and goal placement (default: 0).")
+    parser.add_argument('-o', '--output', metavar='FILE',
+                        help="Write the results to FILE as CSV, or as JSON if FILE ends in .json.")
+    parser.add_argument('-b', '--bitset', action="store_true",
+                        help="Encode search states as int bitsets instead of T/F strings.")
+    parser.add_argument('-t', '--timeout', type=float, default=DEFAULT_TIMEOUT, metavar='SECONDS',
+                        help="Abandon any single case after SECONDS of wall time, 0 for no limit " +
+                             "(default: {:g}).".format(DEFAULT_TIMEOUT))
+    parser.add_argument('--max-expansions', type=int, metavar='N',
+                        help="Stop any single search after N node expansions.")
+    args = parser.parse_args()
+    logging.debug("\nRunning Benchmark with Args: %r", args.__dict__)
+
+    if not args.searches:
+        parser.print_help()
+        print("\nSearch Algorithms\n-----------------")
+        for idx, (name, _, heuristic) in enumerate(SEARCHES):
+            print("    {!s}. {} {}".format(idx+1, name, heuristic))
+        print()
+    else:
+        main(args.sizes, sorted(set(args.searches)), args.seeds, args.output, args.bitset,
+             args.timeout or None, args.max_expansions)
@@ -0,0 +1,122 @@
+import argparse
+import gc
+import tracemalloc
+from collections import deque
+from timeit import default_timer as timer
+from aimacode.search import Node
+from aimacode.utils import expr
+from my_air_cargo_problems import air_cargo_problem
+from my_planning_graph import PgNode_a, PgNode_s, planning_graph_template
+from run_benchmark import parse_size
+
+import my_logging
+from my_logging import *
+my_logging.setup_log_level()
+
+
+class DictNode(Node):
+    """ search Node with a __dict__ (a subclass without __slots__), as Node was before """
+
+
+class DictPgNode_s(PgNode_s):
+    """ PgNode_s with a __dict__ that parses its literal with expr(), as PgNode_s did before """
+
+    def __init__(self, symbol, is_pos, literal=None):
+        PgNode_s.__init__(self, symbol, is_pos,
+                          expr(str(symbol)) if is_pos else expr('~{}'.format(symbol)))
+
+
+class DictPgNode_a(PgNode_a):
+    """ PgNode_a with a __dict__, as PgNode_a was before """
+
+
+def transitions(problem, count):
+    """ the first `count` (parent node, action) pairs met expanding the problem breadth first
+
+    :return: list of (Node, Action)
+    """
+    pairs = []
+    frontier = deque([Node(problem.initial)])
+    while frontier and len(pairs) < count:
+        node = frontier.popleft()
+        for action in problem.actions(node.state):
+            pairs.append((node, action))
+            frontier.append(node.child_node(problem, action))
+    return pairs[:count]
+
+
+def search_nodes(cls, problem, pairs):
+    """ a node of class cls for each (parent, action) pair, with f and h set as A* does """
+    nodes = []
+    for parent, action in pairs:
+        node = cls(parent.state, parent, action, parent.path_cost + 1)
+        node.h = node.f = node.path_cost
+        nodes.append(node)
+    return nodes
+
+
+def s_nodes(cls, template, count):
+    """ `count` S-nodes of class cls, cycling through the literals of the template """
+    literals = template.literals
+    return [cls(*literals[i % len(literals)], template.literal_exprs[i % len(literals)])
+            for i in range(count)]
+
+
+def a_nodes(cls, template, count):
+    """ `count` A-nodes of class cls, cycling through the actions of the template """
+    actions = template.actions
+    return [cls(actions[i % len(actions)], template.prenodes[i % len(actions)],
+                template.effnodes[i % len(actions)])
+            for i in range(count)]
+
+
+def measure(build):
+    """ nodes per second of build(), and bytes per node allocated by a second run under tracemalloc
+
+    :param build: function returning a list of nodes
+    :return: tuple of (nodes, bytes per node, nodes per second)
+    """
+    gc.collect()
+    start = timer()
+    nodes = build()
+    elapsed = timer() - start
+    del nodes
+    gc.collect()
+    tracemalloc.start()
+    nodes = build()
+    allocated, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return len(nodes), allocated / len(nodes), len(nodes) / elapsed
+
+
+def main(size, count):
+    problem = air_cargo_problem(*size, seed=0)
+    template = planning_graph_template(problem)
+    pairs = transitions(problem, count)
+    cases = [('Node', 'Node (__dict__)',
+              lambda cls: search_nodes(cls, problem, pairs), Node, DictNode),
+             ('PgNode_s', 'PgNode_s (__dict__, expr)',
+              lambda cls: s_nodes(cls, template, count), PgNode_s, DictPgNode_s),
+             ('PgNode_a', 'PgNode_a (__dict__)',
+              lambda cls: a_nodes(cls, template, count), PgNode_a, DictPgNode_a)]
+
+    print("\n{:<28}  {:>8}  {:>10}  {:>12}".format("Class", "Nodes", "Bytes/node", "Nodes/s"))
+    results = []
+    for name, before_name, build, after, before in cases:
+        for label, cls in ((before_name, before), (name, after)):
+            nodes, per_node, rate = measure(lambda: build(cls))
+            results.append({'class': label, 'nodes': nodes, 'bytes_per_node': per_node, 'nodes_per_second': rate})
+            print("{:<28}  {:>8d}  {:>10.1f}  {:>12.0f}".format(label, nodes, per_node, rate))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the memory and construction speed of search " +
+        "and planning graph nodes, against versions of the classes with a __dict__.")
+    parser.add_argument('-z', '--size', type=parse_size, default=(4, 2, 4), metavar='CxPxA',
+                        help="Size of the generated air cargo problem as CARGOSxPLANESxAIRPORTS (default: 4x2x4).")
+    parser.add_argument('-n', '--nodes', type=int, default=100000,
+                        help="Nodes of each class to build (default: 100000).")
+    args = parser.parse_args()
+    logging.debug("\nRunning Node Benchmark with Args: %r", args.__dict__)
+    main(args.size, args.nodes)
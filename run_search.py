@@ -1,6 +1,12 @@
 import argparse
+import csv
+import json
+import signal
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
 from timeit import default_timer as timer
-from aimacode.search import InstrumentedProblem
+from aimacode.search import InstrumentedProblem, SearchBudget, BudgetExhausted, is_path_dependent
 from aimacode.search import (breadth_first_search, astar_search,
     breadth_first_tree_search, depth_first_graph_search, uniform_cost_search,
     greedy_best_first_graph_search, depth_limited_search,
@@ -11,6 +17,11 @@ import my_logging
 from my_logging import *
 my_logging.setup_log_level()
 
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
 PROBLEM_CHOICE_MSG = """
 Select from the following list of air cargo problems. You may choose more than
 one by entering multiple selections separated by spaces.
@@ -41,6 +52,15 @@ SEARCHES = [["breadth_first_search", breadth_first_search, ""],
             ['astar_search', astar_search, 'h_ignore_preconditions'],
             ['astar_search', astar_search, 'h_ignore_delete_lists'],
             ['astar_search', astar_search, 'h_pg_levelsum'],
+            ['astar_search', astar_search, 'h_pg_maxlevel'],
+            ['astar_search', astar_search, 'h_pg_setlevel'],
+            ['astar_search', astar_search, 'h_pg_ff'],
+            ['greedy_best_first_graph_search', greedy_best_first_graph_search, 'h_pg_ff'],
+            ['greedy_best_first_graph_search', greedy_best_first_graph_search, 'h_add'],
+            ['astar_search', astar_search, 'h_pdb'],
+            ['astar_search', astar_search, 'h_pdb_additive'],
+            ['greedy_best_first_graph_search', greedy_best_first_graph_search, 'h_landmark_count'],
+            ['astar_search', astar_search, 'h_landmark_count'],
             ]
 
 
@@ -51,7 +71,10 @@ class PrintableProblem(InstrumentedProblem):
     """
 
     def __repr__(self):
-        return '{:^10d}  {:^10d}  {:^10d}'.format(self.succs, self.goal_tests, self.states)
+        stats = '{:^10d}  {:^10d}  {:^10d}'.format(self.succs, self.goal_tests, self.states)
+        if self.heuristic_cache is not None:
+            stats += '  (cache: {} hits, {} misses)'.format(self.heuristic_cache.hits, self.heuristic_cache.misses)
+        return stats
 
 
 def run_search(problem, search_function, parameter=None):
@@ -69,6 +92,293 @@ def run_search(problem, search_function, parameter=None):
     print()
 
 
+# extra wall time the SIGALRM backstop allows past a run's timeout, so the
+# search's own budget normally stops it first with its partial statistics
+TIMEOUT_GRACE = 1.0
+
+
+class SearchTimeout(Exception):
+    """ raised inside a run when its time limit expires """
+
+
+@contextmanager
+def time_limit(seconds):
+    """ raise SearchTimeout in the block once `seconds` of wall time have passed
+
+    Uses SIGALRM, so it only takes effect on Unix and in a process' main thread;
+    elsewhere, or when seconds is None, the block runs without a limit.
+    """
+    if not seconds or not hasattr(signal, 'setitimer'):
+        yield
+        return
+
+    def expire(signum, frame):
+        raise SearchTimeout()
+
+    previous = signal.signal(signal.SIGALRM, expire)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+@contextmanager
+def memory_limit(megabytes):
+    """ cap the address space of the current process in the block, so a runaway
+    search raises MemoryError instead of exhausting the machine; the previous
+    limit is restored on the way out, since in serial mode the block runs in
+    the main process, which goes on to the next run and the report """
+    if not megabytes or resource is None:
+        yield
+        return
+    previous = resource.getrlimit(resource.RLIMIT_AS)
+    soft, hard = previous
+    limit = megabytes * 1024 * 1024
+    if hard != resource.RLIM_INFINITY:
+        limit = min(limit, hard)
+    if soft != resource.RLIM_INFINITY:
+        limit = min(limit, soft)
+    resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+    try:
+        yield
+    finally:
+        resource.setrlimit(resource.RLIMIT_AS, previous)
+
+
+RECORD_FIELDS = ['problem', 'search', 'heuristic', 'bitset', 'status', 'budget',
+                 'expansions', 'goal_tests', 'new_nodes', 'peak_frontier', 'plan_length', 'plan',
+                 'elapsed', 'setup_time', 'search_time', 'heuristic_time', 'heuristic_calls', 'cache_hits', 'cache_misses', 'profile', 'error']
+
+
+def new_record(p_index, s_index, bitset=False):
+    """ an empty result record for PROBLEMS[p_index] with SEARCHES[s_index], with status 'failed' """
+    pname, _ = PROBLEMS[p_index]
+    sname, _, h = SEARCHES[s_index]
+    return {'problem': pname, 'search': sname, 'heuristic': h, 'bitset': bitset, 'status': 'failed',
+            'budget': None, 'expansions': 0, 'goal_tests': 0, 'new_nodes': 0, 'peak_frontier': None,
+            'plan_length': None, 'plan': None, 'elapsed': 0.0,
+            'setup_time': 0.0, 'search_time': 0.0, 'heuristic_time': 0.0, 'heuristic_calls': 0,
+            'cache_hits': None, 'cache_misses': None, 'profile': {}, 'error': None}
+
+
+def solve(p_index, s_index, bitset=False, timeout=None, max_memory=None,
+          max_expansions=None, max_frontier=None, h_cache=None, pdb_cache=None, profile=False):
+    """ solve PROBLEMS[p_index] with SEARCHES[s_index] and return a picklable
+    result record, so it can run in a worker process of a ProcessPoolExecutor.
+
+    The record has one value per RECORD_FIELDS entry. `setup_time` covers building
+    the problem, `search_time` the search call, and `elapsed` both;
+    `heuristic_time` is the heuristic's share of `search_time` over
+    `heuristic_calls` calls, and with h_cache set `cache_hits` and `cache_misses`
+    count its lookups.  With profile set, `profile` maps each of actions,
+    result, goal_test and the heuristic to its CallProfile summary; otherwise it
+    is left empty, as profiling every call slows the search and adds to its memory.
+
+    Limits other than the address space cap are enforced cooperatively by a
+    SearchBudget, and the record keeps the partial statistics of a run that
+    exhausts one; `budget` then names the limit that was hit.  The timeout is
+    also backed by SIGALRM (TIMEOUT_GRACE seconds later) for problem setup
+    and searches that stop making expansions.
+
+    :param timeout: seconds before the run is abandoned with status 'timeout'
+    :param max_memory: address space cap in MB; exceeding it gives status 'memory'
+    :param max_expansions: node expansions before the run stops with status 'budget'
+    :param max_frontier: frontier size at which the run stops with status 'budget'
+    :param h_cache: entries of a state-keyed LRU cache for the heuristic (None for no cache);
+        ignored, with a warning, for a path dependent heuristic such as h_landmark_count
+    :param pdb_cache: directory to save pattern database tables to and reuse them from
+    :param profile: time and count every call of the problem and the heuristic
+    :return: dict
+    """
+    _, p = PROBLEMS[p_index]
+    _, s, h = SEARCHES[s_index]
+    record = new_record(p_index, s_index, bitset)
+    start = timer()
+    search_start = None
+    ip = None
+    try:
+        with memory_limit(max_memory), time_limit(timeout and timeout + TIMEOUT_GRACE):
+            ip = PrintableProblem(p(bitset=bitset), profile=profile)
+            ip.problem.pdb_cache_dir = pdb_cache
+            _h = None
+            if h:
+                h_function = getattr(ip.problem, h)
+                if h_cache and is_path_dependent(h_function):
+                    logging.warning("Not caching %s by state: its value depends on the path", h)
+                    h_cache = None
+                _h = ip.heuristic(h_function, h, cache_size=h_cache)
+            search_start = timer()
+            max_seconds = timeout and max(0.0, timeout - (search_start - start))
+            budget = SearchBudget(max_expansions=max_expansions, max_frontier=max_frontier,
+                                  max_seconds=max_seconds)
+            node = s(ip, _h, budget=budget) if _h is not None else s(ip, budget=budget)
+        record['peak_frontier'] = budget.peak_frontier
+        if isinstance(node, BudgetExhausted):
+            record['budget'] = node.reason
+            record['status'] = 'timeout' if node.reason == 'time' else 'budget'
+        elif node is not None and node != 'cutoff':
+            record['status'] = 'solved'
+            record['plan'] = ["{}{}".format(action.name, action.args) for action in node.solution()]
+            record['plan_length'] = len(record['plan'])
+    except SearchTimeout:
+        record['status'] = 'timeout'
+    except MemoryError:
+        record['status'] = 'memory'
+    end = timer()
+    record['elapsed'] = end - start
+    if search_start is None:
+        record['setup_time'] = end - start
+    else:
+        record['setup_time'] = search_start - start
+        record['search_time'] = end - search_start
+    if ip is not None:
+        record['expansions'], record['goal_tests'], record['new_nodes'] = ip.succs, ip.goal_tests, ip.states
+        record['heuristic_time'], record['heuristic_calls'] = ip.heuristic_time, ip.heuristic_calls
+        if ip.heuristic_cache is not None:
+            record['cache_hits'], record['cache_misses'] = ip.heuristic_cache.hits, ip.heuristic_cache.misses
+    if ip is not None and ip.profiles is not None:
+        record['profile'] = {name: call_profile.summary() for name, call_profile in ip.profiles.items()}
+    return record
+
+
+def show_record(record):
+    """ print a result record from solve() in the same layout as run_search() """
+    print("\nExpansions   Goal Tests   New Nodes")
+    print("{:^10d}  {:^10d}  {:^10d}\n".format(record['expansions'], record['goal_tests'], record['new_nodes']))
+    if record['cache_hits'] is not None and not record['profile']:
+        lookups = record['cache_hits'] + record['cache_misses']
+        print("{} cache: {} hits, {} misses ({:.1%} hit rate)\n".format(
+            record['heuristic'], record['cache_hits'], record['cache_misses'],
+            record['cache_hits'] / lookups if lookups else 0.0))
+    show_profile(record['profile'])
+    if record['status'] == 'solved':
+        print("Plan length: {}  Time elapsed in seconds: {}".format(record['plan_length'], record['search_time']))
+        for action in record['plan']:
+            print(action)
+    elif record['status'] == 'timeout':
+        print("Timed out after {} seconds".format(record['elapsed']))
+    elif record['status'] == 'budget':
+        print("Search budget ({}) exhausted after {} seconds".format(record['budget'], record['search_time']))
+    elif record['status'] == 'memory':
+        print("Ran out of memory after {} seconds".format(record['elapsed']))
+    elif record['error']:
+        print("Failed: {}".format(record['error']))
+    else:
+        print("No solution found in {} seconds".format(record['search_time']))
+    print()
+
+
+def show_profile(profile):
+    """ print the per-call breakdown of a record's profile: calls, cumulative and
+    mean time, the share of calls on a repeated state, and the latency histogram
+    as calls per power of two bucket of microseconds """
+    if not profile:
+        return
+    print("{:<24}{:>10}  {:>10}  {:>10}  {:>8}  {}".format(
+        "Call", "Calls", "Time (s)", "Mean (us)", "Repeat", "Histogram (<=us: calls)"))
+    for name, stats in profile.items():
+        histogram = " ".join("{}:{}".format(bound, calls) for bound, calls in stats['histogram'].items())
+        print("{:<24}{:>10d}  {:>10.4f}  {:>10.1f}  {:>7.1%}  {}".format(
+            name, stats['calls'], stats['time'], stats['mean'] * 1e6, stats['repeat_rate'], histogram))
+    for name, stats in profile.items():
+        if 'cache_hits' in stats:
+            lookups = stats['cache_hits'] + stats['cache_misses']
+            print("{} cache: {} hits, {} misses ({:.1%} hit rate), {} evictions, {} entries".format(
+                name, stats['cache_hits'], stats['cache_misses'], stats['cache_hits'] / lookups if lookups else 0.0,
+                stats['cache_evictions'], stats['cache_size']))
+    print()
+
+
+class RecordWriter():
+    """ stream result records to a file as JSON lines, or as CSV if the file
+    name ends in .csv (plan actions joined with '; ') """
+
+    def __init__(self, path):
+        self.file = open(path, 'w', newline='')
+        self.csv = None
+        if path.endswith('.csv'):
+            self.csv = csv.DictWriter(self.file, fieldnames=RECORD_FIELDS)
+            self.csv.writeheader()
+
+    def write(self, record):
+        if self.csv is not None:
+            row = dict(record)
+            row['plan'] = '; '.join(record['plan'] or [])
+            row['profile'] = json.dumps(record['profile'])
+            self.csv.writerow(row)
+        else:
+            self.file.write(json.dumps(record) + '\n')
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def solving_msg(choice):
+    pname, sname, h = choice
+    hstring = h if not h else " with {}".format(h)
+    return "\nSolving {} using {}{}...".format(pname, sname, hstring)
+
+
+def solve_serial(p_indices, s_indices, **options):
+    """ yield the result record of each problem x search pair, in order; options
+    are passed on to solve() """
+    for i in p_indices:
+        for j in s_indices:
+            print(solving_msg((PROBLEMS[i][0], SEARCHES[j][0], SEARCHES[j][2])))
+            yield solve(i, j, **options)
+
+
+def solve_parallel(p_indices, s_indices, jobs=1, **options):
+    """ run the problem x search matrix on a pool of `jobs` worker processes and
+    yield each result record as soon as it completes; options are passed on to solve()
+
+    A run that raises is yielded as a 'failed' record carrying the error, so the
+    rest of the matrix still completes. If a worker dies (e.g. killed under the
+    memory cap) the pool breaks and fails every unfinished run; each of those is
+    then run again on a pool of its own, so only the run that kills its worker
+    again is recorded as failed. """
+    runs = [(i, j) for i in p_indices for j in s_indices]
+    broken = []
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        for record in pool_records(executor, runs, broken, options):
+            yield record
+    for run in broken:
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            for record in pool_records(executor, [run], None, options):
+                yield record
+
+
+def pool_records(executor, runs, broken, options):
+    """ yield the record of each (problem index, search index) run solved on executor
+    as it completes, or a 'failed' record if it raised; runs failed by a broken pool
+    are appended to `broken` instead, when it is a list """
+    futures = {executor.submit(solve, i, j, **options): (i, j) for i, j in runs}
+    for future in as_completed(futures):
+        i, j = futures[future]
+        try:
+            record = future.result()
+        except BrokenProcessPool as error:
+            if broken is not None:
+                broken.append((i, j))
+                continue
+            record = failed_record(i, j, error, options.get('bitset', False))
+        except Exception as error:
+            record = failed_record(i, j, error, options.get('bitset', False))
+        print(solving_msg((record['problem'], record['search'], record['heuristic'])))
+        yield record
+
+
+def failed_record(p_index, s_index, error, bitset=False):
+    """ the result record of a run that raised error instead of returning one """
+    logging.error("Solving %s with %s failed: %r", PROBLEMS[p_index][0], SEARCHES[s_index][0], error)
+    record = new_record(p_index, s_index, bitset)
+    record['error'] = "{}: {}".format(type(error).__name__, error)
+    return record
+
+
 def manual():
 
     print(PROBLEM_CHOICE_MSG)
@@ -90,20 +400,26 @@ def manual():
                                                " ".join(s_choices)))
 
 
-def main(p_choices, s_choices):
+def main(p_choices, s_choices, jobs=None, output=None, **options):
+    """ solve each chosen problem with each chosen search, showing each result record and
+    writing it to `output` if given; options (bitset, timeout, ...) are passed on to solve() """
 
-    problems = [PROBLEMS[i-1] for i in map(int, p_choices)]
-    searches = [SEARCHES[i-1] for i in map(int, s_choices)]
-
-    for pname, p in problems:
-
-        for sname, s, h in searches:
-            hstring = h if not h else " with {}".format(h)
-            print("\nSolving {} using {}{}...".format(pname, sname, hstring))
+    p_indices = [i-1 for i in map(int, p_choices)]
+    s_indices = [i-1 for i in map(int, s_choices)]
+    if (jobs or 1) > 1:
+        records = solve_parallel(p_indices, s_indices, jobs, **options)
+    else:
+        records = solve_serial(p_indices, s_indices, **options)
 
-            _p = p()
-            _h = None if not h else getattr(_p, h)
-            run_search(_p, s, _h)
+    writer = RecordWriter(output) if output else None
+    try:
+        for record in records:
+            show_record(record)
+            if writer is not None:
+                writer.write(record)
+    finally:
+        if writer is not None:
+            writer.close()
 
 
 def show_solution(node, elapsed_time):
@@ -121,13 +437,37 @@ if __name__=="__main__":
                         help="Specify the indices of the problems to solve as a list of space separated values. Choose from: {!s}".format(list(range(1, len(PROBLEMS)+1))))
     parser.add_argument('-s', '--searches', nargs="+", choices=range(1, len(SEARCHES)+1), type=int, metavar='',
                         help="Specify the indices of the search algorithms to use as a list of space separated values. Choose from: {!s}".format(list(range(1, len(SEARCHES)+1))))
+    parser.add_argument('-b', '--bitset', action="store_true",
+                        help="Encode search states as int bitsets instead of T/F strings.")
+    parser.add_argument('-j', '--jobs', type=int, metavar='N',
+                        help="Solve the problem x search matrix on N worker processes, printing results as they complete.")
+    parser.add_argument('-t', '--timeout', type=float, metavar='SECONDS',
+                        help="Abandon any single run after SECONDS of wall time.")
+    parser.add_argument('--max-memory', type=int, metavar='MB',
+                        help="Cap the address space of each run at MB megabytes.")
+    parser.add_argument('--max-expansions', type=int, metavar='N',
+                        help="Stop any single search after N node expansions.")
+    parser.add_argument('--max-frontier', type=int, metavar='N',
+                        help="Stop any single search once its frontier holds more than N nodes.")
+    parser.add_argument('--h-cache', type=int, metavar='N',
+                        help="Cache up to N heuristic values by state, evicting the least recently used.")
+    parser.add_argument('--profile', action="store_true",
+                        help="Time and count every actions, result, goal_test and heuristic call, and show the " +
+                             "breakdown (and heuristic cache counts) in each result. Adds overhead to the search.")
+    parser.add_argument('--pdb-cache', metavar='DIR',
+                        help="Save pattern database tables to DIR and reuse them from there.")
+    parser.add_argument('-o', '--output', metavar='FILE',
+                        help="Stream one result record per run to FILE as JSON lines, or as CSV if FILE ends in .csv.")
     args = parser.parse_args()
     logging.debug("\nRunning Search with Args: %r", args.__dict__)
 
     if args.manual:
         manual()
     elif args.problems and args.searches:
-        main(list(sorted(set(args.problems))), list(sorted(set((args.searches)))))
+        main(list(sorted(set(args.problems))), list(sorted(set((args.searches)))), bitset=args.bitset,
+             jobs=args.jobs, timeout=args.timeout, max_memory=args.max_memory, output=args.output,
+             max_expansions=args.max_expansions, max_frontier=args.max_frontier, h_cache=args.h_cache,
+             pdb_cache=args.pdb_cache, profile=args.profile)
     else:
         print()
         parser.print_help()
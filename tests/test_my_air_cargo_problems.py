@@ -6,9 +6,11 @@ from aimacode.planning import Action
 from aimacode.utils import expr
 from aimacode.search import Node
 import unittest
-from lp_utils import decode_state
+from lp_utils import decode_state, state_to_bits, bits_to_state
+from lp_utils import FluentState
+from my_planning_graph import PlanningGraph
 from my_air_cargo_problems import (
-    air_cargo_p1, air_cargo_p2, air_cargo_p3,
+    AirCargoProblem, air_cargo_p1, air_cargo_p2, air_cargo_p3, air_cargo_problem,
 )
 
 class TestAirCargoProb1(unittest.TestCase):
@@ -47,6 +49,27 @@ class TestAirCargoProb3(unittest.TestCase):
         self.assertEqual(len(self.p3.goal),4)
 
 
+class TestAirCargoGenerator(unittest.TestCase):
+
+    def test_generated_size(self):
+        p = air_cargo_problem(5, 3, 4, seed=7)
+        self.assertEqual(len(p.initial), 5 * (4 + 3) + 3 * 4)
+        self.assertEqual(len(p.goal), 5)
+        self.assertEqual(len(p.actions_list), 2 * 5 * 3 * 4 + 3 * 4 * 3)
+
+    def test_generated_seed_is_reproducible(self):
+        p, q = air_cargo_problem(4, 2, 4, seed=3), air_cargo_problem(4, 2, 4, seed=3)
+        self.assertEqual(p.initial, q.initial)
+        self.assertEqual(p.goal, q.goal)
+        self.assertFalse(p.goal_test(p.initial))
+
+    def test_generated_placement(self):
+        p = air_cargo_problem(2, 1, 3, initial={'C1': 'A1', 'P1': 'A2'}, goal={'C1': 'A3'}, seed=0)
+        self.assertIn(expr('At(C1, A1)'), p.state_map[:3])
+        self.assertIn(expr('At(P1, A2)'), p.state_map[:3])
+        self.assertIn(expr('At(C1, A3)'), p.goal)
+
+
 class TestAirCargoMethods(unittest.TestCase):
 
     def setUp(self):
@@ -64,6 +87,23 @@ class TestAirCargoMethods(unittest.TestCase):
         #     print("{}{}".format(action.name, action.args))
         self.assertEqual(len(self.p1.actions_list), 20)
 
+    def test_AC_grounding_counts(self):
+        self.assertEqual(self.p1.num_grounded, 20)
+        self.assertEqual(self.p1.num_pruned, 0)
+
+    def test_AC_grounding_prunes_unreachable(self):
+        # without In(C1, P2) in the state map, C1 can never be loaded into P2
+        init = FluentState(
+            [expr('At(C1, SFO)'), expr('At(C2, JFK)'), expr('At(P1, SFO)'), expr('At(P2, JFK)')],
+            [expr('At(C2, SFO)'), expr('In(C2, P1)'), expr('In(C2, P2)'), expr('At(C1, JFK)'),
+             expr('In(C1, P1)'), expr('At(P1, JFK)'), expr('At(P2, SFO)')])
+        p = AirCargoProblem(['C1', 'C2'], ['P1', 'P2'], ['JFK', 'SFO'], init, [expr('At(C1, JFK)')])
+        self.assertEqual(p.num_grounded, 20)
+        self.assertEqual(p.num_pruned, 4)
+        self.assertEqual(len(p.actions_list), 16)
+        self.assertNotIn(('Load', (expr('C1'), expr('P2'), expr('SFO'))),
+                         [(a.name, a.args) for a in p.actions_list])
+
     def test_AC_actions(self):
         # to see list of possible actions, uncomment below
         # print("\npossible actions:")
@@ -80,5 +120,153 @@ class TestAirCargoMethods(unittest.TestCase):
         n = Node(self.p1.initial)
         self.assertEqual(self.p1.h_ignore_preconditions(n),2)
 
+    def test_h_planning_graph(self):
+        n = Node(self.p1.initial)
+        self.assertEqual(self.p1.h_pg_levelsum(n), 4)
+        self.assertEqual(self.p1.h_pg_maxlevel(n), 2)
+        self.assertEqual(self.p1.h_pg_setlevel(n), 4)
+        # the relaxed plan loads, flies and unloads each cargo
+        self.assertEqual(self.p1.h_pg_ff(n), 6)
+
+    def test_relaxed_planning_graph_reuse(self):
+        n = Node(self.p1.initial)
+        pg = self.p1.relaxed_planning_graph(n)
+        self.assertIs(self.p1.relaxed_planning_graph(Node(self.p1.initial)), pg)
+        child = n.child_node(self.p1, self.act1)
+        child_pg = self.p1.relaxed_planning_graph(child)
+        self.assertEqual(child_pg.s_masks, PlanningGraph(self.p1, child.state, mutex=False).s_masks)
+        self.assertEqual(self.p1.h_pg_levelsum(child), PlanningGraph(self.p1, child.state, mutex=False).h_levelsum())
+
+    def test_unsatisfied_goals(self):
+        self.assertEqual(self.p1.unsatisfied_goals(self.p1.initial), 2)
+        state = self.p1.result(self.p1.initial, self.act1)
+        self.assertEqual(self.p1.unsatisfied_goals(state), 2)
+        goal_state = self.p1.fluent_index.mask(self.p1.goal)
+        self.assertEqual(self.p1.unsatisfied_goals(goal_state), 0)
+        self.assertTrue(self.p1.goal_test(goal_state))
+        self.assertFalse(self.p1.goal_test(self.p1.initial))
+
+class TestAirCargoCompiledActions(unittest.TestCase):
+
+    def setUp(self):
+        self.p2 = air_cargo_p2()
+
+    def naive_actions(self, state):
+        pos = decode_state(state, self.p2.state_map).pos
+        return [a for a in self.p2.actions_list
+                if all(c in pos for c in a.precond_pos)
+                and not any(c in pos for c in a.precond_neg)]
+
+    def test_actions_match_naive_check(self):
+        frontier = [self.p2.initial]
+        for _ in range(3):
+            successors = []
+            for state in frontier:
+                self.assertEqual(self.p2.actions(state), self.naive_actions(state))
+                successors.extend(self.p2.result(state, a) for a in self.p2.actions(state)[:3])
+            frontier = successors
+
+    def test_result_applies_effects(self):
+        for action in self.p2.actions(self.p2.initial):
+            before = decode_state(self.p2.initial, self.p2.state_map)
+            after = decode_state(self.p2.result(self.p2.initial, action), self.p2.state_map)
+            expected = [f for f in before.pos if f not in action.effect_rem] + \
+                       [f for f in action.effect_add if f not in before.pos]
+            self.assertEqual(set(after.pos), set(expected))
+
+    def test_every_action_watched_once(self):
+        compiled = self.p2.compiled_actions
+        watched = [idx for idxs in compiled.watchers.values() for idx in idxs]
+        self.assertEqual(sorted(watched + compiled.unwatched), list(range(len(self.p2.actions_list))))
+
+
+class TestAirCargoBitset(unittest.TestCase):
+
+    def setUp(self):
+        self.p1 = air_cargo_p1()
+        self.b1 = air_cargo_p1(bitset=True)
+        self.act1 = Action(
+            expr('Load(C1, P1, SFO)'),
+            [[expr('At(C1, SFO)'), expr('At(P1, SFO)')], []],
+            [[expr('In(C1, P1)')], [expr('At(C1, SFO)')]]
+        )
+
+    def test_bitset_initial(self):
+        self.assertIsInstance(self.b1.initial, int)
+        self.assertEqual(self.b1.state_str(self.b1.initial), self.p1.initial)
+        self.assertEqual(bits_to_state(state_to_bits(self.p1.initial), 12), self.p1.initial)
+
+    def test_bitset_order_matches_strings(self):
+        states = ['TFTF', 'FTTT', 'TTFF', 'FFFT']
+        self.assertEqual(sorted(states, key=state_to_bits), sorted(states))
+
+    def test_bitset_actions(self):
+        self.assertEqual(len(self.b1.actions(self.b1.initial)), 4)
+
+    def test_bitset_result(self):
+        new_state = self.b1.result(self.b1.initial, self.act1)
+        self.assertIsInstance(new_state, int)
+        self.assertEqual(self.b1.state_str(new_state), self.p1.result(self.p1.initial, self.act1))
+        fs = decode_state(new_state, self.b1.state_map)
+        self.assertTrue(expr('In(C1, P1)') in fs.pos)
+
+    def test_bitset_goal_test(self):
+        self.assertFalse(self.b1.goal_test(self.b1.initial))
+        self.assertTrue(self.b1.goal_test(self.b1.fluent_index.mask(self.b1.goal)))
+
+def relaxed_cost_reference(problem, state, additive):
+    """ delete-relaxation goal cost by a plain fixpoint over the Action objects """
+    cost = {f: 0 for f in decode_state(state, problem.state_map).pos}
+    changed = True
+    while changed:
+        changed = False
+        for a in problem.actions_list:
+            if all(p in cost for p in a.precond_pos):
+                pre_costs = [cost[p] for p in a.precond_pos]
+                c = 1 + (sum(pre_costs) if additive else max(pre_costs, default=0))
+                for e in a.effect_add:
+                    if cost.get(e, float('inf')) > c:
+                        cost[e] = c
+                        changed = True
+    goal_costs = [cost.get(g, float('inf')) for g in problem.goal]
+    return sum(goal_costs) if additive else max(goal_costs, default=0)
+
+
+class TestAirCargoDeleteRelaxation(unittest.TestCase):
+
+    def check(self, problem, steps):
+        state = problem.initial
+        for i in range(steps + 1):
+            node = Node(state)
+            self.assertEqual(problem.h_add(node), relaxed_cost_reference(problem, state, True))
+            self.assertEqual(problem.h_max(node), relaxed_cost_reference(problem, state, False))
+            self.assertEqual(problem.h_ignore_delete_lists(node), problem.h_max(node))
+            actions = problem.actions(state)
+            state = problem.result(state, actions[(7 * i) % len(actions)])
+
+    def test_p1(self):
+        self.check(air_cargo_p1(), 10)
+        p1 = air_cargo_p1()
+        self.assertEqual(p1.h_add(Node(p1.initial)), 6)
+        # loading and flying are independent, so each unload costs max(1, 1) + 1
+        self.assertEqual(p1.h_max(Node(p1.initial)), 2)
+
+    def test_p2(self):
+        self.check(air_cargo_p2(), 5)
+
+    def test_p3(self):
+        self.check(air_cargo_p3(), 2)
+
+    def test_bitset(self):
+        p = air_cargo_p2(bitset=True)
+        self.check(p, 5)
+
+    def test_goal_reached(self):
+        p1 = air_cargo_p1(bitset=True)
+        goal_state = p1.fluent_index.mask(p1.goal)
+        self.assertEqual(p1.h_add(Node(goal_state)), 0)
+        self.assertEqual(p1.h_max(Node(goal_state)), 0)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,107 @@
+import os
+import sys
+parent = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(os.path.dirname(parent), "aimacode"))
+import unittest
+from aimacode.search import Node, greedy_best_first_graph_search, is_path_dependent
+from aimacode.utils import expr
+from example_have_cake import have_cake
+from my_air_cargo_problems import air_cargo_p1, air_cargo_p3
+from my_landmarks import LandmarkGraph, landmark_graph
+
+
+class TestHaveCakeLandmarks(unittest.TestCase):
+
+    def setUp(self):
+        self.p = have_cake()
+        self.lm = landmark_graph(self.p)
+
+    def test_landmarks(self):
+        self.assertIs(landmark_graph(self.p), self.lm)
+        self.assertEqual([self.lm.literals(j) for j in range(len(self.lm.landmarks))],
+                         [[(expr('Have(Cake)'), True)], [(expr('Eaten(Cake)'), True)]])
+        # Eat is the only way to Eaten(Cake), and it needs Have(Cake) first
+        self.assertEqual(self.lm.orderings, {(0, 1)})
+        self.assertEqual([[self.lm.template.actions[i].name for i in achievers]
+                          for achievers in self.lm.action_landmarks.values()], [['Eat']])
+
+    def test_landmark_count(self):
+        node = Node(self.p.initial)
+        self.assertEqual(self.p.h_landmark_count(node), 1)
+        eat, bake = self.p.actions_list
+        node = node.child_node(self.p, eat)
+        # Have(Cake) was accepted at the start, but it is a goal that Eat deleted
+        self.assertEqual(self.p.h_landmark_count(node), 1)
+        self.assertEqual(self.lm.accepted(node), 0b11)
+        node = node.child_node(self.p, bake)
+        self.assertEqual(self.p.h_landmark_count(node), 0)
+
+
+class TestAirCargoLandmarks(unittest.TestCase):
+
+    def setUp(self):
+        self.p1 = air_cargo_p1()
+        self.lm = LandmarkGraph(self.p1)
+
+    def test_landmarks(self):
+        landmarks = [self.lm.literals(j) for j in range(len(self.lm.landmarks))]
+        self.assertEqual(len(landmarks), 6)
+        self.assertIn([(expr('In(C1, P1)'), True), (expr('In(C1, P2)'), True)], landmarks)
+        self.assertIn([(expr('At(C1, SFO)'), True)], landmarks)
+        self.assertEqual(bin(self.lm.goal_landmarks).count('1'), len(self.p1.goal))
+
+    def test_landmarks_needed(self):
+        # without every action adding one of its literals, a landmark not true initially
+        # leaves some goal unreachable
+        goal_mask = self.lm.template.goal_mask
+        for mask in self.lm.landmarks:
+            if not mask & self.lm.initial:
+                self.assertNotEqual(self.lm.relaxed_reachable(mask) & goal_mask, goal_mask)
+
+    def test_orderings(self):
+        for i, j in self.lm.orderings:
+            for a in self.lm.action_landmarks[j]:
+                self.assertTrue(self.lm.template.pre_masks[a] & self.lm.landmarks[i])
+
+    def test_path_dependent(self):
+        # load C1, deliver it and bring it back: the state is the initial one again,
+        # but its landmarks were accepted on the way
+        root = node = Node(self.p1.initial)
+        for name, args in [('Load', 'C1 P1 SFO'), ('Fly', 'P1 SFO JFK'), ('Unload', 'C1 P1 JFK'),
+                           ('Load', 'C1 P1 JFK'), ('Fly', 'P1 JFK SFO'), ('Unload', 'C1 P1 SFO')]:
+            action = next(a for a in self.p1.actions(node.state)
+                          if a.name == name and ' '.join(map(str, a.args)) == args)
+            node = node.child_node(self.p1, action)
+        self.assertEqual(node.state, root.state)
+        self.assertNotEqual(self.lm.accepted(node), self.lm.accepted(root))
+        self.assertNotEqual(self.p1.h_landmark_count(node), self.p1.h_landmark_count(root))
+        # so a state-keyed cache would serve one path the count of the other
+        self.assertTrue(is_path_dependent(self.p1.h_landmark_count))
+        with self.assertRaises(ValueError):
+            self.p1.cached_heuristic(self.p1.h_landmark_count, 100)
+        self.p1.cached_heuristic(self.p1.h_1, 100)
+
+    def test_accepted_masks_released(self):
+        node = Node(self.p1.initial)
+        self.lm.accepted(node)
+        child = node.child_node(self.p1, self.p1.actions(node.state)[0])
+        self.lm.accepted(child)
+        self.assertEqual(len(self.lm.accepted_masks), 2)
+        self.assertFalse(hasattr(node, '__dict__'))
+        del node, child
+        self.assertEqual(len(self.lm.accepted_masks), 0)
+
+    def test_accepted_along_path(self):
+        p3 = air_cargo_p3()
+        node = greedy_best_first_graph_search(p3, p3.h_landmark_count)
+        self.assertTrue(p3.goal_test(node.state))
+        self.assertEqual(p3.h_landmark_count(node), 0)
+        lm = landmark_graph(p3)
+        all_landmarks = (1 << len(lm.landmarks)) - 1
+        self.assertEqual(lm.accepted(node), all_landmarks)
+        for n in node.path()[1:]:
+            self.assertEqual(lm.accepted(n) & lm.accepted(n.parent), lm.accepted(n.parent))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,154 @@
+import os
+import sys
+parent = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(os.path.dirname(parent), "aimacode"))
+import shutil
+import tempfile
+import unittest
+from aimacode.search import Node, astar_search
+from my_air_cargo_problems import air_cargo_p1, air_cargo_p2, air_cargo_problem
+from my_pattern_database import (
+    PATTERN_MAX_SIZE, PatternDatabase, PatternDatabaseHeuristic, air_cargo_patterns, air_cargo_variables,
+)
+
+
+class TestAirCargoPatterns(unittest.TestCase):
+
+    def setUp(self):
+        self.p2 = air_cargo_p2()
+
+    def test_variables(self):
+        variables = air_cargo_variables(self.p2)
+        self.assertEqual(list(variables), ['C1', 'C2', 'C3', 'P1', 'P2', 'P3'])
+        # three airports and three planes per cargo, three airports per plane
+        self.assertEqual([len(domain) for domain in variables.values()], [6, 6, 6, 3, 3, 3])
+        bits = self.p2.fluent_index.to_bits(self.p2.initial)
+        for domain in variables.values():
+            self.assertEqual(sum(1 for f in domain if bits & self.p2.fluent_index.bits[f]), 1)
+
+    def test_patterns(self):
+        self.assertEqual(air_cargo_patterns(self.p2),
+                         [('C1', 'C2', 'P1', 'P2', 'P3'), ('C3', 'P1', 'P2', 'P3')])
+        self.assertEqual(air_cargo_patterns(self.p2, 1, planes=False), [('C1',), ('C2',), ('C3',)])
+
+    def test_patterns_fit_max_size(self):
+        # cargo pairs have 6 * 6 values and each plane 3 more: drop planes until a pattern fits
+        self.assertEqual(air_cargo_patterns(self.p2, max_size=36 * 9),
+                         [('C1', 'C2', 'P1', 'P2'), ('C3', 'P1', 'P2', 'P3')])
+        self.assertEqual(air_cargo_patterns(self.p2, max_size=30), [('C1', 'P1'), ('C2', 'P1'), ('C3', 'P1')])
+        # eight planes at eight airports would be 8 ** 8 states per plane pattern
+        p = air_cargo_problem(4, 8, 8, seed=1)
+        for pattern in air_cargo_patterns(p):
+            PatternDatabase(p, pattern, max_size=PATTERN_MAX_SIZE)
+
+
+class TestPatternDatabase(unittest.TestCase):
+
+    def setUp(self):
+        self.p1 = air_cargo_p1()
+        self.bits = self.p1.fluent_index.to_bits(self.p1.initial)
+
+    def test_full_pattern_is_exact(self):
+        # the pattern of every variable is the problem itself
+        db = PatternDatabase(self.p1, air_cargo_variables(self.p1)).build()
+        self.assertEqual(db.size, 4 * 4 * 2 * 2)
+        self.assertEqual(db.table.typecode, 'B')
+        self.assertEqual(db.distance(self.bits), 6)
+
+    def test_cargo_pattern(self):
+        # without the planes a cargo at the wrong airport needs a load and an unload
+        db = PatternDatabase(self.p1, ['C1']).build()
+        self.assertEqual(db.size, 4)
+        self.assertEqual(db.distance(self.bits), 2)
+        self.assertEqual(sorted(db.table), [0, 1, 1, 2])
+
+    def test_unreachable(self):
+        p = air_cargo_problem(1, 1, 2, initial={'C1': 'A1', 'P1': 'A1'}, goal={'C1': 'A2'})
+        p.compiled_actions.masks = [m for m in p.compiled_actions.masks if m.action.name != 'Unload']
+        db = PatternDatabase(p, ['C1']).build()
+        self.assertEqual(db.distance(p.fluent_index.to_bits(p.initial)), float('inf'))
+
+    def test_save_load(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'pdb.bin')
+            db = PatternDatabase(self.p1, ['C1', 'P1']).build()
+            db.save(path)
+            loaded = PatternDatabase(self.p1, ['C1', 'P1'])
+            self.assertTrue(loaded.load(path))
+            self.assertEqual(loaded.table, db.table)
+            self.assertFalse(PatternDatabase(self.p1, ['C2', 'P1']).load(path))
+            self.assertFalse(loaded.load(os.path.join(directory, 'missing.bin')))
+        finally:
+            shutil.rmtree(directory)
+
+    def test_load_corrupt(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'pdb.bin')
+            db = PatternDatabase(self.p1, ['C1', 'P1']).build()
+            db.save(path)
+            with open(path, 'rb') as f:
+                saved = f.read()
+            header = saved[:saved.index(b'\n')]
+            corrupt = [saved[:-1], saved + b'\0', saved[:len(header) // 2], b'', b'\x80\x04junk',
+                       header.replace(b' B ', b' Q ') + saved[len(header):],
+                       header.replace(b' 8 ', b' x ') + saved[len(header):]]
+            for data in corrupt:
+                with open(path, 'wb') as f:
+                    f.write(data)
+                loaded = PatternDatabase(self.p1, ['C1', 'P1'])
+                self.assertFalse(loaded.load(path))
+                self.assertIsNone(loaded.table)
+            # the heuristic rebuilds the table rather than failing
+            os.replace(path, os.path.join(directory, 'pdb-{}.bin'.format(db.key)))
+            h = PatternDatabaseHeuristic(self.p1, [['C1', 'P1']], cache_dir=directory)
+            self.assertEqual(h.databases[0].table, db.table)
+        finally:
+            shutil.rmtree(directory)
+
+class TestPatternDatabaseHeuristic(unittest.TestCase):
+
+    def setUp(self):
+        self.p2 = air_cargo_p2()
+        self.bits = self.p2.fluent_index.to_bits(self.p2.initial)
+
+    def test_additive(self):
+        self.assertTrue(PatternDatabaseHeuristic(self.p2, air_cargo_patterns(self.p2, 1, planes=False)).additive)
+        self.assertFalse(PatternDatabaseHeuristic(self.p2, air_cargo_patterns(self.p2)).additive)
+        # each cargo is two moves away, and the sum of the patterns counts all of them
+        self.assertEqual(self.p2.h_pdb_additive(Node(self.p2.initial)), 6)
+
+    def test_groups(self):
+        # the cargo-only pairs add up; each pattern with the planes stands alone
+        h = self.p2.pattern_database()
+        self.assertEqual([db.pattern for db in h.databases],
+                         [('C1', 'C2'), ('C3',), ('C1', 'C2', 'P1', 'P2', 'P3'), ('C3', 'P1', 'P2', 'P3')])
+        self.assertEqual(h.groups, [[0, 1], [2], [3]])
+        distances = [db.distance(self.bits) for db in h.databases]
+        self.assertEqual(h(self.bits), max(distances[0] + distances[1], distances[2], distances[3]))
+
+    def test_admissible(self):
+        solution = astar_search(self.p2, self.p2.h_pdb).solution()
+        self.assertEqual(len(solution), 9)
+        self.assertLessEqual(self.p2.h_pdb(Node(self.p2.initial)), len(solution))
+        state = self.p2.initial
+        for step, action in enumerate(solution):
+            self.assertLessEqual(self.p2.h_pdb(Node(state)), len(solution) - step)
+            self.assertLessEqual(self.p2.h_pdb_additive(Node(state)), len(solution) - step)
+            state = self.p2.result(state, action)
+        self.assertEqual(self.p2.h_pdb(Node(state)), 0)
+
+    def test_cache_dir(self):
+        directory = tempfile.mkdtemp()
+        try:
+            cached = PatternDatabaseHeuristic(self.p2, air_cargo_patterns(self.p2), cache_dir=directory)
+            self.assertEqual(len(os.listdir(directory)), 2)
+            reused = PatternDatabaseHeuristic(self.p2, air_cargo_patterns(self.p2), cache_dir=directory)
+            self.assertEqual(reused(self.bits), cached(self.bits))
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    unittest.main()
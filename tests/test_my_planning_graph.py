@@ -3,12 +3,14 @@ import sys
 
 parent = os.path.dirname(os.path.realpath(__file__))
 sys.path.append(os.path.join(os.path.dirname(parent), "aimacode"))
+import random
 import unittest
 from aimacode.utils import expr
 from aimacode.planning import Action
 from example_have_cake import have_cake
+from my_air_cargo_problems import air_cargo_p1
 from my_planning_graph import (
-    PlanningGraph, PgNode_a, PgNode_s, mutexify
+    PlanningGraph, PgNode_a, PgNode_s, mutexify, planning_graph_template
 )
 
 
@@ -33,6 +35,21 @@ class TestPlanningGraphLevels(unittest.TestCase):
         self.assertEqual(len(self.pg.s_levels[2]), 4, len(self.pg.s_levels[2]))
 
 
+    def test_level_masks(self):
+        template = self.pg.template
+        self.assertEqual(len(self.pg.s_masks), len(self.pg.s_levels))
+        self.assertEqual(len(self.pg.a_masks), len(self.pg.a_levels))
+        for s_mask, nodeset in zip(self.pg.s_masks, self.pg.s_levels):
+            self.assertEqual({template.literals[l] for l in range(len(template.literals)) if s_mask >> l & 1},
+                             {(node.symbol, node.is_pos) for node in nodeset})
+        for a_mask, nodeset in zip(self.pg.a_masks, self.pg.a_levels):
+            self.assertEqual(bin(a_mask).count('1'), len(nodeset))
+            for node in nodeset:
+                self.assertTrue(node.parents <= self.pg.s_levels[self.pg.a_levels.index(nodeset)])
+                for other in node.mutex:
+                    self.assertIn(node, other.mutex)
+
+
 class TestPlanningGraphMutex(unittest.TestCase):
     def setUp(self):
         self.p = have_cake()
@@ -115,6 +132,62 @@ class TestPlanningGraphMutex(unittest.TestCase):
             "If one parent action can achieve both states, should NOT be inconsistent-support mutex, even if parent actions are themselves mutex")
 
 
+class TestPlanningGraphTemplate(unittest.TestCase):
+    def setUp(self):
+        self.p = have_cake()
+        self.template = planning_graph_template(self.p)
+
+    def test_template_shared(self):
+        self.assertIs(planning_graph_template(self.p), self.template)
+        pg1 = PlanningGraph(self.p, self.p.initial)
+        pg2 = PlanningGraph(self.p, self.p.initial)
+        self.assertIs(pg1.all_actions, pg2.all_actions)
+
+    def test_template_tables(self):
+        # two actions and a positive and a negative no-op per fluent
+        self.assertEqual(len(self.template.actions), 2 + 2 * len(self.p.state_map))
+        self.assertEqual(len(self.template.literals), 2 * len(self.p.state_map))
+        for fluent in self.p.state_map:
+            pos_id = self.template.literal_ids[(fluent, True)]
+            self.assertEqual(self.template.literal_ids[(fluent, False)], pos_id + 1)
+        for i, a in enumerate(self.template.actions):
+            self.assertEqual(self.template.prenodes[i], PgNode_a(a).prenodes)
+            self.assertEqual(self.template.effnodes[i], PgNode_a(a).effnodes)
+            for l in self.template.preconds[i]:
+                self.assertIn(i, self.template.consumers[l])
+
+
+    def test_interned_literals(self):
+        pg = PlanningGraph(self.p, self.p.initial)
+        for nodeset in pg.s_levels:
+            for node in nodeset:
+                l = self.template.literal_ids[(node.symbol, node.is_pos)]
+                self.assertIs(node.literal, self.template.literal_exprs[l])
+                self.assertEqual(node.literal, expr(('{}' if node.is_pos else '~{}').format(node.symbol)))
+                self.assertFalse(hasattr(node, '__dict__'))
+
+    def test_effects_of(self):
+        template = planning_graph_template(air_cargo_p1())
+        rng = random.Random(0)
+        for _ in range(50):
+            mask = rng.getrandbits(len(template.actions))
+            expected = 0
+            for i in range(len(template.actions)):
+                if mask >> i & 1:
+                    expected |= template.eff_masks[i]
+            self.assertEqual(template.effects_of(mask), expected)
+        self.assertEqual(template.effects_of(0), 0)
+
+    def test_static_mutex(self):
+        pg = PlanningGraph(self.p, self.p.initial)
+        nodes = [PgNode_a(a) for a in self.template.actions]
+        for i, n1 in enumerate(nodes):
+            for j, n2 in enumerate(nodes):
+                expected = i != j and (PlanningGraph.inconsistent_effects_mutex(pg, n1, n2) or
+                                       PlanningGraph.interference_mutex(pg, n1, n2))
+                self.assertEqual(bool(self.template.static_mutex[i] >> j & 1), expected)
+
+
 class TestPlanningGraphHeuristics(unittest.TestCase):
     def setUp(self):
         self.p = have_cake()
@@ -123,6 +196,70 @@ class TestPlanningGraphHeuristics(unittest.TestCase):
     def test_levelsum(self):
         self.assertEqual(self.pg.h_levelsum(), 1)
 
+    def test_relaxed_levelsum(self):
+        relaxed = PlanningGraph(self.p, self.p.initial, mutex=False)
+        self.assertEqual(relaxed.h_levelsum(), self.pg.h_levelsum())
+        # stops at the first level with every goal, without mutexes
+        self.assertEqual(len(relaxed.s_masks), 2)
+        self.assertFalse(any(node.mutex for nodeset in relaxed.s_levels + relaxed.a_levels for node in nodeset))
+
+    def test_maxlevel(self):
+        self.assertEqual(self.pg.h_maxlevel(), 1)
+
+    def test_setlevel(self):
+        # Have(Cake) and Eaten(Cake) are mutex in S1, as only Eat achieves Eaten(Cake)
+        self.assertEqual(self.pg.h_setlevel(), 2)
+        self.assertEqual(PlanningGraph(self.p, self.p.initial, stop_at_goals=True).h_setlevel(), 2)
+        # without mutexes set-level is max-level
+        self.assertEqual(PlanningGraph(self.p, self.p.initial, mutex=False).h_setlevel(), 1)
+
+    def test_ff(self):
+        self.assertEqual(self.pg.h_ff(), 1)
+        self.assertEqual(PlanningGraph(self.p, self.p.initial, mutex=False).h_ff(), 1)
+
+    def test_stop_at_goals(self):
+        pg = PlanningGraph(self.p, self.p.initial, stop_at_goals=True)
+        self.assertEqual(pg.h_levelsum(), self.pg.h_levelsum())
+        self.assertTrue(pg.goals_reached())
+        self.assertEqual(len(pg.s_masks), 2)
+
+    def test_cutoff(self):
+        pg = PlanningGraph(self.p, self.p.initial, cutoff=0)
+        self.assertEqual(len(pg.s_masks), 1)
+        self.assertFalse(pg.leveled)
+        # Eaten(Cake) is missing from S0, so it counts as appearing at S1
+        self.assertEqual(pg.h_levelsum(), 1)
+
+    def test_parent_reuse(self):
+        eat = self.p.actions_list[0]
+        child_state = self.p.result(self.p.initial, eat)
+        for mutex in (True, False):
+            parent = PlanningGraph(self.p, self.p.initial, mutex=mutex)
+            child = PlanningGraph(self.p, child_state, mutex=mutex, parent=parent)
+            full = PlanningGraph(self.p, child_state, mutex=mutex)
+            self.assertEqual((child.s_masks, child.a_masks, child.leveled), (full.s_masks, full.a_masks, full.leveled))
+            self.assertEqual((child.s_mutex, child.a_mutex), (full.s_mutex, full.a_mutex))
+            self.assertEqual(child.h_levelsum(), full.h_levelsum())
+        # after baking again, S1 (and its mutexes) is S1 of the graph after eating, so S2 is copied
+        parent = PlanningGraph(self.p, child_state)
+        child = PlanningGraph(self.p, self.p.result(child_state, self.p.actions_list[1]), parent=parent)
+        self.assertNotEqual(child.s_masks[0], parent.s_masks[0])
+        self.assertEqual(child.s_masks[1:], parent.s_masks[1:])
+        self.assertIs(child.s_mutex[2], parent.s_mutex[2])
+
+    def test_parent_reuse_incompatible(self):
+        parent = PlanningGraph(self.p, self.p.initial, stop_at_goals=True)
+        parent.h_setlevel()
+        self.assertFalse(PlanningGraph(self.p, self.p.initial).compatible(parent))
+        self.assertFalse(PlanningGraph(self.p, self.p.initial, mutex=False).compatible(self.pg))
+
+    def test_unreachable_goal(self):
+        p = have_cake()
+        p.actions_list = [a for a in p.actions_list if a.name != 'Eat']
+        pg = PlanningGraph(p, p.initial, mutex=False)
+        self.assertTrue(pg.leveled)
+        self.assertEqual(pg.h_levelsum(), float('inf'))
+
 
 if __name__ == '__main__':
     unittest.main()